@@ -0,0 +1,227 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+# Throughput and latency of the auth and API hot paths, running offline: the database is a temporary SQLite file,
+# Redis is replaced by fakeredis and the sensor API by sensor_stub, served on a free local port.
+# Requests go through the whole WSGI stack with the Flask test client, one client per thread.
+# Results can be appended to a file with --record, and compared with the last run of another commit with --compare.
+# The default results file is local to each checkout and ignored by git, another one can be given with --results-file.
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "flaskserver")
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+sys.path.insert(0, SERVER_DIR)
+
+import fakeredis
+from werkzeug.serving import make_server
+import main
+import sensor_stub
+from authorization import allow
+from models import Area, Machine, Role, Task, User, UserRole, db
+
+ROLES = ["Dipendente", "Titolare", "Amministratore di sistema"]
+PASSWORD = "benchmark"
+
+
+# Builds the application on a seeded SQLite database, with a user per thread.
+# Redis is replaced by fakeredis unless the configuration overrides set REDIS_URL.
+def create_app(args: argparse.Namespace, database_dir: str, sensor_url: str, overrides: dict[str, any] = None):
+    config = {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(database_dir, 'bench.db')}",
+        "SENSOR_API_URL": sensor_url,
+        "BCRYPT_LOG_ROUNDS": args.bcrypt_rounds,
+        "METRICS_ENABLED": not args.no_metrics,
+        "RATE_LIMIT_ENABLED": False,
+        "LOG_LEVEL": "WARNING",
+        **(overrides or {})
+    }
+    redis = fakeredis.FakeStrictRedis(decode_responses = True) if config.get("REDIS_URL") is None else None
+    app = main.create_app(config, redis = redis)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([Role(rolename = role) for role in ROLES] + [Area(id = 1)])
+        db.session.commit()
+        User.insert_many([{"username": f"bench_user_{index}", "password": PASSWORD} for index in range(args.concurrency)])
+        users = User.query.filter(User.username.like("bench_user_%")).all()
+        db.session.add_all([UserRole(user = user.id, role = "Dipendente") for user in users])
+        db.session.add_all([Task(area = 1, user = str(user.id), description = f"Task {index}", completed = index % 2 == 0)
+                            for user in users for index in range(args.tasks)])
+        db.session.add_all([Machine(area = 1, model = f"M{index}", serial = f"S{index:06}", type = "Lathe", manufacturer = "Acme",
+                                    width = 100, depth = 100, height = 100, weight = 500, purchase_year = "2020")
+                            for index in range(args.machines)])
+        db.session.commit()
+    return app
+
+# Serves the sensor API stub in a background thread, returning its URL
+def start_sensor_stub() -> str:
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, sensor_stub.app, threaded = True)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+# Logs in every thread's user, returning the clients and the tokens of each thread
+def login_users(app, concurrency: int) -> list[dict[str, any]]:
+    sessions = []
+    for index in range(concurrency):
+        client = app.test_client()
+        tokens = client.post("/login", data = {"username": f"bench_user_{index}", "password": PASSWORD}).get_json()
+        sessions.append({"index": index, "client": client, **tokens})
+    return sessions
+
+def bearer(token: str) -> dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
+
+
+# Scenarios, each sending one request with the session of a thread and returning whether it succeeded
+
+def login(app, session: dict[str, any]) -> bool:
+    return session["client"].post("/login", data = {"username": f"bench_user_{session['index']}", "password": PASSWORD}).status_code == 200
+
+def refresh(app, session: dict[str, any]) -> bool:
+    response = session["client"].post("/refresh", headers = bearer(session["refresh_token"]))
+    session["access_token"] = response.get_json()["access_token"]
+    return response.status_code == 200
+
+def user_data(app, session: dict[str, any]) -> bool:
+    return session["client"].get("/user-data", headers = bearer(session["access_token"])).status_code == 200
+
+def user_tasks(app, session: dict[str, any]) -> bool:
+    return session["client"].get("/user-tasks", query_string = {"area_id": 1}, headers = bearer(session["access_token"])).status_code == 200
+
+def machines(app, session: dict[str, any]) -> bool:
+    return session["client"].get("/machines", query_string = {"area_id": 1}, headers = bearer(session["access_token"])).status_code == 200
+
+def monitoring(app, session: dict[str, any]) -> bool:
+    # Closing the response releases the upstream connection and the stream slot, as a server would
+    with session["client"].get("/monitoring", query_string = {"count": 20}, headers = bearer(session["access_token"])) as response:
+        response.get_data()
+        return response.status_code == 200
+
+# The verify_token and allow decorator stack on its own, around a view doing nothing
+noop_view = allow(ROLES)(lambda: "ok")
+
+def decorators(app, session: dict[str, any]) -> bool:
+    with app.test_request_context("/", headers = bearer(session["access_token"])):
+        return noop_view() == "ok"
+
+# Refresh and login revoke the previous tokens of the user, so they run last
+SCENARIOS: dict[str, Callable[[any, dict[str, any]], bool]] = {
+    "decorators": decorators,
+    "user-data": user_data,
+    "user-tasks": user_tasks,
+    "machines": machines,
+    "monitoring": monitoring,
+    "refresh": refresh,
+    "login": login
+}
+
+
+# Sends "requests" requests split among the threads, returning the throughput and the latency percentiles
+def run(app, scenario: Callable, sessions: list[dict[str, any]], requests: int) -> dict[str, float]:
+    def worker(session: dict[str, any]) -> tuple[list[float], int]:
+        latencies, errors = [], 0
+        for _ in range(requests // len(sessions)):
+            start = time.perf_counter()
+            errors += not scenario(app, session)
+            latencies.append(time.perf_counter() - start)
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(sessions)) as executor:
+        results = list(executor.map(worker, sessions))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    percentile = lambda fraction: latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000
+    return {
+        "requests": len(latencies),
+        "errors": sum(result[1] for result in results),
+        "rps": len(latencies) / elapsed,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99)
+    }
+
+def report(name: str, result: dict[str, float], previous: dict[str, float] = None, tolerance: float = 0.1) -> bool:
+    change, regressed = "", False
+    if previous is not None:
+        ratio = result["rps"] / previous["rps"] - 1
+        regressed = ratio < -tolerance
+        change = f"   {ratio * 100:+6.1f}% rps{'  REGRESSION' if regressed else ''}"
+    print(f"{name:<12} {result['rps']:9.1f} rps   p50 {result['p50_ms']:7.2f} ms   p90 {result['p90_ms']:7.2f} ms   "
+          f"p99 {result['p99_ms']:7.2f} ms   errors {result['errors']}{change}")
+    return regressed
+
+
+# Current commit, marked as dirty if the tree has uncommitted changes
+def get_commit() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = SERVER_DIR, check = True,
+                                capture_output = True, text = True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd = SERVER_DIR, check = True,
+                               capture_output = True, text = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+# Returns the last recorded run of another commit with the same settings
+def load_previous(path: str, commit: str, settings: dict[str, any]) -> dict[str, any]:
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path) as file:
+        for line in file:
+            entry = json.loads(line)
+            if entry["commit"] != commit and entry["settings"] == settings:
+                previous = entry
+    return previous
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Auth and API hot path benchmark")
+    parser.add_argument("--requests", type = int, default = 2000, help = "requests per scenario")
+    parser.add_argument("--concurrency", type = int, default = 8)
+    parser.add_argument("--scenarios", nargs = "+", choices = SCENARIOS, default = list(SCENARIOS))
+    parser.add_argument("--tasks", type = int, default = 200, help = "tasks per user")
+    parser.add_argument("--machines", type = int, default = 500)
+    parser.add_argument("--bcrypt-rounds", type = int, default = 4)
+    parser.add_argument("--no-metrics", action = "store_true")
+    parser.add_argument("--record", action = "store_true", help = "append the results to the results file")
+    parser.add_argument("--compare", action = "store_true", help = "compare with the last recorded run of another commit")
+    parser.add_argument("--tolerance", type = float, default = 0.1, help = "throughput loss reported as a regression")
+    parser.add_argument("--results-file", default = RESULTS_FILE)
+    args = parser.parse_args()
+
+    settings = {key: getattr(args, key) for key in ("requests", "concurrency", "tasks", "machines", "bcrypt_rounds", "no_metrics")}
+    commit = get_commit()
+    previous = load_previous(args.results_file, commit, settings) if args.compare else None
+    if previous is not None:
+        print(f"Comparing {commit} with {previous['commit']}")
+
+    with tempfile.TemporaryDirectory() as database_dir:
+        app = create_app(args, database_dir, start_sensor_stub())
+        sessions = login_users(app, args.concurrency)
+
+        # A short warm-up fills the caches and the connection pools
+        results, regressions = {}, []
+        for name in args.scenarios:
+            run(app, SCENARIOS[name], sessions, args.concurrency * 5)
+            results[name] = run(app, SCENARIOS[name], sessions, args.requests)
+            if report(name, results[name], previous["results"].get(name) if previous else None, args.tolerance):
+                regressions.append(name)
+
+    if args.record:
+        with open(args.results_file, "a") as file:
+            file.write(json.dumps({"commit": commit, "time": time.time(), "python": platform.python_version(),
+                                   "settings": settings, "results": results}) + "\n")
+    sys.exit(1 if regressions else 0)
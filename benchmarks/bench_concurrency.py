@@ -0,0 +1,199 @@
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Throughput of the same gunicorn deployment with threaded workers ("gthread") and cooperative workers ("gevent"),
+# under many concurrent clients of a route waiting on Redis and on a slow sensor API. Both run the same number
+# of worker processes, and the peak resident memory of the workers is reported next to the throughput.
+# Redis is a fakeredis TCP server and the sensor API is sensor_stub, each in its own process, so that they
+# do not compete with the clients for the interpreter lock; the database is a temporary SQLite file.
+# Requires gunicorn, and gevent for the cooperative workers.
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(BENCHMARKS_DIR, os.pardir, "flaskserver")
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from bench_api import create_app, login_users
+
+REDIS_SERVER = """
+import sys
+from fakeredis import TcpFakeServer
+TcpFakeServer(("127.0.0.1", int(sys.argv[1])), server_type = "redis").serve_forever()
+"""
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# Waits until a server accepts connections on the port
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with status {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout = 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing is listening on port {port}")
+
+def start_process(command: list[str], port: int, **kwargs) -> subprocess.Popen:
+    process = subprocess.Popen(command, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, **kwargs)
+    wait_for_port(port, process)
+    return process
+
+def stop_process(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout = 30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# Resident memory of the worker processes of a gunicorn master, in bytes, or None outside of Linux
+def get_workers_rss(master_pid: int) -> int:
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as file:
+            pids = file.read().split()
+        rss = 0
+        for pid in pids:
+            with open(f"/proc/{pid}/status") as file:
+                rss += next(int(line.split()[1]) * 1024 for line in file if line.startswith("VmRSS:"))
+        return rss
+    except (OSError, StopIteration):
+        return None
+
+# Sends requests from "clients" threads, each with its own keep-alive connection, until "seconds" have elapsed.
+# Returns the throughput, the latency percentiles, the errors and the peak memory of the workers.
+def run_load(port: int, master_pid: int, path: str, tokens: list[str], clients: int, seconds: float) -> dict[str, float]:
+    latencies, errors, lock = [], [0], threading.Lock()
+    deadline = time.perf_counter() + seconds
+    start_barrier = threading.Barrier(clients + 1)
+
+    def client(index: int):
+        headers = {"Authorization": f"Bearer {tokens[index % len(tokens)]}"}
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout = 60)
+        start_barrier.wait()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path, headers = headers)
+                response = connection.getresponse()
+                response.read()
+                failed = response.status != 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                failed = True
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                errors[0] += failed
+        connection.close()
+
+    peak_rss = [None]
+    def sample_memory():
+        while time.perf_counter() < deadline:
+            rss = get_workers_rss(master_pid)
+            if rss is not None:
+                peak_rss[0] = max(peak_rss[0] or 0, rss)
+            time.sleep(0.25)
+
+    threads = [threading.Thread(target = client, args = (index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    start = time.perf_counter()
+    sampler = threading.Thread(target = sample_memory)
+    sampler.start()
+    for thread in threads:
+        thread.join()
+    sampler.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    percentile = lambda fraction: latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(0.5),
+        "p99_ms": percentile(0.99),
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "peak_rss_mb": peak_rss[0] / 2 ** 20 if peak_rss[0] is not None else None
+    }
+
+def report(name: str, result: dict[str, float]):
+    memory = f"{result['peak_rss_mb']:8.1f} MB" if result["peak_rss_mb"] is not None else "     n/a"
+    print(f"{name:<8} {result['rps']:9.1f} rps   p50 {result['p50_ms']:8.2f} ms   p99 {result['p99_ms']:8.2f} ms   "
+          f"errors {result['errors']:5}   workers RSS {memory}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Threaded and cooperative gunicorn workers under concurrent clients")
+    parser.add_argument("--workers", type = int, default = 2)
+    parser.add_argument("--threads", type = int, default = 64, help = "threads of each gthread worker")
+    parser.add_argument("--connections", type = int, default = 1000, help = "concurrent requests of each gevent worker")
+    parser.add_argument("--clients", type = int, default = 400)
+    parser.add_argument("--seconds", type = float, default = 20)
+    parser.add_argument("--path", default = "/monitoring?count=2&interval=1", help = "route requested by the clients")
+    parser.add_argument("--users", type = int, default = 16)
+    parser.add_argument("--modes", nargs = "+", choices = ["gthread", "gevent"], default = ["gthread", "gevent"])
+    args = parser.parse_args()
+    args.concurrency, args.tasks, args.machines, args.bcrypt_rounds, args.no_metrics = args.users, 20, 50, 4, True
+
+    redis_port, sensor_port = get_free_port(), get_free_port()
+    redis_url, sensor_url = f"redis://127.0.0.1:{redis_port}/0", f"http://127.0.0.1:{sensor_port}"
+    redis = start_process([sys.executable, "-c", REDIS_SERVER, str(redis_port)], redis_port)
+    sensor = start_process([sys.executable, "sensor_stub.py", "--port", str(sensor_port)], sensor_port, cwd = SERVER_DIR)
+
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as database_dir:
+            # The users are created and logged in here, the servers share the database file and Redis
+            app = create_app(args, database_dir, sensor_url, {"REDIS_URL": redis_url})
+            tokens = [session["access_token"] for session in login_users(app, args.users)]
+
+            environment = {
+                **os.environ,
+                "FLASKSERVER_SQLALCHEMY_DATABASE_URI": app.config["SQLALCHEMY_DATABASE_URI"],
+                "FLASKSERVER_REDIS_URL": redis_url,
+                "FLASKSERVER_SENSOR_API_URL": sensor_url,
+                "FLASKSERVER_SENSOR_API_MAX_STREAMS": str(max(args.threads, args.connections)),
+                "FLASKSERVER_RATE_LIMIT_ENABLED": "false",
+                "FLASKSERVER_METRICS_ENABLED": "false",
+                "FLASKSERVER_LOG_LEVEL": "WARNING",
+                "FLASKSERVER_WORKERS": str(args.workers),
+                "FLASKSERVER_THREADS": str(args.threads),
+                "FLASKSERVER_WORKER_CONNECTIONS": str(args.connections),
+                "PROMETHEUS_MULTIPROC_DIR": os.path.join(database_dir, "metrics")
+            }
+            for mode in args.modes:
+                port = get_free_port()
+                server = start_process([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"], port, cwd = SERVER_DIR,
+                                       env = {**environment, "FLASKSERVER_BIND": f"127.0.0.1:{port}", "FLASKSERVER_WORKER_CLASS": mode})
+                try:
+                    # A short warm-up loads the application in every worker and fills the connection pools
+                    run_load(port, server.pid, args.path, tokens, min(args.clients, 50), 1)
+                    results[mode] = run_load(port, server.pid, args.path, tokens, args.clients, args.seconds)
+                    report(mode, results[mode])
+                finally:
+                    stop_process(server)
+    finally:
+        stop_process(sensor)
+        stop_process(redis)
+
+    if "gthread" in results and "gevent" in results:
+        threaded, cooperative = results["gthread"], results["gevent"]
+        print(f"gevent serves {cooperative['rps'] / threaded['rps']:.2f}x the requests of gthread "
+              f"with {args.workers} workers of {args.connections} connections and {args.threads} threads")
+        if threaded["peak_rss_mb"] is not None and cooperative["peak_rss_mb"] is not None:
+            print(f"Peak workers RSS: gthread {threaded['peak_rss_mb']:.1f} MB, gevent {cooperative['peak_rss_mb']:.1f} MB")
@@ -0,0 +1,123 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+# Behavior of the protected routes while Redis goes down and comes back. Redis is a fakeredis TCP server on a free
+# local port, reached through the real connection pool, timeouts and circuit breaker of the application.
+# Requests are sent for a few seconds with Redis up, after killing it, and after restarting it with the same data,
+# then the statuses and latencies of each phase are checked against the chosen REDIS_DEGRADED_MODE:
+# "reject" must answer 503 quickly while Redis is down, "fallback" must keep answering 200.
+# Exits with 1 if any check fails.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "flaskserver"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakeredis import TcpFakeServer
+from bench_api import bearer, create_app, login_users, start_sensor_stub
+
+
+# Fakeredis server which can be killed and restarted on the same port, keeping its data as a real restart would
+class RedisStandIn:
+    def __init__(self):
+        self.server: TcpFakeServer = None
+        self.port = 0
+        self.data = None
+
+    def start(self):
+        self.server = TcpFakeServer(("127.0.0.1", self.port), server_type = "redis")
+        self.port = self.server.server_address[1]
+        if self.data is not None:
+            self.server.fake_server = self.data
+        self.data = self.server.fake_server
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+
+    # Closes the listening socket and every client connection
+    def kill(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+
+# Sends requests to a protected route from every session until "seconds" have elapsed,
+# returning the count of each status and the latencies
+def run_phase(sessions: list[dict[str, any]], seconds: float) -> tuple[Counter, list[float]]:
+    statuses, latencies, lock = Counter(), [], threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(session: dict[str, any]):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status = session["client"].get("/user-data", headers = bearer(session["access_token"])).status_code
+            with lock:
+                statuses[status] += 1
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target = worker, args = (session,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses, sorted(latencies)
+
+def report(name: str, statuses: Counter, latencies: list[float]):
+    percentile = lambda fraction: latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000
+    print(f"{name:<10} {len(latencies):6} requests   p50 {percentile(0.5):8.2f} ms   p99 {percentile(0.99):8.2f} ms   "
+          f"max {latencies[-1] * 1000:8.2f} ms   statuses {dict(sorted(statuses.items()))}")
+
+def check(description: str, passed: bool) -> bool:
+    print(f"{'PASS' if passed else 'FAIL'}  {description}")
+    return passed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Protected routes during a Redis outage")
+    parser.add_argument("--mode", choices = ["reject", "fallback"], default = "reject", help = "REDIS_DEGRADED_MODE")
+    parser.add_argument("--phase-seconds", type = float, default = 5)
+    parser.add_argument("--concurrency", type = int, default = 8)
+    parser.add_argument("--socket-timeout", type = float, default = 0.5)
+    parser.add_argument("--reset-timeout", type = int, default = 2, help = "REDIS_BREAKER_RESET_TIMEOUT")
+    parser.add_argument("--max-latency", type = float, default = 1.5, help = "slowest response allowed while Redis is down, in seconds")
+    args = parser.parse_args()
+    args.tasks, args.machines, args.bcrypt_rounds, args.no_metrics = 0, 0, 4, True
+
+    redis = RedisStandIn()
+    redis.start()
+    with tempfile.TemporaryDirectory() as database_dir:
+        app = create_app(args, database_dir, start_sensor_stub(), {
+            "REDIS_URL": redis.url,
+            "REDIS_DEGRADED_MODE": args.mode,
+            "REDIS_CONNECT_TIMEOUT": args.socket_timeout,
+            "REDIS_SOCKET_TIMEOUT": args.socket_timeout,
+            "REDIS_BREAKER_RESET_TIMEOUT": args.reset_timeout,
+            "LOG_LEVEL": "ERROR"
+        })
+        sessions = login_users(app, args.concurrency)
+
+        up = run_phase(sessions, args.phase_seconds)
+        report("up", *up)
+        redis.kill()
+        down = run_phase(sessions, args.phase_seconds)
+        report("down", *down)
+        redis.start()
+        # The circuit breaker lets a probe through once the reset timeout has elapsed
+        recovered = run_phase(sessions, max(args.phase_seconds, args.reset_timeout + 1))
+        report("recovered", *recovered)
+        final = run_phase(sessions, 1)
+        redis.kill()
+
+    down_status = 200 if args.mode == "fallback" else 503
+    results = [
+        check("every request succeeds while Redis is up", set(up[0]) == {200}),
+        check(f"every request answers {down_status} while Redis is down", set(down[0]) == {down_status}),
+        check(f"no request takes more than {args.max_latency} s while Redis is down", down[1][-1] <= args.max_latency),
+        check("requests succeed again once Redis is back", set(final[0]) == {200}),
+    ]
+    print(f"Most requests while down took {statistics.median(down[1]) * 1000:.2f} ms, the circuit breaker failing fast")
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,39 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures how long a cold worker takes to import the application and to build it through the factory,
+# as "wsgi.py" does. Each sample runs in a fresh interpreter.
+# Backends are connected lazily, so no Redis or database is needed.
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "flaskserver")
+
+SAMPLE = """
+import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app()
+print(imported - start, time.perf_counter() - imported)
+"""
+
+# Runs one cold start and returns the import time and the app creation time, in seconds
+def sample() -> tuple[float, float]:
+    output = subprocess.run([sys.executable, "-c", SAMPLE], cwd = SERVER_DIR, check = True,
+                            capture_output = True, text = True).stdout
+    import_seconds, create_seconds = output.strip().splitlines()[-1].split()
+    return float(import_seconds), float(create_seconds)
+
+def report(name: str, samples: list[float]):
+    samples = sorted(samples)
+    print(f"{name:<13} median {statistics.median(samples) * 1000:8.1f} ms   "
+          f"p90 {samples[int(len(samples) * 0.9) - 1] * 1000:8.1f} ms   max {samples[-1] * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Cold worker boot benchmark")
+    parser.add_argument("--runs", type = int, default = 20)
+    runs = [sample() for _ in range(parser.parse_args().runs)]
+    report("import main", [run[0] for run in runs])
+    report("create_app", [run[1] for run in runs])
+    report("total", [run[0] + run[1] for run in runs])
@@ -1,15 +1,29 @@
+import logging
 import flask
 from flask_jwt_extended import current_user as current_user_id
-import requests
 from authorization import allow, deny
 from authentication import verify_token
-from utilities import RedisUtils
-from models import Machine, PasswordTooShortException, Role, UsernameException
+from caching import ResponseCache
+from core import Context, InstrumentedQueuePool
+from hashing import PasswordHasher, PasswordHasherBusyException
+from proxy import SensorProxy
+from ratelimit import RateLimiter, rate_limit
+from streaming import EXPORT_FORMATS, build_export_response, compress_response, not_modified_response
+from utilities import CredentialCache, FlaskUtils, MachineCache, RedisUtils
+from models import BulkInsertConflictException, InvalidQueryException, InvalidRequestBodyException, Machine, PasswordTooShortException
+from models import Role, UsernameException
 from models import Task, User, UserRole
+from policies import PolicyRegistry
+from profiling import RequestProfiler
 
 # Define Blueprint
 bp = flask.Blueprint('api', __name__)
 
+logger = logging.getLogger(__name__)
+
+# Compresses the responses and answers conditional requests for JSON responses
+bp.after_request(compress_response)
+
 # Base route
 @bp.route('/')
 def test_connection():
@@ -25,10 +39,10 @@ def test_connection():
 @bp.route("/user-data", methods=["GET"])
 @verify_token()
 def user_data():
-    # Gets basic data
-    user_dict: dict[str, any] = User.get_current_user().__dict__
-    user_dict.pop("password")
-    user_dict.pop("_sa_instance_state")
+    # Gets basic data, without the password
+    user_dict: dict[str, any] = User.get_data_by_id(int(current_user_id))
+    if user_dict is None:
+        return flask.jsonify(msg = "User not found"), 404
 
     # Gets roles
     user_dict["role_list"] = RedisUtils.get_roles(current_user_id)
@@ -44,6 +58,7 @@ def update_username():
 
     try:
         User.get_current_user().update_username(username)
+        CredentialCache.invalidate([username])
         
     except UsernameException as exception:
         return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
@@ -63,20 +78,45 @@ def update_password():
     except PasswordTooShortException as exception:
         return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
 
+    except PasswordHasherBusyException as exception:
+        return (flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 503, 
+                {"Retry-After": exception.retry_after})
+
     return flask.jsonify(msg = "Password updated successfully"), 200
 
 # Get user tasks
 @bp.route("/user-tasks", methods=["GET"])
 @verify_token()
 def get_user_tasks():
-    return flask.jsonify(Task.get_by_user_id_and_area_id(current_user_id, flask.request.args.get("area_id"))), 200
+    args = flask.request.args
+    try:
+        area_id = FlaskUtils.get_int_arg(args, "area_id")
+    except InvalidQueryException as exception:
+        return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
+
+    if not FlaskUtils.is_page_request(args, ("completed",)):
+        return flask.jsonify(Task.get_rows_by_user_id_and_area_id(int(current_user_id), area_id)), 200
+
+    # Returns a page of the tasks, filtered and with the selected fields only
+    try:
+        cursor, limit, fields = FlaskUtils.get_page_args(args)
+        tasks, next_cursor = Task.get_page_by_user_id_and_area_id(
+            int(current_user_id), area_id, cursor, limit, fields, FlaskUtils.get_bool_arg(args, "completed"))
+
+    except InvalidQueryException as exception:
+        return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
+
+    return flask.jsonify(items = tasks, next_cursor = next_cursor), 200
 
 # Update user task
 @bp.route("/user-task-update", methods=["PUT"])
 @verify_token()
 def update_user_task_state():
     # Get the args
-    data: dict[str, any] = eval(flask.request.data.decode("utf-8"))
+    try:
+        data: dict[str, any] = FlaskUtils.get_body_object()
+    except InvalidRequestBodyException as exception:
+        return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
     task_id: int = data.get("task_id")
     completed: bool = data.get("completed")
 
@@ -84,7 +124,7 @@ def update_user_task_state():
     task: Task = Task.get_by_id(task_id)
 
     # A user is only allowed to edit his tasks
-    if task.user != current_user_id:
+    if task is None or str(task.user) != str(current_user_id):
         return flask.jsonify(msg = "Not allowed to modify the requested user task"), 403
 
     # Updates the task state in the database
@@ -93,6 +133,30 @@ def update_user_task_state():
     # Informs the use that the operation was successful
     return flask.jsonify(msg = "Task state updated successfully"), 200
 
+# Update the state of many user tasks at once, given as a JSON list of {"task_id", "completed"} objects
+@bp.route("/user-tasks-update", methods=["PUT"])
+@verify_token()
+def update_user_tasks_state():
+    # Get the args
+    try:
+        states: dict[int, bool] = {}
+        for item in FlaskUtils.get_body_rows(Context.app().config["BULK_UPDATE_MAX_ROWS"]):
+            task_id, completed = item.get("task_id"), item.get("completed")
+            if type(task_id) is not int or type(completed) is not bool:
+                raise InvalidRequestBodyException
+            states[task_id] = completed
+
+    except InvalidRequestBodyException as exception:
+        return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
+
+    # A user is only allowed to edit his tasks, so no task is updated if any of them belongs to someone else
+    rejected_ids = Task.set_completed_many(int(current_user_id), states)
+    if rejected_ids:
+        return flask.jsonify(msg = "Not allowed to modify the requested user tasks", task_ids = rejected_ids), 403
+
+    # Informs the use that the operation was successful
+    return flask.jsonify(msg = f"{len(states)} task states updated successfully"), 200
+
 # Create and save a new user in the database
 @bp.route("/insert-user", methods=["POST"])
 @allow(roles = ["Titolare", "Amministratore di sistema"])
@@ -113,6 +177,7 @@ def insert_user():
 
         # Insert new user
         new_user_id: int = User.insert(username, password)
+        CredentialCache.invalidate([username])
 
         # Insert new role if it is not None
         if rolename is not None:
@@ -127,13 +192,139 @@ def insert_user():
     except (UsernameException, PasswordTooShortException) as exception:
         return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
 
+    except PasswordHasherBusyException as exception:
+        return (flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 503, 
+                {"Retry-After": exception.retry_after})
+
     return flask.jsonify(msg = "User account created successfully"), 200
 
+# Create and save a batch of users, given as a JSON list or CSV document with
+# username, password and optional rolename fields
+@bp.route("/insert-users", methods=["POST"])
+@allow(roles = ["Titolare", "Amministratore di sistema"])
+def insert_users():
+    try:
+        reports = User.insert_many(FlaskUtils.get_body_rows(Context.app().config["BULK_INSERT_MAX_ROWS"]))
+
+    except InvalidRequestBodyException as exception:
+        return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
+
+    except BulkInsertConflictException as exception:
+        return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 409
+
+    except PasswordHasherBusyException as exception:
+        return (flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 503, 
+                {"Retry-After": exception.retry_after})
+
+    CredentialCache.invalidate([report["username"] for report in reports if "id" in report])
+    created = sum(1 for report in reports if "id" in report)
+    return flask.jsonify(msg = f"{created} of {len(reports)} user accounts created", results = reports), 200
+
 # Get machine data
 @bp.route("/machines", methods=["GET"])
 @allow(["Dipendente", "Titolare", "Amministratore di sistema"])
 def get_machines_by_area():
-    return flask.jsonify(Machine.get_by_area_id(flask.request.args.get("area_id"))), 200
+    args = flask.request.args
+    try:
+        area_id = FlaskUtils.get_int_arg(args, "area_id")
+    except InvalidQueryException as exception:
+        return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
+
+    if FlaskUtils.is_page_request(args, ("type", "manufacturer")):
+
+        # Returns a page of the machines, filtered and with the selected fields only
+        try:
+            cursor, limit, fields = FlaskUtils.get_page_args(args)
+            machines, next_cursor = Machine.get_page_by_area_id(
+                area_id, cursor, limit, fields, args.get("type", None), args.get("manufacturer", None))
+
+        except InvalidQueryException as exception:
+            return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
+
+        return flask.jsonify(items = machines, next_cursor = next_cursor), 200
+
+    machines = MachineCache.get_by_area_id(area_id)
+
+    # Answers 304 Not Modified if the client already has the current list, as told by the ETag only:
+    # the cache does not know when the machines last changed
+    response = not_modified_response(machines.etag)
+    if response is not None:
+        return response
+    response = flask.Response(machines.body, content_type = "application/json")
+    response.set_etag(machines.etag, weak = True)
+    return response
+
+# Get the statistics of the in-process caches of this worker
+@bp.route("/stats", methods=["GET"])
+@allow(["Amministratore di sistema"])
+def get_stats():
+    querying_cache = ResponseCache.for_route("api.querying")
+    return flask.jsonify(role_cache = RedisUtils.role_cache_invalidator().cache.stats(), 
+                         token_cache = RedisUtils.token_cache_invalidator().cache.stats(), 
+                         machine_cache = MachineCache.invalidator().cache.stats(), 
+                         password_hasher = PasswordHasher.stats(), 
+                         querying_cache = querying_cache.stats() if querying_cache is not None else None,
+                         sensor_api = SensorProxy.stats(), 
+                         rate_limiter = RateLimiter.stats(), 
+                         redis = Context.redis().circuit_breaker.stats() if getattr(Context.redis(), "circuit_breaker", None) else None,
+                         database_pools = {name or "default": engine.pool.stats() for name, engine in Context.db().engines.items()
+                                           if isinstance(engine.pool, InstrumentedQueuePool)}), 200
+
+# Get the compiled role policy of every route, for auditing
+@bp.route("/policies", methods=["GET"])
+@allow(["Amministratore di sistema"])
+def get_policies():
+    return flask.jsonify(role_ids = PolicyRegistry.role_ids(), routes = PolicyRegistry.dump(flask.current_app)), 200
+
+# Get the summaries of the profiled and slow requests captured by this worker
+@bp.route("/profiles", methods=["GET"])
+@allow(["Amministratore di sistema"])
+def get_profiles():
+    return flask.jsonify(RequestProfiler.get_captures()), 200
+
+# Get a captured request with its profile and its SQL and Redis calls
+@bp.route("/profiles/<int:capture_id>", methods=["GET"])
+@allow(["Amministratore di sistema"])
+def get_profile(capture_id: int):
+    capture = RequestProfiler.get_capture(capture_id)
+    if capture is None:
+        return flask.jsonify(msg = "Profile not found, it may have been evicted"), 404
+    return flask.jsonify(capture), 200
+
+
+# Export Routes
+
+# Streams every task of an area as NDJSON or CSV
+@bp.route("/export/tasks", methods=["GET"])
+@allow(["Titolare", "Amministratore di sistema"])
+def export_tasks():
+    export_format = flask.request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return flask.jsonify(msg = f"Bad request: format must be one of {', '.join(EXPORT_FORMATS)}"), 400
+
+    try:
+        area_id = FlaskUtils.get_int_arg(flask.request.args, "area_id")
+    except InvalidQueryException as exception:
+        return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
+
+    return build_export_response(Task.iter_by_area_id(area_id, Context.app().config["EXPORT_BATCH_SIZE"]),
+                                 Task.__table__.columns.keys(), export_format, f"tasks_area_{area_id}")
+
+# Streams every machine of an area as NDJSON or CSV
+@bp.route("/export/machines", methods=["GET"])
+@allow(["Dipendente", "Titolare", "Amministratore di sistema"])
+def export_machines():
+    export_format = flask.request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return flask.jsonify(msg = f"Bad request: format must be one of {', '.join(EXPORT_FORMATS)}"), 400
+
+    try:
+        area_id = FlaskUtils.get_int_arg(flask.request.args, "area_id")
+    except InvalidQueryException as exception:
+        return flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 400
+
+    return build_export_response(Machine.iter_by_area_id(area_id, Context.app().config["EXPORT_BATCH_SIZE"]),
+                                 Machine.__table__.columns.keys(), export_format, f"machines_area_{area_id}")
 
 
 # API Routes
@@ -141,26 +332,28 @@ def get_machines_by_area():
 # Route to access Monitoring API
 @bp.route("/monitoring", methods=["GET"])
 @allow(["Dipendente", "Titolare", "Amministratore di sistema"])
+@rate_limit
 def monitoring():
-    url = f"http://193.205.129.120:63429/api/data"
-    print(f"Sensor data requested from {url}")
+    logger.debug("Sensor data requested from %s/api/data", Context.app().config["SENSOR_API_URL"])
 
-    # Gets streams from API monitoring server
-    response = requests.get(url, flask.request.args, stream = True)
-    
     # Acts like a Proxy and returns same stream response
-    return flask.Response(response.iter_content(), content_type = response.headers['Content-Type'])
+    return SensorProxy.stream("/api/data", flask.request.args)
 
 # Route to access Querying API
 @bp.route("/querying", methods=["GET"])
 @allow(["Dipendente", "Titolare", "Amministratore di sistema"])
+@rate_limit
 def querying():
-    url = f"http://193.205.129.120:63429/api/data"
-    print(f"Sensor data requested from {url}")
-
-    # Gets streams from API querying server
-    response = requests.get(url, flask.request.args)
-    
-    # Acts like a Proxy and returns same stream response
-    return flask.Response(response, content_type = response.headers['Content-Type'])
-
+    logger.debug("Sensor data requested from %s/api/data", Context.app().config["SENSOR_API_URL"])
+
+    # Acts like a Proxy and returns same stream response if responses are not cached
+    cache = ResponseCache.for_route(flask.request.endpoint)
+    if cache is None:
+        return SensorProxy.stream("/api/data", flask.request.args)
+
+    # Identical queries are answered from the cache, with a single upstream request for concurrent misses
+    args = flask.request.args
+    response = cache.get_or_fetch(cache.get_key(args), lambda: SensorProxy.fetch("/api/data", args, cache.max_item_bytes))
+    if isinstance(response, flask.Response):
+        return response
+    return flask.Response(response.body, status = response.status, content_type = response.content_type)
@@ -2,15 +2,17 @@ from functools import wraps
 import flask
 from flask_jwt_extended import current_user as current_user_id, get_jwt, jwt_required
 from flask_jwt_extended.view_decorators import LocationType
-from models import User
-from core import Context
-from utilities import FlaskUtils, RedisUtils
+from models import UserCredentials
+from core import REDIS_UNAVAILABLE_ERRORS, Context
+from hashing import PasswordHasher, PasswordHasherBusyException
+from ratelimit import rate_limit
+from utilities import CredentialCache, FlaskUtils, RedisUtils
 
 # Define Blueprint
 bp = flask.Blueprint('authentication', __name__)
 
-# Get the references to JWT and Redis
-jwt = Context().jwt()
+# Get the reference to JWT, bound to the application when it is created
+jwt = Context.jwt()
 
 
 # Callbacks
@@ -29,6 +31,25 @@ def user_lookup_callback(_jwt_header, jwt_data) -> int:
     return jwt_data["sub"]
 
 
+# Answers with a 503 instead of a 500 when Redis is unavailable, on every route of the application,
+# asking to retry once the circuit breaker will let calls through again
+def redis_unavailable(exception: Exception):
+    return (flask.jsonify(msg = "Service temporarily unavailable, retry later", exceptionType = exception.__class__.__name__), 503,
+            {"Retry-After": Context.app().config["REDIS_BREAKER_RESET_TIMEOUT"]})
+
+for error in REDIS_UNAVAILABLE_ERRORS:
+    bp.app_errorhandler(error)(redis_unavailable)
+
+
+# Tells whether the token of the current request has been revoked or has expired, its jti not being
+# the one stored in Redis anymore. The roles are fetched in the same round trip and cached for the
+# authorization check. If Redis is unavailable, the token is only accepted in the fallback degraded mode.
+def is_token_revoked(refresh: bool = False) -> bool:
+    jti_provided = get_jwt().get("jti", None)
+    jti_in_redis, _roles = RedisUtils.get_token_and_roles(current_user_id, refresh, default = jti_provided)
+    return jti_in_redis is None or jti_in_redis != jti_provided
+
+
 # Decorators
 
 # Function to check if a provided JWT is valid and exists in the redis database (not revoked)
@@ -57,11 +78,7 @@ def verify_token(
                 return f(*args, **kwargs)
 
             # Checking if token is revoked
-            # Getting the jti of the access or refresh token - it is not present in Redis if revoked or expired
-            jti_in_redis = (RedisUtils.get_refresh_token(current_user_id) if refresh 
-                              else RedisUtils.get_access_token(current_user_id))
-
-            if jti_in_redis is None or jti_in_redis != jti_provided:  # Must evaluate to TRUE if revoked
+            if is_token_revoked(refresh):
                 return flask.jsonify(message = "Token has been revoked"), 401
             return f(*args, **kwargs)
         return decorator_function
@@ -72,6 +89,7 @@ def verify_token(
 
 # Login route
 @bp.route('/login', methods=['POST'])
+@rate_limit
 def login():
 
     # Get the args
@@ -79,15 +97,20 @@ def login():
     username = args.get("username", None)
     password = args.get("password", None)
 
-    user: User = User.get_by_username(username)
+    # The credentials and the roles are read with a single query
+    user: UserCredentials = CredentialCache.get_by_username(username)
 
-    if user is not None and Context.bcrypt().check_password_hash(user.password, password):
+    try:
+        password_matches = user is not None and PasswordHasher.check_password_hash(user.password, password)
+    except PasswordHasherBusyException as exception:
+        return (flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 503, 
+                {"Retry-After": exception.retry_after})
 
-        # Creates and stores\overrides the access token and refresh token
-        access_token, refresh_token = FlaskUtils.generate_tokens(user.id, True)  # Fresh access token
+    if password_matches:
 
-        # Saves user roles that are stored in SQL database in Redis
-        FlaskUtils.cache_roles_in_redis(user.id)
+        # Creates and stores\overrides the access token and refresh token, 
+        # saving the user roles that are stored in SQL database in Redis within the same round trip if they changed
+        access_token, refresh_token = FlaskUtils.generate_tokens(user.id, True, user.roles)  # Fresh access token
 
         return flask.jsonify(access_token = access_token, refresh_token = refresh_token), 200
 
@@ -99,6 +122,7 @@ def login():
 # this will only return a new access token, so that we don't keep
 # generating new refresh tokens, which entirely defeats their point.
 @bp.route('/fresh-login', methods=['POST'])
+@rate_limit
 def fresh_login():
     
     # Get the args
@@ -106,15 +130,20 @@ def fresh_login():
     username = args.get("username", None)
     password = args.get("password", None)
 
-    user: User = User.get_by_username(username)
+    # The credentials and the roles are read with a single query
+    user: UserCredentials = CredentialCache.get_by_username(username)
 
-    if user is not None and Context.bcrypt().check_password_hash(user.password, password):
+    try:
+        password_matches = user is not None and PasswordHasher.check_password_hash(user.password, password)
+    except PasswordHasherBusyException as exception:
+        return (flask.jsonify(msg = exception.message, exceptionType = exception.__class__.__name__), 503, 
+                {"Retry-After": exception.retry_after})
 
-        # Creates and stores\overrides the access token
-        access_token = FlaskUtils.generate_access_token(user.id, True)  # Fresh access token
-        
-        # Saves user roles that are stored in SQL database in Redis
-        FlaskUtils.cache_roles_in_redis(user.id)
+    if password_matches:
+
+        # Creates and stores\overrides the access token, 
+        # saving the user roles that are stored in SQL database in Redis within the same round trip if they changed
+        access_token = FlaskUtils.generate_access_token(user.id, True, user.roles)  # Fresh access token
 
         return flask.jsonify(access_token = access_token), 200
 
@@ -137,10 +166,7 @@ def refresh():
 @bp.route("/logout", methods=["DELETE"])
 @verify_token()
 def logout():
-    # Revokes both the access and the refresh tokens
-    RedisUtils.delete_tokens(current_user_id)
-
-    # Deletes the list of roles of the user
-    RedisUtils.delete_roles(current_user_id)
+    # Revokes both the access and the refresh tokens and deletes the list of roles of the user
+    RedisUtils.delete_session(current_user_id)
 
     return flask.jsonify(msg = "Access and refresh tokens revoked")
\ No newline at end of file
@@ -1,16 +1,49 @@
 from functools import wraps
+from typing import Iterable
 import flask
-from flask_jwt_extended import current_user as current_user_id, get_jwt
+from flask_jwt_extended import current_user as current_user_id, get_jwt, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
 from flask_jwt_extended.view_decorators import LocationType
-from authentication import verify_token
+from jwt.exceptions import PyJWTError
+from authentication import is_token_revoked, verify_token
+from policies import PolicyRegistry, RolePolicy
 from utilities import RedisUtils
 
 
+# Returns the roles of the current user, taken from the claims of the token as long as
+# their version is still the current one, otherwise from Redis. Only the version is looked up
+# while the claims are current.
+def get_current_roles() -> list[str]:
+    claims = get_jwt()
+    role_version = claims.get("role_version")
+    if role_version is not None and role_version == RedisUtils.get_role_version(current_user_id):
+        return claims["roles"]
+    return RedisUtils.get_roles(current_user_id)
+
+
+# Tells whether the roles of the current user pass "policy". Requests without a token pass,
+# the token being required or not by the verify_token decorator.
+def check_roles(policy: RolePolicy) -> bool:
+    if get_jwt().get("jti", None) is None:
+        return True
+    return policy.permits(get_current_roles())
+
+
+# Tells whether the current request carries a valid token of a user with at least one of "roles",
+# going through the same checks as the allow decorator. Can be called outside of a view.
+def is_allowed(roles: Iterable[str]) -> bool:
+    try:
+        verify_jwt_in_request()
+    except (JWTExtendedException, PyJWTError):
+        return False
+    return not is_token_revoked() and check_roles(PolicyRegistry.compile(PolicyRegistry.ALLOW, roles))
+
+
 # Decorators
 
 # Grants access to users with at least one of "roles"
 def allow(
-        roles: list[str] = [],
+        roles: Iterable[str] = (),
         optional: bool = False,
         fresh: bool = False, 
         refresh: bool = False, 
@@ -18,25 +51,23 @@ def allow(
         verify_type: bool = True,
         skip_revocation_check: bool = False
         ):
+    policy = PolicyRegistry.compile(PolicyRegistry.ALLOW, roles)
+
     def decorator(f):
         @wraps(f)
         @verify_token(optional, fresh, refresh, locations, verify_type, skip_revocation_check)
         def decorator_function(*args, **kwargs):
-            # Check authorization only if token is provided
-            if get_jwt().get("jti", None) is None:
-                return f(*args, **kwargs) 
-
-            # Checking user role
-            for user_role in RedisUtils.get_roles(current_user_id):
-                if user_role in roles:
-                    return f(*args, **kwargs)
+            # Checking user role, only if token is provided
+            if check_roles(policy):
+                return f(*args, **kwargs)
             return flask.jsonify(msg = "Forbidden"), 403
+        decorator_function.role_policy = policy
         return decorator_function
     return decorator
 
 # Denies access to users with at least one of "roles"
 def deny(
-        roles: list[str] = [],
+        roles: Iterable[str] = (),
         optional: bool = False,
         fresh: bool = False, 
         refresh: bool = False, 
@@ -44,18 +75,16 @@ def deny(
         verify_type: bool = True,
         skip_revocation_check: bool = True  # Recommended method not implemented because it is based on a blocklist
         ):
+    policy = PolicyRegistry.compile(PolicyRegistry.DENY, roles)
+
     def decorator(f):
         @wraps(f)
         @verify_token(optional, fresh, refresh, locations, verify_type, skip_revocation_check)
         def decorator_function(*args, **kwargs):
-            # Check authorization only if token is provided
-            if get_jwt().get("jti", None) is None:
-                return f(*args, **kwargs) 
-
-            # Checking user role
-            for user_role in RedisUtils.get_roles(current_user_id):
-                if user_role in roles:
-                    return flask.jsonify(msg = "Forbidden"), 403
-            return f(*args, **kwargs)
+            # Checking user role, only if token is provided
+            if check_roles(policy):
+                return f(*args, **kwargs)
+            return flask.jsonify(msg = "Forbidden"), 403
+        decorator_function.role_policy = policy
         return decorator_function
     return decorator
\ No newline at end of file
@@ -0,0 +1,311 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from concurrent.futures import Future
+from hashlib import sha1
+from threading import Lock
+from typing import Callable, NamedTuple
+from urllib.parse import urlencode
+import json
+import logging
+import os
+import time
+from redis import RedisError, StrictRedis
+from werkzeug.datastructures import MultiDict
+from werkzeug.wrappers import Response
+from core import Context
+
+logger = logging.getLogger(__name__)
+
+# Sentinel used to tell a cache miss apart from a cached None
+_MISSING = object()
+
+
+# Bounded in-process cache with a time to live and LRU eviction
+class LRUCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__entries: OrderedDict[str, tuple[float, any]] = OrderedDict()
+        self.__lock = Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    # Returns the cached value, or default if it is missing or expired
+    def get(self, key: str, default: any = None) -> any:
+        with self.__lock:
+            entry = self.__entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self.__entries.move_to_end(key)
+                    self.__hits += 1
+                    return value
+                del self.__entries[key]
+            self.__misses += 1
+            return default
+
+    # Stores a value, evicting the least recently used entries if the cache is full
+    def set(self, key: str, value: any) -> None:
+        if self.max_size <= 0:
+            return
+        with self.__lock:
+            self.__entries[key] = (time.monotonic() + self.ttl, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last = False)
+                self.__evictions += 1
+
+    # Removes a single entry
+    def delete(self, key: str) -> None:
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    # Removes every entry
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+    # Returns the cached value, or stores and returns the value built by the loader
+    def get_or_set(self, key: str, loader: Callable[[], any]) -> any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    # Returns the size and the hit/miss counters of the cache
+    def stats(self) -> dict[str, int | float]:
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                "size": len(self.__entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "evictions": self.__evictions,
+                "hit_ratio": self.__hits / lookups if lookups else 0.0
+            }
+
+
+# Propagates the invalidations of an LRUCache to every worker process through Redis pub/sub
+class CacheInvalidator:
+    CLEAR_ALL: str = "*"
+    # Seconds to wait before subscribing again after a failure
+    RETRY_INTERVAL: float = 5.0
+
+    def __init__(self, cache: LRUCache, channel: str):
+        self.cache = cache
+        self.channel = channel
+        self.__pid: int = None
+        self.__thread = None
+        self.__retry_at: float = 0.0
+        self.__lock = Lock()
+
+    # Starts the subscriber thread once per process, since threads do not survive a fork.
+    # While Redis is unavailable, subscribing is retried at most every RETRY_INTERVAL seconds
+    # instead of on every call, and the entries only live until their time to live.
+    def listen(self, redis: StrictRedis) -> None:
+        if self.__pid == os.getpid() or time.monotonic() < self.__retry_at:
+            return
+        circuit_breaker = getattr(redis, "circuit_breaker", None)
+        if circuit_breaker is not None and circuit_breaker.is_open():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            pubsub = redis.pubsub(ignore_subscribe_messages = True)
+            try:
+                pubsub.subscribe(**{self.channel: self.__on_message})
+            except RedisError as exception:
+                logger.warning("Could not subscribe to %s: %s", self.channel, exception)
+                pubsub.close()
+                self.cache.clear()
+                self.__retry_at = time.monotonic() + self.RETRY_INTERVAL
+                return
+            self.__thread = pubsub.run_in_thread(sleep_time = 1, daemon = True, exception_handler = self.__on_error)
+            self.__pid = os.getpid()
+
+    # Stops the subscriber thread of this process, if any. The thread closes its connection once stopped.
+    def close(self) -> None:
+        with self.__lock:
+            if self.__thread is not None and self.__pid == os.getpid():
+                self.__thread.stop()
+            self.__thread = None
+            self.__pid = None
+
+    # Invalidates a key in this process and in every other subscribed process
+    def invalidate(self, redis: StrictRedis, key: str = CLEAR_ALL) -> None:
+        self.__on_message({"data": key})
+        redis.publish(self.channel, key)
+
+    def __on_message(self, message: dict[str, any]) -> None:
+        if message["data"] == self.CLEAR_ALL:
+            self.cache.clear()
+        else:
+            self.cache.delete(message["data"])
+
+    # Invalidations may have been missed while disconnected, so the whole cache is dropped
+    # and the subscriber is restarted on the next call to listen
+    def __on_error(self, _exception: Exception, pubsub, thread) -> None:
+        self.cache.clear()
+        thread.stop()
+        pubsub.close()
+        self.__pid = None
+
+
+# Serialized JSON body, stored along with the ETag validating conditional requests
+class CachedJSON(NamedTuple):
+    body: bytes
+    etag: str
+
+
+# Serializes a JSON response body once, so that it can be cached and validated with an ETag
+def build_cached_json(data: any) -> CachedJSON:
+    json_provider = Context.app().json
+    body = json_provider.dumps_bytes(data) if hasattr(json_provider, "dumps_bytes") else json_provider.dumps(data).encode("utf-8")
+    return CachedJSON(body, sha1(body).hexdigest())
+
+
+# Response stored by a ResponseCache
+class CachedResponse(NamedTuple):
+    status: int
+    content_type: str
+    body: bytes
+
+
+# Cache of whole responses of a route, stored in Redis so that it is shared by every worker.
+# Falls back to an in-process LRUCache if Redis is not configured or not reachable.
+# Concurrent misses on the same key within a process wait for a single upstream fetch.
+class ResponseCache:
+    __routes: dict[str, "ResponseCache"] = {}
+    __routes_lock: Lock = Lock()
+
+    def __init__(self, name: str, ttl: int, max_size: int, max_item_bytes: int, redis: StrictRedis = None):
+        self.name = name
+        self.ttl = ttl
+        self.max_item_bytes = max_item_bytes
+        self.redis = redis
+        self.memory = LRUCache(max_size, ttl)
+        self.__in_flight: dict[str, Future] = {}
+        self.__lock = Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__coalesced = 0
+        self.__redis_errors = 0
+
+    # Forgets the caches of the routes, built from the configuration of the former application
+    @classmethod
+    def reset(cls):
+        with cls.__routes_lock:
+            cls.__routes = {}
+
+    # Returns the cache of a route, or None if the route has no TTL in RESPONSE_CACHE_TTLS
+    @classmethod
+    def for_route(cls, endpoint: str) -> "ResponseCache":
+        with cls.__routes_lock:
+            if endpoint not in cls.__routes:
+                config = Context.app().config
+                ttl = config["RESPONSE_CACHE_TTLS"].get(endpoint, 0)
+                cls.__routes[endpoint] = ResponseCache(
+                    endpoint, ttl, config["RESPONSE_CACHE_SIZE"], config["RESPONSE_CACHE_MAX_ITEM_BYTES"],
+                    Context.redis() if config["RESPONSE_CACHE_BACKEND"] == "redis" else None
+                ) if ttl > 0 else None
+            return cls.__routes[endpoint]
+
+    # Generates the cache key from the query string arguments, regardless of their order
+    def get_key(self, args: MultiDict) -> str:
+        query = urlencode(sorted(args.items(multi = True)))
+        return f"response_cache:{self.name}:{sha1(query.encode('utf-8')).hexdigest()}"
+
+    # Returns the cached response, or None
+    def get(self, key: str) -> CachedResponse:
+        response = self.__redis_get(key) if self.redis is not None else None
+        if response is None:
+            response = self.memory.get(key)
+        with self.__lock:
+            if response is None:
+                self.__misses += 1
+            else:
+                self.__hits += 1
+        return response
+
+    # Stores a response if it is successful and small enough
+    def set(self, key: str, response: CachedResponse) -> None:
+        if response.status != 200 or len(response.body) > self.max_item_bytes:
+            return
+        if self.redis is None or not self.__redis_set(key, response):
+            self.memory.set(key, response)
+
+    # Returns the cached response, or calls fetch once for all the concurrent misses on the same key.
+    # Fetch may also return a streamed response, which is neither cached nor shared: each waiting
+    # request then calls fetch on its own.
+    def get_or_fetch(self, key: str, fetch: Callable[[], CachedResponse | Response]) -> CachedResponse | Response:
+        response = self.get(key)
+        if response is not None:
+            return response
+
+        with self.__lock:
+            future = self.__in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.__in_flight[key] = Future()
+            else:
+                self.__coalesced += 1
+
+        if not leader:
+            response = future.result()
+            return response if response is not None else fetch()
+
+        try:
+            response = fetch()
+            if isinstance(response, CachedResponse):
+                self.set(key, response)
+                future.set_result(response)
+            else:
+                future.set_result(None)
+            return response
+        except BaseException as exception:
+            future.set_exception(exception)
+            raise
+        finally:
+            with self.__lock:
+                del self.__in_flight[key]
+
+    # Returns the hit/miss counters of the cache
+    def stats(self) -> dict[str, int | float]:
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                "backend": "redis" if self.redis is not None else "memory",
+                "ttl": self.ttl,
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "coalesced": self.__coalesced,
+                "redis_errors": self.__redis_errors,
+                "hit_ratio": self.__hits / lookups if lookups else 0.0,
+                "memory": self.memory.stats()
+            }
+
+    def __redis_get(self, key: str) -> CachedResponse:
+        try:
+            value = self.redis.get(key)
+        except RedisError:
+            with self.__lock:
+                self.__redis_errors += 1
+            return None
+        if value is None:
+            return None
+        status, content_type, body = json.loads(value)
+        return CachedResponse(status, content_type, b64decode(body))
+
+    def __redis_set(self, key: str, response: CachedResponse) -> bool:
+        try:
+            self.redis.set(key, json.dumps([response.status, response.content_type, b64encode(response.body).decode("ascii")]),
+                           ex = self.ttl)
+            return True
+        except RedisError:
+            with self.__lock:
+                self.__redis_errors += 1
+            return False
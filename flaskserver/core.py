@@ -1,9 +1,33 @@
 from datetime import timedelta
-from flask import Flask
+from threading import Lock
+import json
+import logging
+import os
+import sys
+import time
+from typing import Callable
+from flask import Flask, Response, current_app, g, has_request_context
 from flask_jwt_extended import JWTManager
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import Executable
 from flask_bcrypt import Bcrypt
-from redis import StrictRedis
+from redis import BlockingConnectionPool, StrictRedis
+from redis.backoff import ExponentialBackoff
+from redis.client import Pipeline
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from redis.retry import Retry
+from werkzeug.middleware.proxy_fix import ProxyFix
+from metrics import Metrics
+from serialization import OrjsonProvider
+
+logger = logging.getLogger(__name__)
+
+# Sentinel used to tell a missing value apart from a memoized None
+_MISSING = object()
 
 
 # Singleton metaclass
@@ -15,30 +39,325 @@ class SingletonMeta(type):
         return cls._instances[cls]
 
 
+# Values memoized for the duration of a request, and counters of the backend calls made by it.
+# Both are stored on flask.g, and nothing is memoized or counted outside of a request.
+class RequestScope:
+    CACHE_ATTRIBUTE: str = "request_cache"
+    COUNTERS_ATTRIBUTE: str = "request_counters"
+    COUNTERS_HEADER: str = "X-Request-Counters"
+    TRACE_ATTRIBUTE: str = "request_trace"
+
+    # Returns the value memoized for the current request, or default
+    @classmethod
+    def get(cls, key: tuple, default: any = None) -> any:
+        if not has_request_context():
+            return default
+        return g.get(cls.CACHE_ATTRIBUTE, {}).get(key, default)
+
+    @classmethod
+    def set(cls, key: tuple, value: any) -> None:
+        if has_request_context():
+            g.setdefault(cls.CACHE_ATTRIBUTE, {})[key] = value
+
+    # Drops memoized values, once the data they were loaded from has been changed
+    @classmethod
+    def forget(cls, *keys: tuple) -> None:
+        if has_request_context():
+            cache: dict[tuple, any] = g.get(cls.CACHE_ATTRIBUTE, {})
+            for key in keys:
+                cache.pop(key, None)
+
+    # Returns the value memoized for the current request, or memoizes the value built by the loader
+    @classmethod
+    def memoize(cls, key: tuple, loader: Callable[[], any]) -> any:
+        value = cls.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            cls.set(key, value)
+        return value
+
+    # Counts the calls made to a backend by the current request
+    @classmethod
+    def count(cls, backend: str, calls: int = 1) -> None:
+        if has_request_context():
+            counters: dict[str, int] = g.setdefault(cls.COUNTERS_ATTRIBUTE, {})
+            counters[backend] = counters.get(backend, 0) + calls
+
+    # Returns the number of calls made to each backend by the current request
+    @classmethod
+    def counters(cls) -> dict[str, int]:
+        return dict(g.get(cls.COUNTERS_ATTRIBUTE, {})) if has_request_context() else {}
+
+    # Starts recording the backend calls of the current request with their timings, up to max_calls
+    @classmethod
+    def start_trace(cls, max_calls: int) -> None:
+        setattr(g, cls.TRACE_ATTRIBUTE, {"max_calls": max_calls, "dropped": 0, "calls": []})
+
+    # Records a backend call, if the current request is being traced
+    @classmethod
+    def trace(cls, backend: str, description: str, seconds: float) -> None:
+        trace: dict[str, any] = g.get(cls.TRACE_ATTRIBUTE) if has_request_context() else None
+        if trace is None:
+            return
+        if len(trace["calls"]) < trace["max_calls"]:
+            trace["calls"].append({"backend": backend, "call": description, "seconds": seconds})
+        else:
+            trace["dropped"] += 1
+
+    # Returns the backend calls recorded for the current request, or None if it is not traced
+    @classmethod
+    def get_trace(cls) -> dict[str, any]:
+        return g.get(cls.TRACE_ATTRIBUTE) if has_request_context() else None
+
+    # Adds the counters of the request to the response, e.g. "X-Request-Counters: db=2, redis=1",
+    # if REQUEST_COUNTERS_HEADER is enabled. Streamed responses only include the calls made before streaming.
+    @classmethod
+    def add_counters_header(cls, response: Response) -> Response:
+        if current_app.config["REQUEST_COUNTERS_HEADER"]:
+            counters = cls.counters()
+            response.headers[cls.COUNTERS_HEADER] = ", ".join(f"{backend}={counters.get(backend, 0)}" for backend in ("db", "redis"))
+        return response
+
+
+# Counts and times the statements sent to the database
+@event.listens_for(Engine, "before_cursor_execute")
+def count_database_statement(connection, _cursor, _statement, _parameters, _context, _executemany):
+    RequestScope.count("db")
+    connection.info.setdefault("statement_starts", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def time_database_statement(connection, _cursor, statement, _parameters, _context, _executemany):
+    seconds = time.perf_counter() - connection.info["statement_starts"].pop()
+    Metrics.observe_backend("sql", seconds)
+    RequestScope.trace("sql", statement, seconds)
+
+@event.listens_for(Engine, "handle_error")
+def discard_database_statement(context):
+    if context.connection is not None and context.connection.info.get("statement_starts"):
+        context.connection.info["statement_starts"].pop()
+
+
+# Circuit breaker failing fast once a backend has failed "threshold" times in a row. Calls are rejected with
+# open_error for "reset_timeout" seconds, then a single call is let through to probe the backend,
+# closing the circuit if it succeeds. Only the exceptions in failure_types count as failures,
+# unless they are in ignored_types, which say nothing about the health of the backend.
+class CircuitBreaker:
+    CLOSED: str = "closed"
+    OPEN: str = "open"
+    HALF_OPEN: str = "half_open"
+
+    def __init__(self, name: str, threshold: int, reset_timeout: float,
+                 failure_types: tuple[type[Exception]], open_error: type[Exception], ignored_types: tuple[type[Exception]] = ()):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failure_types = failure_types
+        self.open_error = open_error
+        self.ignored_types = ignored_types
+        self.__state = self.CLOSED
+        self.__failures = 0
+        self.__opened_at = 0.0
+        self.__lock = Lock()
+        self.__opens = 0
+        self.__rejected = 0
+
+    # Calls the function unless the circuit is open
+    def call(self, function: Callable, *args, **kwargs) -> any:
+        self.__before_call()
+        try:
+            result = function(*args, **kwargs)
+        except self.ignored_types:
+            self.__record(failed = False)
+            raise
+        except self.failure_types:
+            self.__record(failed = True)
+            raise
+        except BaseException:
+            self.__record(failed = False)
+            raise
+        self.__record(failed = False)
+        return result
+
+    # Tells whether calls are currently rejected
+    def is_open(self) -> bool:
+        with self.__lock:
+            return self.__state == self.OPEN and time.monotonic() < self.__opened_at + self.reset_timeout
+
+    def stats(self) -> dict[str, any]:
+        with self.__lock:
+            return {"state": self.__state, "consecutive_failures": self.__failures, "opens": self.__opens, "rejected": self.__rejected}
+
+    def __before_call(self):
+        with self.__lock:
+            if self.__state == self.CLOSED:
+                return
+            if self.__state == self.OPEN and time.monotonic() >= self.__opened_at + self.reset_timeout:
+                self.__state = self.HALF_OPEN
+                return
+            self.__rejected += 1
+        raise self.open_error(f"Circuit breaker of {self.name} is open")
+
+    def __record(self, failed: bool):
+        with self.__lock:
+            if not failed:
+                if self.__state != self.CLOSED:
+                    logger.warning("Circuit breaker of %s closed", self.name)
+                self.__state = self.CLOSED
+                self.__failures = 0
+                return
+            self.__failures += 1
+            if self.__state == self.HALF_OPEN or self.__failures >= self.threshold:
+                if self.__state != self.OPEN:
+                    self.__opens += 1
+                    logger.warning("Circuit breaker of %s opened after %d failures", self.name, self.__failures)
+                self.__state = self.OPEN
+                self.__opened_at = time.monotonic()
+
+
+# Raised instead of calling Redis while its circuit breaker is open
+class RedisCircuitOpenError(RedisConnectionError):
+    pass
+
+# Raised when no connection of the pool gets free within REDIS_POOL_TIMEOUT seconds,
+# meaning that the worker has more requests waiting on Redis than connections rather than that Redis is down
+class RedisPoolExhaustedError(RedisConnectionError):
+    pass
+
+
+# Connection pool telling an exhausted pool apart from an unreachable Redis, which both raise a ConnectionError
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    EXHAUSTED_MESSAGE: str = "No connection available."
+
+    def get_connection(self, *args, **kwargs):
+        try:
+            return super().get_connection(*args, **kwargs)
+        except RedisConnectionError as exception:
+            if str(exception) != self.EXHAUSTED_MESSAGE or isinstance(exception, RedisPoolExhaustedError):
+                raise
+            raise RedisPoolExhaustedError(self.EXHAUSTED_MESSAGE) from exception
+
+
+# Errors meaning that Redis could not be reached or did not answer in time, including an open circuit
+REDIS_UNAVAILABLE_ERRORS: tuple[type[Exception]] = (RedisConnectionError, RedisTimeoutError)
+
+
+# Redis client counting the round trips of the current request and timing them, and failing fast
+# through its circuit breaker, if any, while Redis is unreachable. A pipeline counts as a single round trip.
+class InstrumentedRedis(StrictRedis):
+    circuit_breaker: CircuitBreaker = None
+
+    def execute_command(self, *args, **options):
+        RequestScope.count("redis")
+        execute_command = super().execute_command
+        start = time.perf_counter()
+        try:
+            if self.circuit_breaker is None:
+                return execute_command(*args, **options)
+            return self.circuit_breaker.call(execute_command, *args, **options)
+        finally:
+            seconds = time.perf_counter() - start
+            Metrics.observe_backend("redis", seconds)
+            RequestScope.trace("redis", str(args[0]), seconds)
+
+    def pipeline(self, transaction: bool = True, shard_hint: any = None) -> Pipeline:
+        pipeline = InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipeline.circuit_breaker = self.circuit_breaker
+        return pipeline
+
+
+class InstrumentedPipeline(Pipeline):
+    circuit_breaker: CircuitBreaker = None
+
+    def execute(self, raise_on_error: bool = True) -> list[any]:
+        if not self.command_stack:
+            return super().execute(raise_on_error)
+        RequestScope.count("redis")
+        commands = " ".join(str(command[0][0]) for command in self.command_stack)
+        execute = super().execute
+        start = time.perf_counter()
+        try:
+            if self.circuit_breaker is None:
+                return execute(raise_on_error)
+            return self.circuit_breaker.call(execute, raise_on_error)
+        finally:
+            seconds = time.perf_counter() - start
+            Metrics.observe_backend("redis", seconds)
+            RequestScope.trace("redis", f"PIPELINE {commands}", seconds)
+
+
+# Connection pool recording how long checkouts wait for a free connection
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__lock = Lock()
+        self.__checkouts = 0
+        self.__total_wait_seconds = 0.0
+        self.__max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait_seconds = time.perf_counter() - start
+            with self.__lock:
+                self.__checkouts += 1
+                self.__total_wait_seconds += wait_seconds
+                self.__max_wait_seconds = max(self.__max_wait_seconds, wait_seconds)
+
+    # Returns the connections in use and the checkout wait times of this pool
+    def stats(self) -> dict[str, int | float]:
+        with self.__lock:
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": self.overflow(),
+                "checkouts": self.__checkouts,
+                "mean_wait_seconds": self.__total_wait_seconds / self.__checkouts if self.__checkouts else 0.0,
+                "max_wait_seconds": self.__max_wait_seconds
+            }
+
+
+# Session sending the queries marked with the "replica" execution option to the read replica, if any
+class RoutingSession(Session):
+    REPLICA_BIND: str = "replica"
+
+    def get_bind(self, mapper = None, clause = None, bind = None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, Executable)
+                and clause.get_execution_options().get(self.REPLICA_BIND, False)
+                and self.REPLICA_BIND in self._db.engines):
+            return self._db.engines[self.REPLICA_BIND]
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+
 # Context class   
 class Context(metaclass = SingletonMeta):
     __app: Flask = None
-    __db: SQLAlchemy = None
-    __jwt: JWTManager = None
-    __bcrypt: Bcrypt = None
+    __db: SQLAlchemy = SQLAlchemy(session_options = {"class_": RoutingSession})
+    __jwt: JWTManager = JWTManager()
+    __bcrypt: Bcrypt = Bcrypt()
     __redis: StrictRedis = None
+    __lock: Lock = Lock()
 
-    def __init__(self):
-        self.__set_modules(*ApplicationInitializer.initialize())
-        print(f"Initialization completed")
-
+    # Creates the application and binds the modules to it. Backends are only connected on first use.
     @classmethod
-    def __set_modules(cls, app: Flask, db: SQLAlchemy, jwt: JWTManager, bcrypt: Bcrypt, redis: StrictRedis):
-        # Initialize the class variables
-        cls.__app = app
-        cls.__db = db
-        cls.__jwt = jwt
-        cls.__bcrypt = bcrypt
-        cls.__redis = redis
+    def init_app(cls, config: dict[str, any] = None, redis: StrictRedis = None) -> Flask:
+        app = ApplicationInitializer.initialize(config)
+        cls.__db.init_app(app)
+        cls.__jwt.init_app(app)
+        cls.__bcrypt.init_app(app)
+        with cls.__lock:
+            cls.__app = app
+            cls.__redis = redis
+        logger.info("Initialization completed")
+        return app
 
     # Getters
     @classmethod
     def app(cls) -> Flask:
+        if cls.__app is None:
+            cls.init_app()
         return cls.__app
     
     @classmethod
@@ -53,27 +372,141 @@ class Context(metaclass = SingletonMeta):
     def bcrypt(cls) -> Bcrypt:
         return cls.__bcrypt
     
+    # The client connects on the first command, and its connection pool is reset
+    # by redis-py in forked workers
     @classmethod
     def redis(cls) -> StrictRedis:
+        if cls.__redis is None:
+            config = cls.app().config
+            with cls.__lock:
+                if cls.__redis is None:
+                    cls.__redis = ApplicationInitializer.create_redis(config)
         return cls.__redis
     
+    # Discards the database connections inherited by a forked worker, without closing them for the parent
+    @classmethod
+    def dispose_engines(cls):
+        if cls.__app is not None:
+            with cls.__app.app_context():
+                for engine in cls.__db.engines.values():
+                    engine.dispose(close = False)
+
     # Utilities
+
+    # Tells whether blocking I/O has been made cooperative by gevent, as done by the gevent workers of gunicorn.
+    # Requests are then greenlets sharing the thread of their worker.
     @classmethod
-    def min_username_length(cls) -> StrictRedis:
-        return cls.__app.config["MIN_USERNAME_LENGTH"]
+    def is_cooperative(cls) -> bool:
+        monkey = sys.modules.get("gevent.monkey")
+        return monkey is not None and monkey.is_module_patched("socket")
+
+    @classmethod
+    def min_username_length(cls) -> int:
+        return cls.app().config["MIN_USERNAME_LENGTH"]
     
     @classmethod
-    def min_password_length(cls) -> StrictRedis:
-        return cls.__app.config["MIN_PASSWORD_LENGTH"]
+    def min_password_length(cls) -> int:
+        return cls.app().config["MIN_PASSWORD_LENGTH"]
+
+
+# Engines are not shared with forked workers, which open their own connections
+os.register_at_fork(after_in_child = Context.dispose_engines)
 
 
 # ApplicationInitializer class  
 class ApplicationInitializer:
+    # Prefix of the environment variables overriding the configuration, e.g. FLASKSERVER_REDIS_HOST.
+    # Values are parsed as JSON when possible, and nested keys are separated by a double underscore.
+    ENV_PREFIX: str = "FLASKSERVER"
+
+    # Environment variable holding the path of a Python or JSON configuration file
+    CONFIG_FILE_ENV: str = "FLASKSERVER_CONFIG"
+
+    # Creates the application, with its configuration loaded in order from the defaults,
+    # the configuration file, the environment and the given mapping
     @classmethod
-    def initialize(cls) -> tuple[Flask, SQLAlchemy, JWTManager, Bcrypt, StrictRedis]:
+    def initialize(cls, config: dict[str, any] = None) -> Flask:
         # Initialize the Flask library
         app = Flask(__name__)
+        cls.set_defaults(app)
+
+        config_file = os.environ.get(cls.CONFIG_FILE_ENV)
+        if config_file is not None:
+            if config_file.endswith(".json"):
+                app.config.from_file(os.path.abspath(config_file), load = json.load)
+            else:
+                app.config.from_pyfile(os.path.abspath(config_file))
+        app.config.from_prefixed_env(cls.ENV_PREFIX)
+        app.config.update(config or {})
+
+        cls.set_derived(app)
+        if app.config['PROXY_TRUSTED_HOPS']:
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for = app.config['PROXY_TRUSTED_HOPS'])
+        app.json = OrjsonProvider.create(app) or app.json
+        logging.basicConfig(level = app.config["LOG_LEVEL"], format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+        app.after_request(RequestScope.add_counters_header)
+        Metrics.init_app(app)
+        return app
+
+    # Creates the Redis client from the configuration, with a bounded pool of connections per worker,
+    # timeouts on connecting and on every command, and a circuit breaker failing fast while Redis is down
+    @classmethod
+    def create_redis(cls, config: dict[str, any]) -> StrictRedis:
+        options = {
+            "max_connections": config["REDIS_POOL_SIZE"],
+            "timeout": config["REDIS_POOL_TIMEOUT"],
+            "socket_connect_timeout": config["REDIS_CONNECT_TIMEOUT"],
+            "socket_timeout": config["REDIS_SOCKET_TIMEOUT"],
+            "socket_keepalive": True,
+            "health_check_interval": config["REDIS_HEALTH_CHECK_INTERVAL"],
+            "retry": Retry(ExponentialBackoff(cap = 0.5, base = 0.05), config["REDIS_RETRIES"]),
+            "decode_responses": True
+        }
+        if config["REDIS_URL"] is not None:
+            pool = InstrumentedConnectionPool.from_url(config["REDIS_URL"], **options)
+        else:
+            pool = InstrumentedConnectionPool(
+                host = config["REDIS_HOST"],
+                port = config["REDIS_PORT"],
+                db = config["REDIS_DB"],
+                username = config["REDIS_USERNAME"],
+                password = config["REDIS_PASSWORD"],
+                **options
+            )
+
+        client = InstrumentedRedis(connection_pool = pool)
+        client.circuit_breaker = CircuitBreaker("redis", config["REDIS_BREAKER_THRESHOLD"], config["REDIS_BREAKER_RESET_TIMEOUT"],
+                                                REDIS_UNAVAILABLE_ERRORS, RedisCircuitOpenError, (RedisPoolExhaustedError,))
+        return client
+
+    # Settings computed from the other ones, once they have all been loaded
+    @classmethod
+    def set_derived(cls, app: Flask):
+        # Token lifetimes can be given in seconds by the environment
+        for key in ("JWT_ACCESS_TOKEN_EXPIRES", "JWT_REFRESH_TOKEN_EXPIRES"):
+            if isinstance(app.config[key], (int, float)):
+                app.config[key] = timedelta(seconds = app.config[key])
 
+        engine_options = {
+            "poolclass": InstrumentedQueuePool,
+            "pool_size": app.config['DB_POOL_SIZE'],
+            "max_overflow": app.config['DB_MAX_OVERFLOW'],
+            "pool_timeout": app.config['DB_POOL_TIMEOUT'],
+            "pool_recycle": app.config['DB_POOL_RECYCLE'],
+            "pool_pre_ping": app.config['DB_POOL_PRE_PING']
+        }
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options)
+        if app.config['DB_REPLICA_URI'] is not None:
+            app.config.setdefault('SQLALCHEMY_BINDS', {
+                RoutingSession.REPLICA_BIND: {"url": app.config['DB_REPLICA_URI'], **engine_options}
+            })
+
+        if app.config["BCRYPT_BULK_MAX_IN_FLIGHT"] is None:
+            app.config["BCRYPT_BULK_MAX_IN_FLIGHT"] = max(app.config["BCRYPT_POOL_SIZE"] // 2, 1)
+
+    # Default settings
+    @classmethod
+    def set_defaults(cls, app: Flask):
         # Initialize the database
         app.config['SECRET_KEY'] = 'LzLIDNOvsfDEwqXogc6CNhjXkJn1C7mx'
 
@@ -83,34 +516,175 @@ class ApplicationInitializer:
         #SOCKET   = '?unix_socket=/Applications/XAMPP/xamppfiles/var/mysql/mysql.sock'
 
         app.config['SQLALCHEMY_DATABASE_URI'] = USERPASS + BASEDIR + DBNAME
-        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+        # Connection pool of each engine. Connections are recycled after DB_POOL_RECYCLE seconds
+        # and checked with a ping when taken from the pool.
+        app.config['DB_POOL_SIZE'] = 10
+        app.config['DB_MAX_OVERFLOW'] = 20
+        app.config['DB_POOL_TIMEOUT'] = 30  # Seconds
+        app.config['DB_POOL_RECYCLE'] = 1800  # Seconds
+        app.config['DB_POOL_PRE_PING'] = True
+
+        # Read replica used by the paginated and exported listings, which tolerate replication lag, if set
+        app.config['DB_REPLICA_URI'] = None
 
         app.config['MIN_USERNAME_LENGTH'] = 3
         app.config['MIN_PASSWORD_LENGTH'] = 6
 
-        db = SQLAlchemy(app)
+        # Page sizes of the listing routes
+        app.config['PAGE_DEFAULT_SIZE'] = 50
+        app.config['PAGE_MAX_SIZE'] = 500
+
+        # Rows accepted at most by the bulk routes
+        app.config['BULK_INSERT_MAX_ROWS'] = 5000
+        app.config['BULK_UPDATE_MAX_ROWS'] = 1000
+
+        # Rows read from the database at a time by the export routes
+        app.config['EXPORT_BATCH_SIZE'] = 1000
+
+        # Compression of the responses of the api blueprint, with brotli if installed or gzip.
+        # Buffered responses smaller than COMPRESSION_MIN_SIZE bytes are not compressed, streams always are.
+        app.config['COMPRESSION_ENABLED'] = True
+        app.config['COMPRESSION_MIN_SIZE'] = 1024
+        app.config['COMPRESSION_LEVEL'] = 6
+        app.config['COMPRESSION_BROTLI_QUALITY'] = 4
+        app.config['COMPRESSION_MIMETYPES'] = ["application/json", "application/x-ndjson", "text/csv", "text/plain"]
+
+        # JSON serialization with orjson, if installed, or with the default provider of Flask ("default")
+        app.config['JSON_PROVIDER'] = "orjson"
+
+        # Level of the root logger, if it is not configured by the server already
+        app.config['LOG_LEVEL'] = "INFO"
+
+        # Reverse proxies in front of the application whose X-Forwarded-For header is trusted, so that the
+        # rate limits and the metrics allowlist see the address of the client rather than the one of the proxy.
+        # Must be 0 if the clients connect directly, since they could otherwise choose the address they are seen with.
+        app.config['PROXY_TRUSTED_HOPS'] = 1
+
+        # Prometheus metrics, scraped from METRICS_PATH. With several worker processes,
+        # PROMETHEUS_MULTIPROC_DIR must be set (see gunicorn.conf.py).
+        # The metrics are only served to clients of METRICS_ALLOWED_NETWORKS, and METRICS_PATH must not be
+        # exposed publicly by the reverse proxy either: the endpoints and their traffic are visible there.
+        app.config['METRICS_ENABLED'] = True
+        app.config['METRICS_PATH'] = "/metrics"
+        app.config['METRICS_ALLOWED_NETWORKS'] = ["127.0.0.0/8", "::1/128"]
+
+        # Profiling of single requests, enabled by sending PROFILING_HEADER with a token of a user with one of
+        # PROFILING_ROLES, or at random for a PROFILING_SAMPLE_RATE fraction of the requests.
+        # Profiled requests and requests slower than SLOW_REQUEST_THRESHOLD seconds are kept
+        # in a buffer of SLOW_REQUEST_BUFFER_SIZE entries per worker.
+        app.config['PROFILING_HEADER'] = "X-Profile"
+        app.config['PROFILING_ROLES'] = ["Amministratore di sistema"]
+        app.config['PROFILING_SAMPLE_RATE'] = 0.0
+        app.config['PROFILING_TOP_FUNCTIONS'] = 30
+        app.config['PROFILING_MAX_CALLS'] = 500
+        app.config['SLOW_REQUEST_THRESHOLD'] = 1.0  # Seconds, None to disable
+        app.config['SLOW_REQUEST_BUFFER_SIZE'] = 100
+
+        # Report the database statements and Redis round trips of each request in a response header, for debugging
+        app.config['REQUEST_COUNTERS_HEADER'] = False
 
         # Initialize the Authentication module
         app.config["JWT_SECRET_KEY"] = '5PJijcrNhrXNaCqeJ4KJmMRBlu7iUAPc'
         app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours = 12)
         app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days = 30)
-        
-        jwt = JWTManager(app)
 
-        # Initialize the Password Hashing module
-        bcrypt = Bcrypt(app)
+        # Embed the roles of the user and their version in the access tokens, so that authorization
+        # is decided from the token as long as the roles have not changed since it was created
+        app.config["JWT_ROLE_CLAIMS"] = False
+
+        # Initialize the in-process cache of user roles, invalidated across workers via pub/sub
+        app.config["ROLE_CACHE_SIZE"] = 10000
+        app.config["ROLE_CACHE_TTL"] = 60  # Seconds
+        app.config["ROLE_CACHE_CHANNEL"] = "role_cache_invalidation"
+
+        # Initialize the in-process cache of the serialized machines of each area
+        app.config["MACHINE_CACHE_SIZE"] = 1024
+        app.config["MACHINE_CACHE_TTL"] = 300  # Seconds
+        app.config["MACHINE_CACHE_CHANNEL"] = "machine_cache_invalidation"
+
+        # Token revocation check of verify_token. With "redis", the current token identifier of the user is read
+        # from Redis on every request. With "local", it is cached by each worker and invalidated via pub/sub
+        # whenever a token is superseded or revoked, so a revoked token is accepted at most
+        # TOKEN_REVOCATION_MAX_STALENESS seconds if the invalidation is lost.
+        app.config["TOKEN_REVOCATION_MODE"] = "redis"
+        app.config["TOKEN_REVOCATION_MAX_STALENESS"] = 30  # Seconds
+        app.config["TOKEN_REVOCATION_CHANNEL"] = "token_revocation"
+        app.config["TOKEN_CACHE_SIZE"] = 10000
+
+        # Initialize the in-process cache of the usernames that failed to log in because they do not exist,
+        # invalidated across workers via pub/sub when a user is created or renamed. Disabled with a TTL of 0.
+        app.config["LOGIN_NEGATIVE_CACHE_TTL"] = 5  # Seconds
+        app.config["LOGIN_NEGATIVE_CACHE_SIZE"] = 10000
+        app.config["LOGIN_NEGATIVE_CACHE_CHANNEL"] = "login_negative_cache_invalidation"
+
+        # Limits of the requests to each endpoint, shared by every worker through Redis. Each rule allows "limit"
+        # requests per "period" seconds for each IP address ("ip"), submitted username ("username") or user ("user").
+        # If Redis cannot be reached, the requests are let through when RATE_LIMIT_FAIL_OPEN is enabled.
+        app.config["RATE_LIMIT_ENABLED"] = True
+        app.config["RATE_LIMIT_FAIL_OPEN"] = True
+        app.config["RATE_LIMITS"] = {
+            "authentication.login": [{"key": "ip", "limit": 30, "period": 60}, {"key": "username", "limit": 10, "period": 60}],
+            "authentication.fresh_login": [{"key": "ip", "limit": 30, "period": 60}, {"key": "username", "limit": 10, "period": 60}],
+            "api.monitoring": [{"key": "user", "limit": 30, "period": 60}],
+            "api.querying": [{"key": "user", "limit": 120, "period": 60}]
+        }
+
+        # Look up the legacy "user_{id}:*" keys when a user hash is missing, migrating them on the fly.
+        # Can be disabled once "flask --app main migrate-redis-keys" has been run.
+        app.config["REDIS_LEGACY_KEYS_FALLBACK"] = True
+
+        # Password hashing runs on a process pool of BCRYPT_POOL_SIZE workers (inline if 0), with at most
+        # BCRYPT_QUEUE_SIZE waiting requests before new ones are rejected with a 503
+        app.config["BCRYPT_POOL_SIZE"] = os.cpu_count() or 1
+        app.config["BCRYPT_QUEUE_SIZE"] = 32
+        app.config["BCRYPT_TIMEOUT"] = 10  # Seconds
+        # Bulk hashing, such as the user imports, submits at most this many passwords at once (half the pool if None)
+        app.config["BCRYPT_BULK_MAX_IN_FLIGHT"] = None
 
         # Setup our redis connection for storing the blocklisted tokens. You will probably
         # want your redis instance configured to persist data to disk, so that a restart
         # does not cause your application to forget that a JWT was revoked.
-        redis = StrictRedis(
-            host="redis-13586.c91.us-east-1-3.ec2.redns.redis-cloud.com", 
-            port=13586, 
-            db=0, 
-            username="default",
-            password="3LSmYtaQ22Zhtd7g2wcBlVInlLVrSVrJ",
-            decode_responses=True
-        )
-
-        # Initialize the Context with all the modules
-        return (app, db, jwt, bcrypt, redis)
\ No newline at end of file
+        # REDIS_URL, if set, takes precedence over the other settings.
+        app.config["REDIS_URL"] = None
+        app.config["REDIS_HOST"] = "redis-13586.c91.us-east-1-3.ec2.redns.redis-cloud.com"
+        app.config["REDIS_PORT"] = 13586
+        app.config["REDIS_DB"] = 0
+        app.config["REDIS_USERNAME"] = "default"
+        app.config["REDIS_PASSWORD"] = "3LSmYtaQ22Zhtd7g2wcBlVInlLVrSVrJ"
+
+        # Connections to Redis of each worker. Requests wait at most REDIS_POOL_TIMEOUT seconds for a free connection,
+        # and commands time out after REDIS_SOCKET_TIMEOUT seconds, being retried REDIS_RETRIES times.
+        # Idle connections are checked every REDIS_HEALTH_CHECK_INTERVAL seconds before being used.
+        app.config["REDIS_POOL_SIZE"] = 64
+        app.config["REDIS_POOL_TIMEOUT"] = 1.0  # Seconds
+        app.config["REDIS_CONNECT_TIMEOUT"] = 1.0  # Seconds
+        app.config["REDIS_SOCKET_TIMEOUT"] = 1.0  # Seconds
+        app.config["REDIS_RETRIES"] = 1
+        app.config["REDIS_HEALTH_CHECK_INTERVAL"] = 30  # Seconds
+
+        # After REDIS_BREAKER_THRESHOLD consecutive connection failures, Redis is not called for
+        # REDIS_BREAKER_RESET_TIMEOUT seconds. Meanwhile, with the "reject" degraded mode the routes needing Redis
+        # answer 503, while with "fallback" tokens are accepted unless the local token cache shows them as revoked,
+        # and roles are read from the local cache or the database.
+        app.config["REDIS_BREAKER_THRESHOLD"] = 5
+        app.config["REDIS_BREAKER_RESET_TIMEOUT"] = 5  # Seconds
+        app.config["REDIS_DEGRADED_MODE"] = "reject"
+
+        # Sensor API proxied by the monitoring and querying routes. Timeouts are in seconds,
+        # the read timeout being the longest allowed silence between two chunks of a stream.
+        # A chunk size of None forwards each chunk as soon as it is received.
+        app.config["SENSOR_API_URL"] = "http://193.205.129.120:63429"
+        app.config["SENSOR_API_CONNECT_TIMEOUT"] = 3.05
+        app.config["SENSOR_API_READ_TIMEOUT"] = 30
+        app.config["SENSOR_API_POOL_SIZE"] = 32
+        app.config["SENSOR_API_MAX_STREAMS"] = 256
+        app.config["SENSOR_API_CHUNK_SIZE"] = None
+
+        # Response caches, by route endpoint and TTL in seconds. Stored in Redis ("redis" backend)
+        # or in each worker ("memory" backend), with the worker memory also used when Redis fails.
+        app.config["RESPONSE_CACHE_BACKEND"] = "redis"
+        app.config["RESPONSE_CACHE_TTLS"] = {"api.querying": 10}
+        app.config["RESPONSE_CACHE_SIZE"] = 1024  # In-memory entries per route
+        app.config["RESPONSE_CACHE_MAX_ITEM_BYTES"] = 1024 * 1024
@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+
+# Gunicorn settings, used with "gunicorn -c gunicorn.conf.py wsgi:app"
+bind = os.environ.get("FLASKSERVER_BIND", "0.0.0.0:5004")
+workers = int(os.environ.get("FLASKSERVER_WORKERS", 2))
+
+# Each proxied sensor stream holds a thread rather than a whole worker process, so a few workers
+# with many threads serve many concurrent long-lived streams (see SENSOR_API_MAX_STREAMS)
+worker_class = os.environ.get("FLASKSERVER_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("FLASKSERVER_THREADS", 256))
+keepalive = 5
+
+# With FLASKSERVER_WORKER_CLASS=gevent (requires the gevent package), the blocking calls to Redis, MySQL through
+# PyMySQL and the sensor API are made cooperative, and each request is a greenlet of a few KB instead of a thread.
+# A worker then serves up to worker_connections requests at a time, waiting on the connection pools of
+# each backend (REDIS_POOL_SIZE, DB_POOL_SIZE, SENSOR_API_POOL_SIZE) rather than on free threads.
+worker_connections = int(os.environ.get("FLASKSERVER_WORKER_CONNECTIONS", 1000))
+
+# Prometheus metrics of every worker are written to PROMETHEUS_MULTIPROC_DIR, which is set here so that
+# it is known before the application imports prometheus_client, and emptied when the server starts
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "flaskserver_metrics"))
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors = True)
+    os.makedirs(metrics_dir)
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,201 @@
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from threading import BoundedSemaphore, Lock
+import hmac
+import multiprocessing
+import os
+import time
+import bcrypt as bcrypt_backend
+from core import Context
+from metrics import Metrics
+
+
+# Worker functions, executed in the processes of the pool
+
+def _generate_password_hash(password: bytes, rounds: int, prefix: bytes) -> str:
+    return bcrypt_backend.hashpw(password, bcrypt_backend.gensalt(rounds, prefix)).decode("utf-8")
+
+def _check_password_hash(pw_hash: bytes, password: bytes) -> bool:
+    return hmac.compare_digest(bcrypt_backend.hashpw(password, pw_hash), pw_hash)
+
+
+# Runs bcrypt hashing and checking on a bounded process pool, so that it does not hold the GIL
+# of the request threads. Requests exceeding the queue bound are rejected immediately.
+class PasswordHasher:
+    __pid: int = None
+    __executor: ProcessPoolExecutor = None
+    __slots: BoundedSemaphore = None
+    __bulk_slots: BoundedSemaphore = None
+    __lock: Lock = Lock()
+
+    # Metrics
+    __in_flight: int = 0
+    __rejected: int = 0
+    __completed: int = 0
+    __total_seconds: float = 0.0
+    __max_seconds: float = 0.0
+
+    # Shuts the pool down, sized by the configuration of the former application, and clears the metrics.
+    # Jobs still waiting are cancelled.
+    @classmethod
+    def reset(cls):
+        with cls.__lock:
+            executor = cls.__executor if cls.__pid == os.getpid() else None
+            cls.__pid = cls.__executor = cls.__slots = cls.__bulk_slots = None
+            cls.__in_flight = cls.__rejected = cls.__completed = 0
+            cls.__total_seconds = cls.__max_seconds = 0.0
+        # The callbacks of the cancelled jobs take the lock
+        if executor is not None:
+            executor.shutdown(wait = False, cancel_futures = True)
+
+    # Hashes a password, with the same output format as Flask-Bcrypt
+    @classmethod
+    def generate_password_hash(cls, password: str) -> str:
+        config = Context.app().config
+        return cls.__run(_generate_password_hash, password.encode("utf-8"),
+                         config.get("BCRYPT_LOG_ROUNDS", 12), config.get("BCRYPT_HASH_PREFIX", "2b").encode("utf-8"))
+
+    # Hashes many passwords in parallel, waiting for free slots of the pool instead of being rejected.
+    # At most BCRYPT_BULK_MAX_IN_FLIGHT passwords are submitted at once, leaving the rest of the pool and queue
+    # to the logins. The passwords still waiting are cancelled if one of them fails.
+    @classmethod
+    def generate_password_hashes(cls, passwords: list[str]) -> list[str]:
+        config = Context.app().config
+        args = (config.get("BCRYPT_LOG_ROUNDS", 12), config.get("BCRYPT_HASH_PREFIX", "2b").encode("utf-8"))
+
+        # Hashing inline when the pool is disabled
+        if config["BCRYPT_POOL_SIZE"] <= 0:
+            return [cls.__timed(_generate_password_hash, password.encode("utf-8"), *args) for password in passwords]
+
+        bulk_slots = cls.__get_bulk_slots()
+        futures = []
+        try:
+            for password in passwords:
+                if not bulk_slots.acquire(timeout = config["BCRYPT_TIMEOUT"]):
+                    raise PasswordHasherBusyException
+                try:
+                    future = cls.__submit(_generate_password_hash, password.encode("utf-8"), *args, wait = True)
+                except BaseException:
+                    bulk_slots.release()
+                    raise
+                future.add_done_callback(lambda _: bulk_slots.release())
+                futures.append(future)
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    # Checks a password against a hash generated by generate_password_hash or Flask-Bcrypt
+    @classmethod
+    def check_password_hash(cls, pw_hash: str | bytes, password: str) -> bool:
+        if pw_hash is None or password is None:
+            return False
+        if isinstance(pw_hash, str):
+            pw_hash = pw_hash.encode("utf-8")
+        return cls.__run(_check_password_hash, pw_hash, password.encode("utf-8"))
+
+    # Returns the queue depth and the latency of the hashing operations of this worker
+    @classmethod
+    def stats(cls) -> dict[str, int | float]:
+        with cls.__lock:
+            pool_size = Context.app().config["BCRYPT_POOL_SIZE"]
+            return {
+                "pool_size": pool_size,
+                "queue_size": Context.app().config["BCRYPT_QUEUE_SIZE"],
+                "in_flight": cls.__in_flight,
+                "queue_depth": max(cls.__in_flight - pool_size, 0),
+                "rejected": cls.__rejected,
+                "completed": cls.__completed,
+                "mean_seconds": cls.__total_seconds / cls.__completed if cls.__completed else 0.0,
+                "max_seconds": cls.__max_seconds
+            }
+
+    @classmethod
+    def __run(cls, function, *args) -> any:
+        config = Context.app().config
+
+        # Hashing inline when the pool is disabled
+        if config["BCRYPT_POOL_SIZE"] <= 0:
+            return cls.__timed(function, *args)
+
+        future = cls.__submit(function, *args, wait = False)
+        try:
+            return future.result(timeout = config["BCRYPT_TIMEOUT"])
+        except FutureTimeoutError:
+            future.cancel()
+            raise PasswordHasherBusyException
+
+    # Submits a job to the pool once a slot is free, either failing immediately or waiting up to
+    # BCRYPT_TIMEOUT for it. The slot is released when the job is done.
+    @classmethod
+    def __submit(cls, function, *args, wait: bool) -> Future:
+        executor, slots = cls.__get_executor()
+        if not slots.acquire(blocking = wait, timeout = Context.app().config["BCRYPT_TIMEOUT"] if wait else None):
+            with cls.__lock:
+                cls.__rejected += 1
+            raise PasswordHasherBusyException
+
+        with cls.__lock:
+            cls.__in_flight += 1
+        start = time.perf_counter()
+
+        def on_done(future: Future):
+            with cls.__lock:
+                # Jobs of a pool shut down by reset are not counted anymore
+                if cls.__slots is slots:
+                    cls.__in_flight -= 1
+            slots.release()
+            if not future.cancelled() and future.exception() is None:
+                cls.__record(time.perf_counter() - start)
+
+        try:
+            future = executor.submit(function, *args)
+        except BaseException:
+            with cls.__lock:
+                cls.__in_flight -= 1
+            slots.release()
+            raise
+        future.add_done_callback(on_done)
+        return future
+
+    @classmethod
+    def __timed(cls, function, *args) -> any:
+        start = time.perf_counter()
+        result = function(*args)
+        cls.__record(time.perf_counter() - start)
+        return result
+
+    @classmethod
+    def __record(cls, seconds: float):
+        Metrics.observe_backend("bcrypt", seconds)
+        with cls.__lock:
+            cls.__completed += 1
+            cls.__total_seconds += seconds
+            cls.__max_seconds = max(cls.__max_seconds, seconds)
+
+    # Creates the pool once per process, since pools do not survive a fork
+    @classmethod
+    def __get_executor(cls) -> tuple[ProcessPoolExecutor, BoundedSemaphore]:
+        with cls.__lock:
+            if cls.__pid != os.getpid():
+                config = Context.app().config
+                cls.__executor = ProcessPoolExecutor(
+                    max_workers = config["BCRYPT_POOL_SIZE"],
+                    mp_context = multiprocessing.get_context("forkserver")
+                )
+                cls.__slots = BoundedSemaphore(config["BCRYPT_POOL_SIZE"] + config["BCRYPT_QUEUE_SIZE"])
+                cls.__bulk_slots = BoundedSemaphore(config["BCRYPT_BULK_MAX_IN_FLIGHT"])
+                cls.__in_flight = 0
+                cls.__pid = os.getpid()
+            return cls.__executor, cls.__slots
+
+    @classmethod
+    def __get_bulk_slots(cls) -> BoundedSemaphore:
+        cls.__get_executor()
+        return cls.__bulk_slots
+
+
+# Custom exceptions
+class PasswordHasherBusyException(Exception):
+    message: str = "Too many concurrent password checks, retry later"
+    retry_after: int = 1  # Seconds
@@ -1,16 +1,60 @@
+import json
+import click
+from flask import Flask, current_app
+from redis import StrictRedis
+from caching import ResponseCache
 from core import Context
 from authentication import bp as authentication_blueprint
 from api import bp as api_blueprint
+from hashing import PasswordHasher
+from models import migrate_indexes
+from policies import PolicyRegistry
+from profiling import RequestProfiler
+from proxy import SensorProxy
+from utilities import CredentialCache, MachineCache, RedisUtils
 
-# Get the app reference from Context
-app = Context().app()
+# Moves the legacy "user_{id}:*" Redis keys into the per-user hashes
+@click.command("migrate-redis-keys")
+def migrate_redis_keys():
+    print(f"Migrated the Redis keys of {RedisUtils.migrate_legacy_keys()} users")
 
-# Register Blueprints
-app.register_blueprint(authentication_blueprint)
-app.register_blueprint(api_blueprint)
+# Creates the indexes of the models missing from the existing tables and drops the replaced ones
+@click.command("migrate-indexes")
+def migrate_indexes_command():
+    created, dropped = migrate_indexes()
+    print(f"Created indexes: {', '.join(created) or 'none'}")
+    print(f"Dropped indexes: {', '.join(dropped) or 'none'}")
+
+# Prints the compiled role policy of every route as JSON, for auditing
+@click.command("dump-policies")
+def dump_policies():
+    print(json.dumps(PolicyRegistry.dump(current_app), indent = 2))
+
+# Application factory. The configuration is read from the environment (see ApplicationInitializer),
+# then overridden by the given mapping. Redis and the database are connected on first use,
+# so that pre-fork workers do not inherit any socket. The module is served by "gunicorn wsgi:app",
+# and "flask --app main" calls the factory.
+def create_app(config: dict[str, any] = None, redis: StrictRedis = None) -> Flask:
+    # The caches, pools and sessions built from the configuration of a former application start over
+    for component in (RedisUtils, MachineCache, CredentialCache, ResponseCache, PasswordHasher, SensorProxy):
+        component.reset()
+
+    app = Context.init_app(config, redis)
+    RequestProfiler.init_app(app)
+
+    # Register Blueprints
+    app.register_blueprint(authentication_blueprint)
+    app.register_blueprint(api_blueprint)
+
+    # Register CLI commands
+    app.cli.add_command(migrate_redis_keys)
+    app.cli.add_command(migrate_indexes_command)
+    app.cli.add_command(dump_policies)
+
+    return app
 
 # Entry point for the application
 if __name__ == "__main__":
     # Set the port for the application, this is only for development
     # turn debug on in development
-    app.run(port=5004, debug=True)
+    create_app().run(port=5004, debug=True)
@@ -0,0 +1,105 @@
+from ipaddress import ip_address, ip_network
+import os
+import time
+import flask
+
+# The metrics are only collected if prometheus_client is installed.
+# Under multi-process servers, PROMETHEUS_MULTIPROC_DIR must be set before it is imported (see gunicorn.conf.py).
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+except ImportError:
+    prometheus_client = None
+
+# Buckets of the latency histograms, in seconds
+LATENCY_BUCKETS: tuple[float] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = Histogram("flaskserver_request_duration_seconds", "Time until the response headers are sent",
+                                ["blueprint", "endpoint", "method"], buckets = LATENCY_BUCKETS)
+    REQUESTS = Counter("flaskserver_requests_total", "Responses by status code",
+                       ["blueprint", "endpoint", "method", "status"])
+    REQUESTS_IN_FLIGHT = Gauge("flaskserver_requests_in_flight", "Requests being handled",
+                               ["blueprint"], multiprocess_mode = "livesum")
+    BACKEND_LATENCY = Histogram("flaskserver_backend_duration_seconds", "Time spent in Redis commands, SQL statements and bcrypt",
+                                ["backend"], buckets = LATENCY_BUCKETS)
+    UPSTREAM_LATENCY = Histogram("flaskserver_upstream_duration_seconds", "Time until the sensor API response headers are received",
+                                 ["outcome"], buckets = LATENCY_BUCKETS)
+    UPSTREAM_BYTES = Counter("flaskserver_upstream_bytes_total", "Bytes received from the sensor API")
+
+
+# Prometheus metrics of the application, exposed on METRICS_PATH. Every method is a no-op
+# if prometheus_client is not installed or METRICS_ENABLED is off.
+class Metrics:
+    START_ATTRIBUTE: str = "metrics_start"
+
+    # Whether the backend and upstream hooks record anything, set by init_app. They can run outside
+    # of an application context, in the callbacks of the password hashing pool.
+    __enabled: bool = False
+
+    # Registers the request hooks and the scrape route
+    @classmethod
+    def init_app(cls, app: flask.Flask):
+        cls.__enabled = prometheus_client is not None and app.config["METRICS_ENABLED"]
+        if not cls.__enabled:
+            return
+        app.before_request(cls.__before_request)
+        app.after_request(cls.__after_request)
+        app.teardown_request(cls.__teardown_request)
+        app.add_url_rule(app.config["METRICS_PATH"], "metrics", cls.scrape, methods = ["GET"])
+
+    # Returns the metrics of every worker, or of this process if the multi-process mode is not enabled.
+    # Clients outside of METRICS_ALLOWED_NETWORKS are answered with a 403.
+    @classmethod
+    def scrape(cls) -> flask.Response:
+        networks = [ip_network(network) for network in flask.current_app.config["METRICS_ALLOWED_NETWORKS"]]
+        try:
+            address = ip_address(flask.request.remote_addr)
+        except ValueError:
+            address = None
+        if address is None or not any(address in network for network in networks):
+            return flask.jsonify(msg = "Forbidden"), 403
+
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return flask.Response(prometheus_client.generate_latest(registry), content_type = prometheus_client.CONTENT_TYPE_LATEST)
+
+    # Records the duration of a Redis command ("redis"), SQL statement ("sql") or password hash ("bcrypt")
+    @classmethod
+    def observe_backend(cls, backend: str, seconds: float):
+        if cls.__enabled:
+            BACKEND_LATENCY.labels(backend).observe(seconds)
+
+    # Records the latency of a sensor API request
+    @classmethod
+    def observe_upstream(cls, seconds: float, error: bool = False):
+        if cls.__enabled:
+            UPSTREAM_LATENCY.labels("error" if error else "ok").observe(seconds)
+
+    # Counts the bytes received from the sensor API
+    @classmethod
+    def count_upstream_bytes(cls, size: int):
+        if cls.__enabled:
+            UPSTREAM_BYTES.inc(size)
+
+    @classmethod
+    def __before_request(cls):
+        flask.g.setdefault(cls.START_ATTRIBUTE, time.perf_counter())
+        REQUESTS_IN_FLIGHT.labels(flask.request.blueprint or "").inc()
+
+    # Unmatched paths share a single endpoint label, to bound the number of series
+    @classmethod
+    def __after_request(cls, response: flask.Response) -> flask.Response:
+        labels = (flask.request.blueprint or "", flask.request.endpoint or "unmatched", flask.request.method)
+        REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - flask.g.get(cls.START_ATTRIBUTE, time.perf_counter()))
+        REQUESTS.labels(*labels, str(response.status_code)).inc()
+        return response
+
+    # Called once the response has been sent, even if the view failed
+    @classmethod
+    def __teardown_request(cls, _exception: BaseException):
+        if flask.g.pop(cls.START_ATTRIBUTE, None) is not None:
+            REQUESTS_IN_FLIGHT.labels(flask.request.blueprint or "").dec()
@@ -1,20 +1,69 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Iterator, NamedTuple
 from flask_jwt_extended import current_user as current_user_id
-from sqlalchemy import ForeignKeyConstraint, UniqueConstraint, func
-from sqlalchemy.orm import reconstructor
-from core import Context
+from sqlalchemy import ForeignKeyConstraint, MetaData, Table, UniqueConstraint, case, func, insert, inspect, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Query, reconstructor
+from core import Context, RequestScope
+from hashing import PasswordHasher
+
+# Get the references from Context, the database is bound to the application when it is created
+db = Context.db()
+
+# Lengths of the string columns checked before bulk inserts
+USERNAME_MAX_LENGTH: int = 30
+ROLENAME_MAX_LENGTH: int = 30
+
+# Returns a query on the model that runs on the read replica if "replica" is set and one is configured.
+# The replica may lag behind, so it is only meant for reads which tolerate stale rows: queries filling a cache
+# or following a write of the same request stay on the primary.
+def replica_query(model: type[db.Model], replica: bool = True) -> Query:
+    return model.query.execution_options(replica = True) if replica else model.query
+
+# Returns a page of rows as dictionaries, keyset-paginated on the primary key so that the cost of a page
+# does not depend on its position. The cursor of the next page is None if this is the last one.
+def get_page(model: type[db.Model], query: Query, after_id: int = None, limit: int = 50,
+             fields: list[str] = None) -> tuple[list[dict[str, any]], int]:
+    if fields:
+        unknown_fields = set(fields) - set(model.__table__.columns.keys())
+        if unknown_fields:
+            raise UnknownFieldException
+        query = query.with_entities(model.id, *(model.__table__.columns[field] for field in fields if field != "id"))
+    else:
+        query = query.with_entities(*model.__table__.columns)
+
+    if after_id is not None:
+        query = query.filter(model.id > after_id)
+    rows = [row._asdict() for row in query.order_by(model.id).limit(limit + 1)]
+
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+# Returns the rows of a query as dictionaries, selecting the columns only so that no model instance is built
+def get_rows(model: type[db.Model], query: Query) -> list[dict[str, any]]:
+    return [row._asdict() for row in query.with_entities(*model.__table__.columns)]
+
+# Yields the rows of a query as dictionaries, read from a server-side cursor in batches
+# so that memory stays constant regardless of the number of rows
+def iter_rows(model: type[db.Model], query: Query, batch_size: int = 1000) -> Iterator[dict[str, any]]:
+    for row in query.with_entities(*model.__table__.columns).order_by(model.id).yield_per(batch_size):
+        yield row._asdict()
+
+
+# Id, password hash and sorted role names of a user, as needed by the login routes
+class UserCredentials(NamedTuple):
+    id: int
+    password: str
+    roles: list[str]
 
-# Get the references from Context
-db = Context().db()
-bcrypt = Context().bcrypt()
 
 # Models
 @dataclass
 class User(db.Model):
     id: int = db.Column(db.Integer, primary_key = True)
-    username: str = db.Column(db.String(30), unique = True, nullable = False)
+    username: str = db.Column(db.String(USERNAME_MAX_LENGTH), unique = True, nullable = False)
     password: str = db.Column(db.String(100), nullable = False)
     datetime_added: datetime = db.Column(db.DateTime(timezone = True), server_default = func.now())
 
@@ -32,9 +81,26 @@ class User(db.Model):
     def get_by_username(cls, username: str) -> User:
         return User.query.filter_by(username = username).one_or_none()
     
+    # Returns the credentials and the roles of a user with a single query, without building any model instance
+    @classmethod
+    def get_credentials_by_username(cls, username: str) -> UserCredentials:
+        rows = (db.session.query(User.id, User.password, UserRole.role)
+                .outerjoin(UserRole, UserRole.user == User.id)
+                .filter(User.username == username)
+                .order_by(UserRole.role)
+                .all())
+        if not rows:
+            return None
+        return UserCredentials(rows[0].id, rows[0].password, [row.role for row in rows if row.role is not None])
+
+    @classmethod
+    def get_data_by_id(cls, user_id: int) -> dict[str, any]:
+        user = User.query.with_entities(User.id, User.username, User.datetime_added).filter_by(id = user_id).one_or_none()
+        return user._asdict() if user is not None else None
+    
     @classmethod
     def get_current_user(cls) -> User:
-        return User.get_by_id(current_user_id)
+        return RequestScope.memoize(("current_user", str(current_user_id)), lambda: User.get_by_id(int(current_user_id)))
     
     @classmethod
     def insert(cls, username: str, password: str) -> int:
@@ -48,11 +114,78 @@ class User(db.Model):
             raise PasswordTooShortException
         
         else:
-            new_user = User(username = username, password = bcrypt.generate_password_hash(password))
+            new_user = User(username = username, password = PasswordHasher.generate_password_hash(password))
             db.session.add(new_user)
             db.session.commit()
             return new_user.id
     
+    # Inserts a batch of users with their optional role in a single transaction, creating the missing roles
+    # as /insert-user does. Returns a report for each row, in the same order, with the id of the created user
+    # or the reason why the row was rejected.
+    # Raises BulkInsertConflictException if a username or role was created by a concurrent insert meanwhile.
+    @classmethod
+    def insert_many(cls, rows: list[dict[str, str]]) -> list[dict[str, any]]:
+        rows = [{key: value for key, value in row.items() if isinstance(value, str)} for row in rows]
+        reports: list[dict[str, any]] = [{"row": index, "username": row.get("username")} for index, row in enumerate(rows)]
+
+        # Checks the rows with a single query on the users and one on the roles. Usernames and role names
+        # are compared case-insensitively, as the collation of the database does.
+        usernames = {row.get("username") for row in rows if row.get("username")}
+        taken_usernames = {user.username.casefold()
+                           for user in User.query.with_entities(User.username).filter(User.username.in_(usernames))}
+        rolenames = {row.get("rolename") for row in rows if row.get("rolename")}
+        known_rolenames = {role.rolename.casefold() for role in Role.query.with_entities(Role.rolename)
+                           .filter(Role.rolename.in_([rolename for rolename in rolenames if len(rolename) <= ROLENAME_MAX_LENGTH]))}
+        missing_rolenames: dict[str, str] = {}
+        accepted: list[int] = []
+        for index, row in enumerate(rows):
+            username, password, rolename = row.get("username"), row.get("password"), row.get("rolename")
+            if not username:
+                reports[index]["error"] = "Bad request: missing username field"
+            elif not password:
+                reports[index]["error"] = "Bad request: missing password field"
+            elif len(username) < Context.min_username_length():
+                reports[index]["error"] = UsernameTooShortException().message
+            elif len(username) > USERNAME_MAX_LENGTH:
+                reports[index]["error"] = UsernameTooLongException().message
+            elif username.casefold() in taken_usernames:
+                reports[index]["error"] = UsernameExistsException().message
+            elif len(password) < Context.min_password_length():
+                reports[index]["error"] = PasswordTooShortException().message
+            elif rolename and len(rolename) > ROLENAME_MAX_LENGTH:
+                reports[index]["error"] = RolenameTooLongException().message
+            else:
+                taken_usernames.add(username.casefold())
+                accepted.append(index)
+                if rolename and rolename.casefold() not in known_rolenames:
+                    missing_rolenames.setdefault(rolename.casefold(), rolename)
+
+        if not accepted:
+            return reports
+
+        # Inserts roles, users and user roles with bulk statements, committing once
+        passwords = PasswordHasher.generate_password_hashes([rows[index]["password"] for index in accepted])
+        try:
+            if missing_rolenames:
+                db.session.execute(insert(Role), [{"rolename": rolename} for rolename in missing_rolenames.values()])
+            db.session.execute(insert(User), [{"username": rows[index]["username"], "password": password}
+                                              for index, password in zip(accepted, passwords)])
+            user_ids = {username.casefold(): user_id for username, user_id in User.query.with_entities(User.username, User.id)
+                        .filter(User.username.in_([rows[index]["username"] for index in accepted]))}
+
+            user_roles = [{"user": user_ids[rows[index]["username"].casefold()], "role": rows[index]["rolename"]}
+                          for index in accepted if rows[index].get("rolename")]
+            if user_roles:
+                db.session.execute(insert(UserRole), user_roles)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise BulkInsertConflictException
+
+        for index in accepted:
+            reports[index]["id"] = user_ids[rows[index]["username"].casefold()]
+        return reports
+
     def update_username(self, new_username: str) -> None:
         if len(new_username) < Context.min_username_length():
             raise UsernameTooShortException
@@ -69,12 +202,12 @@ class User(db.Model):
             raise PasswordTooShortException
         
         else:
-            self.password = Context.bcrypt().generate_password_hash(new_password)
+            self.password = PasswordHasher.generate_password_hash(new_password)
             db.session.commit()
 
 @dataclass
 class Role(db.Model):
-    rolename: str = db.Column(db.String(30), primary_key = True)
+    rolename: str = db.Column(db.String(ROLENAME_MAX_LENGTH), primary_key = True)
 
     @classmethod
     def get_by_rolename(cls, rolename: str) -> Role:
@@ -82,7 +215,7 @@ class Role(db.Model):
 
     @classmethod
     def get_rolenames(cls) -> list[str]:
-        return [role.rolename for role in Role.query.all()]
+        return [role.rolename for role in replica_query(Role).all()]
     
     @classmethod
     def exists(cls, rolename: str) -> bool:
@@ -97,7 +230,7 @@ class Role(db.Model):
 @dataclass
 class UserRole(db.Model):
     user: int = db.Column(db.Integer, primary_key = True)
-    role: str = db.Column(db.String(30), primary_key = True)
+    role: str = db.Column(db.String(ROLENAME_MAX_LENGTH), primary_key = True)
     __table_args__ = (
         ForeignKeyConstraint([user], [User.id]),
         ForeignKeyConstraint([role], [Role.rolename])
@@ -131,6 +264,8 @@ class Task(db.Model):
     __table_args__ = (
         ForeignKeyConstraint([user], [User.id]),
         ForeignKeyConstraint([area], [Area.id]),
+        # Serves the task lists of a user and area, filtered on completion and paginated on the id
+        db.Index("ix_task_user_area_completed", user, area, completed, id),
     )
 
     @classmethod
@@ -141,13 +276,55 @@ class Task(db.Model):
     def get_by_user_id(cls, user_id: int) -> list[Task]:
         return Task.query.filter_by(user = user_id).all()
     
+    @classmethod
+    def query_by_area_id(cls, area_id: int, replica: bool = False) -> Query:
+        return replica_query(Task, replica).filter_by(area = area_id)
+
+    @classmethod
+    def iter_by_area_id(cls, area_id: int, batch_size: int = 1000) -> Iterator[dict[str, any]]:
+        return iter_rows(Task, Task.query_by_area_id(area_id, replica = True), batch_size)
+
+    # The user column is a string, so the id is bound as one: compared to a number, MySQL would convert
+    # every row and could not use the index on the column
+    @classmethod
+    def query_by_user_id_and_area_id(cls, user_id: int, area_id: int, replica: bool = False) -> Query:
+        return replica_query(Task, replica).filter_by(user = str(user_id), area = area_id)
+
     @classmethod
     def get_by_user_id_and_area_id(cls, user_id: int, area_id: int) -> list[Task]:
-        return Task.query.filter_by(user = user_id, area = area_id).all()
+        return Task.query_by_user_id_and_area_id(user_id, area_id).all()
+
+    @classmethod
+    def get_rows_by_user_id_and_area_id(cls, user_id: int, area_id: int) -> list[dict[str, any]]:
+        return get_rows(Task, Task.query_by_user_id_and_area_id(user_id, area_id))
+
+    @classmethod
+    def get_page_by_user_id_and_area_id(cls, user_id: int, area_id: int, after_id: int = None, limit: int = 50,
+                                        fields: list[str] = None, completed: bool = None) -> tuple[list[dict[str, any]], int]:
+        query = Task.query_by_user_id_and_area_id(user_id, area_id, replica = True)
+        if completed is not None:
+            query = query.filter_by(completed = completed)
+        return get_page(Task, query, after_id, limit, fields)
     
     def set_completed(self, completed: bool) -> None:
         self.completed = completed
         db.session.commit()
+
+    # Updates the state of many tasks of a user with a single query, UPDATE and commit. Returns the ids
+    # of the tasks that do not exist or belong to another user, in which case no task is updated.
+    @classmethod
+    def set_completed_many(cls, user_id: int, states: dict[int, bool]) -> list[int]:
+        owned_ids = {task.id for task in Task.query.with_entities(Task.id).filter(Task.id.in_(states), Task.user == str(user_id))}
+        rejected_ids = sorted(set(states) - owned_ids)
+        if rejected_ids or not states:
+            return rejected_ids
+
+        db.session.execute(update(Task)
+                           .where(Task.id.in_(states))
+                           .values(completed = case(states, value = Task.id))
+                           .execution_options(synchronize_session = False))
+        db.session.commit()
+        return []
     
 @dataclass
 class Machine(db.Model):
@@ -165,13 +342,65 @@ class Machine(db.Model):
     __table_args__ = (
         UniqueConstraint("manufacturer", "model", "serial"),
         ForeignKeyConstraint([area], [Area.id]),
+        db.Index("ix_machine_area", area),
     )
 
+    @classmethod
+    def query_by_area_id(cls, area_id: int, replica: bool = False) -> Query:
+        return replica_query(Machine, replica).filter_by(area = area_id)
+
     @classmethod
     def get_by_area_id(cls, area_id: int) -> list[Machine]:
-        return Machine.query.filter_by(area = area_id).all()
+        return Machine.query_by_area_id(area_id).all()
+
+    @classmethod
+    def get_rows_by_area_id(cls, area_id: int) -> list[dict[str, any]]:
+        return get_rows(Machine, Machine.query_by_area_id(area_id))
+
+    @classmethod
+    def iter_by_area_id(cls, area_id: int, batch_size: int = 1000) -> Iterator[dict[str, any]]:
+        return iter_rows(Machine, Machine.query_by_area_id(area_id, replica = True), batch_size)
+
+    @classmethod
+    def get_page_by_area_id(cls, area_id: int, after_id: int = None, limit: int = 50, fields: list[str] = None,
+                            type: str = None, manufacturer: str = None) -> tuple[list[dict[str, any]], int]:
+        query = Machine.query_by_area_id(area_id, replica = True)
+        if type is not None:
+            query = query.filter_by(type = type)
+        if manufacturer is not None:
+            query = query.filter_by(manufacturer = manufacturer)
+        return get_page(Machine, query, after_id, limit, fields)
     
 
+# Indexes declared by former versions of the models, replaced since, for each table
+OBSOLETE_INDEXES: dict[str, tuple[str]] = {
+    "task": ("ix_task_user_area", "ix_task_user_completed")
+}
+
+# Creates the indexes of the models missing from the database, since db.create_all does not add them to
+# existing tables, then drops the obsolete ones. Returns the names of the created and dropped indexes.
+def migrate_indexes() -> tuple[list[str], list[str]]:
+    engine = db.engine
+    inspector = inspect(engine)
+    created, dropped = [], []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind = engine)
+                created.append(index.name)
+
+        obsolete = set(OBSOLETE_INDEXES.get(table.name, ())) & existing
+        if obsolete:
+            for index in Table(table.name, MetaData(), autoload_with = engine).indexes:
+                if index.name in obsolete:
+                    index.drop(bind = engine)
+                    dropped.append(index.name)
+    return created, dropped
+
+
 # Custom exceptions
 class UsernameException(Exception):
     message: str = "The given username is invalid"
@@ -180,7 +409,29 @@ class UsernameExistsException(UsernameException):
     message: str = "The given username is already in use"
 
 class UsernameTooShortException(UsernameException):
-    message: str = f"The given username must be at least {Context.min_username_length()} characters long"
+    @property
+    def message(self) -> str:
+        return f"The given username must be at least {Context.min_username_length()} characters long"
+
+class UsernameTooLongException(UsernameException):
+    message: str = f"The given username must be at most {USERNAME_MAX_LENGTH} characters long"
+
+class RolenameTooLongException(Exception):
+    message: str = f"The given role name must be at most {ROLENAME_MAX_LENGTH} characters long"
+
+class BulkInsertConflictException(Exception):
+    message: str = "Some of the given usernames or roles were created meanwhile, retry the batch"
 
 class PasswordTooShortException(Exception):
-    message: str = f"The given password must be at least {Context.min_password_length()} characters long"
+    @property
+    def message(self) -> str:
+        return f"The given password must be at least {Context.min_password_length()} characters long"
+
+class InvalidQueryException(Exception):
+    message: str = "The given query arguments are invalid"
+
+class UnknownFieldException(InvalidQueryException):
+    message: str = "The given fields do not exist"
+
+class InvalidRequestBodyException(Exception):
+    message: str = "The request body is invalid"
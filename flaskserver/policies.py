@@ -0,0 +1,78 @@
+from functools import lru_cache
+from threading import Lock
+from typing import Iterable, NamedTuple
+from flask import Flask
+
+
+# Role policy of a route, compiled once when the route is decorated.
+# The roles are stored as a bitmask of their interned ids, so that checking the roles of a request
+# is a single bitwise and.
+class RolePolicy(NamedTuple):
+    effect: str  # "allow" or "deny"
+    roles: frozenset[str]
+    mask: int
+
+    # Tells whether a request with the given roles passes the policy
+    def permits(self, roles: Iterable[str]) -> bool:
+        matches = PolicyRegistry.get_mask(roles) & self.mask != 0
+        return matches if self.effect == PolicyRegistry.ALLOW else not matches
+
+
+# Registry interning role names to small integer ids, shared by every policy of the process.
+# Ids are assigned on first use and never change, so compiled masks stay valid when new roles appear.
+class PolicyRegistry:
+    ALLOW: str = "allow"
+    DENY: str = "deny"
+
+    __role_ids: dict[str, int] = {}
+    __lock: Lock = Lock()
+
+    # Returns the id of a role, interning it if needed
+    @classmethod
+    def get_role_id(cls, role: str) -> int:
+        role_id = cls.__role_ids.get(role)
+        if role_id is None:
+            with cls.__lock:
+                role_id = cls.__role_ids.setdefault(role, len(cls.__role_ids))
+        return role_id
+
+    # Returns the bitmask of a set of roles. Masks are memoized, since users share few distinct role lists.
+    @classmethod
+    def get_mask(cls, roles: Iterable[str]) -> int:
+        return _get_mask(roles if isinstance(roles, tuple) else tuple(roles))
+
+    # Compiles the roles of an allow or deny decorator
+    @classmethod
+    def compile(cls, effect: str, roles: Iterable[str]) -> RolePolicy:
+        roles = frozenset(roles)
+        return RolePolicy(effect, roles, cls.get_mask(tuple(sorted(roles))))
+
+    # Returns the interned role ids
+    @classmethod
+    def role_ids(cls) -> dict[str, int]:
+        with cls.__lock:
+            return dict(cls.__role_ids)
+
+    # Returns the compiled policy of every route of the app, for auditing
+    @classmethod
+    def dump(cls, app: Flask) -> list[dict[str, any]]:
+        table = []
+        for rule in sorted(app.url_map.iter_rules(), key = lambda rule: rule.rule):
+            policy: RolePolicy = getattr(app.view_functions[rule.endpoint], "role_policy", None)
+            table.append({
+                "endpoint": rule.endpoint,
+                "rule": rule.rule,
+                "methods": sorted(rule.methods - {"HEAD", "OPTIONS"}),
+                "effect": policy.effect if policy is not None else None,
+                "roles": sorted(policy.roles) if policy is not None else None,
+                "mask": policy.mask if policy is not None else None
+            })
+        return table
+
+
+@lru_cache(maxsize = 1024)
+def _get_mask(roles: tuple[str]) -> int:
+    mask = 0
+    for role in roles:
+        mask |= 1 << PolicyRegistry.get_role_id(role)
+    return mask
@@ -0,0 +1,112 @@
+from collections import deque
+from itertools import count
+from threading import Lock
+import cProfile
+import io
+import pstats
+import random
+import time
+import flask
+from authorization import is_allowed
+from core import Context, RequestScope
+
+
+# Per-request profiling and slow request capture.
+# A request is profiled if it sends PROFILING_HEADER with the token of a user with one of PROFILING_ROLES,
+# or if it is sampled. Profiled requests record a cProfile breakdown and their SQL statements and Redis commands
+# with timings. Profiled requests and requests slower than SLOW_REQUEST_THRESHOLD are kept in a bounded
+# buffer of each worker, and profiled responses carry the id of their entry in PROFILE_ID_HEADER.
+class RequestProfiler:
+    PROFILE_ID_HEADER: str = "X-Profile-Id"
+    STATE_ATTRIBUTE: str = "profiler_state"
+
+    __captures: deque = None
+    __ids = count(1)
+    __lock: Lock = Lock()
+
+    # Registers the request hooks
+    @classmethod
+    def init_app(cls, app: flask.Flask):
+        with cls.__lock:
+            cls.__captures = deque(maxlen = app.config["SLOW_REQUEST_BUFFER_SIZE"])
+        app.before_request(cls.__before_request)
+        app.after_request(cls.__after_request)
+
+    # Returns the summaries of the captured requests, the latest first
+    @classmethod
+    def get_captures(cls) -> list[dict[str, any]]:
+        with cls.__lock:
+            captures = list(cls.__captures or ())
+        return [{key: value for key, value in capture.items() if key not in ("profile", "trace")} for capture in reversed(captures)]
+
+    # Returns a captured request with its profile and trace, or None if it is not in the buffer anymore
+    @classmethod
+    def get_capture(cls, capture_id: int) -> dict[str, any]:
+        with cls.__lock:
+            return next((capture for capture in cls.__captures or () if capture["id"] == capture_id), None)
+
+    @classmethod
+    def __before_request(cls):
+        config = flask.current_app.config
+        reason = None
+        if config["PROFILING_HEADER"] in flask.request.headers and is_allowed(config["PROFILING_ROLES"]):
+            reason = "requested"
+        elif config["PROFILING_SAMPLE_RATE"] > 0 and random.random() < config["PROFILING_SAMPLE_RATE"]:
+            reason = "sampled"
+
+        profiler = None
+        if reason is not None:
+            RequestScope.start_trace(config["PROFILING_MAX_CALLS"])
+            # Only one profiler can be active at a time on some Python versions,
+            # in which case the request is traced without the function breakdown.
+            # Cooperative workers run every request on the same thread, so a profiler would also record
+            # the other requests running while this one waits, and only the trace is kept.
+            try:
+                if not Context.is_cooperative():
+                    profiler = cProfile.Profile()
+                    profiler.enable()
+            except ValueError:
+                profiler = None
+        setattr(flask.g, cls.STATE_ATTRIBUTE, (time.perf_counter(), reason, profiler))
+
+    # The duration is measured until the response headers are sent
+    @classmethod
+    def __after_request(cls, response: flask.Response) -> flask.Response:
+        state = flask.g.pop(cls.STATE_ATTRIBUTE, None)
+        if state is None:
+            return response
+        start, reason, profiler = state
+        if profiler is not None:
+            profiler.disable()
+
+        seconds = time.perf_counter() - start
+        threshold = flask.current_app.config["SLOW_REQUEST_THRESHOLD"]
+        if reason is None and (threshold is None or seconds < threshold):
+            return response
+
+        capture = {
+            "id": next(cls.__ids),
+            "reason": reason or "slow",
+            "time": time.time(),
+            "method": flask.request.method,
+            "path": flask.request.full_path.rstrip("?"),
+            "endpoint": flask.request.endpoint,
+            "status": response.status_code,
+            "seconds": seconds,
+            "counters": RequestScope.counters(),
+            "profile": cls.__format_profile(profiler) if profiler is not None else None,
+            "trace": RequestScope.get_trace()
+        }
+        with cls.__lock:
+            cls.__captures.append(capture)
+        if reason is not None:
+            response.headers[cls.PROFILE_ID_HEADER] = str(capture["id"])
+        return response
+
+    # Returns the functions with the highest cumulative time
+    @classmethod
+    def __format_profile(cls, profiler: cProfile.Profile) -> str:
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream = output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(flask.current_app.config["PROFILING_TOP_FUNCTIONS"])
+        return output.getvalue()
@@ -0,0 +1,155 @@
+from itertools import chain
+from threading import BoundedSemaphore, Lock
+from typing import Iterator
+import os
+import time
+import flask
+import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.datastructures import MultiDict
+from caching import CachedResponse
+from core import Context
+from metrics import Metrics
+
+
+# Proxy towards the sensor API, sharing a pool of keep-alive connections within each process
+class SensorProxy:
+    __pid: int = None
+    __session: requests.Session = None
+    __streams: BoundedSemaphore = None
+    __lock: Lock = Lock()
+
+    # Metrics
+    __requests: int = 0
+    __errors: int = 0
+    __total_seconds: float = 0.0
+    __max_seconds: float = 0.0
+
+    # Returns the HTTP session of this process, creating it on first use since sockets must not be
+    # shared with forked workers
+    @classmethod
+    def session(cls) -> requests.Session:
+        with cls.__lock:
+            if cls.__pid != os.getpid():
+                config = Context.app().config
+                adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = config["SENSOR_API_POOL_SIZE"])
+                cls.__session = requests.Session()
+                cls.__session.mount("http://", adapter)
+                cls.__session.mount("https://", adapter)
+                cls.__streams = BoundedSemaphore(config["SENSOR_API_MAX_STREAMS"])
+                cls.__pid = os.getpid()
+            return cls.__session
+
+    # Closes the HTTP session, configured for the former application, and clears the metrics
+    @classmethod
+    def reset(cls):
+        with cls.__lock:
+            if cls.__session is not None and cls.__pid == os.getpid():
+                cls.__session.close()
+            cls.__pid = cls.__session = cls.__streams = None
+            cls.__requests = cls.__errors = 0
+            cls.__total_seconds = cls.__max_seconds = 0.0
+
+    # Sends a GET request to the sensor API with the configured timeouts
+    # The recorded latency is the time until the response headers are received
+    @classmethod
+    def get(cls, path: str, params: MultiDict, stream: bool = False) -> requests.Response:
+        config = Context.app().config
+        start = time.perf_counter()
+        try:
+            response = cls.session().get(config["SENSOR_API_URL"] + path, params = params, stream = stream,
+                                         timeout = (config["SENSOR_API_CONNECT_TIMEOUT"], config["SENSOR_API_READ_TIMEOUT"]))
+        except requests.RequestException:
+            cls.__record(time.perf_counter() - start, error = True)
+            raise
+        cls.__record(time.perf_counter() - start)
+        return response
+
+    # Reads the whole upstream response, turning upstream failures into error responses.
+    # Responses larger than "max_bytes" are not buffered any further, they are streamed to the client
+    # as stream() does and returned as a flask.Response.
+    @classmethod
+    def fetch(cls, path: str, params: MultiDict, max_bytes: int) -> CachedResponse | flask.Response:
+        try:
+            upstream = cls.get(path, params, stream = True)
+        except requests.Timeout:
+            return CachedResponse(504, "application/json", b'{"msg": "Sensor API timed out"}')
+        except requests.RequestException:
+            return CachedResponse(502, "application/json", b'{"msg": "Sensor API unreachable"}')
+
+        chunks, size = [], 0
+        upstream_chunks = upstream.iter_content(chunk_size = Context.app().config["SENSOR_API_CHUNK_SIZE"])
+        try:
+            for chunk in upstream_chunks:
+                Metrics.count_upstream_bytes(len(chunk))
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > max_bytes:
+                    break
+        except requests.RequestException:
+            upstream.close()
+            return CachedResponse(502, "application/json", b'{"msg": "Sensor API unreachable"}')
+
+        if size <= max_bytes:
+            upstream.close()
+            return CachedResponse(upstream.status_code, upstream.headers.get("Content-Type"), b"".join(chunks))
+
+        # Too large to be cached, the chunks read so far are sent first
+        if not cls.__streams.acquire(blocking = False):
+            upstream.close()
+            return CachedResponse(503, "application/json", b'{"msg": "Too many open sensor streams, retry later"}')
+        return cls.__forward(upstream, chain(chunks, cls.__count_bytes(upstream_chunks)))
+
+    # Returns the number of upstream requests and their latency within this worker
+    @classmethod
+    def stats(cls) -> dict[str, int | float]:
+        with cls.__lock:
+            return {
+                "requests": cls.__requests,
+                "errors": cls.__errors,
+                "mean_seconds": cls.__total_seconds / cls.__requests if cls.__requests else 0.0,
+                "max_seconds": cls.__max_seconds
+            }
+
+    @classmethod
+    def __record(cls, seconds: float, error: bool = False):
+        Metrics.observe_upstream(seconds, error)
+        with cls.__lock:
+            cls.__requests += 1
+            cls.__errors += error
+            cls.__total_seconds += seconds
+            cls.__max_seconds = max(cls.__max_seconds, seconds)
+
+    # Forwards the upstream response to the client chunk by chunk, as soon as each chunk arrives
+    @classmethod
+    def stream(cls, path: str, params: MultiDict) -> flask.Response:
+        cls.session()
+        if not cls.__streams.acquire(blocking = False):
+            return flask.jsonify(msg = "Too many open sensor streams, retry later"), 503, {"Retry-After": 1}
+
+        try:
+            upstream = cls.get(path, params, stream = True)
+        except requests.Timeout:
+            cls.__streams.release()
+            return flask.jsonify(msg = "Sensor API timed out"), 504
+        except requests.RequestException:
+            cls.__streams.release()
+            return flask.jsonify(msg = "Sensor API unreachable"), 502
+
+        return cls.__forward(upstream, cls.__count_bytes(upstream.iter_content(chunk_size = Context.app().config["SENSOR_API_CHUNK_SIZE"])))
+
+    # Returns a response sending the chunks of the upstream response, which holds a stream slot
+    @classmethod
+    def __forward(cls, upstream: requests.Response, chunks: Iterator[bytes]) -> flask.Response:
+        response = flask.Response(chunks, status = upstream.status_code, content_type = upstream.headers.get("Content-Type"))
+
+        # Releases the upstream connection back to the session pool once the client is done
+        response.call_on_close(upstream.close)
+        response.call_on_close(cls.__streams.release)
+        return response
+
+    @classmethod
+    def __count_bytes(cls, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            Metrics.count_upstream_bytes(len(chunk))
+            yield chunk
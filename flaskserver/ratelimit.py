@@ -0,0 +1,118 @@
+from functools import wraps
+from hashlib import sha1
+from threading import Lock
+import logging
+import math
+import flask
+from flask_jwt_extended import get_jwt_identity
+from redis import RedisError
+from core import Context
+
+logger = logging.getLogger(__name__)
+
+# Token bucket of LIMIT tokens, refilled evenly over PERIOD seconds, checked and updated atomically.
+# The time of the Redis server is used, so that every worker shares the same clock.
+# Returns 1 if a token was taken, or 0 and the seconds until the next token is available.
+RATE_LIMIT_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or limit
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(limit, tokens + math.max(now - updated, 0) * limit / period)
+
+local allowed = tokens >= 1
+if allowed then
+    tokens = tokens - 1
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(period))
+
+if allowed then
+    return {1, "0"}
+end
+return {0, tostring((1 - tokens) * period / limit)}
+"""
+
+
+# Rate limiter shared by every worker through Redis. The limits of each route are listed in RATE_LIMITS
+# by endpoint, as rules with the key the requests are counted by ("ip", "username" or "user"),
+# the number of requests allowed and the period in seconds they are refilled over.
+class RateLimiter:
+    KEY_PREFIX: str = "rate_limit"
+
+    # Metrics
+    __lock: Lock = Lock()
+    __allowed: int = 0
+    __rejected: int = 0
+    __errors: int = 0
+
+    # Checks the rules of the current endpoint, returning the seconds to wait before retrying if any is exceeded,
+    # or None. If Redis cannot be reached, requests are let through when RATE_LIMIT_FAIL_OPEN is enabled.
+    @classmethod
+    def check(cls) -> float:
+        config = Context.app().config
+        rules: list[dict[str, any]] = config["RATE_LIMITS"].get(flask.request.endpoint, [])
+        if not config["RATE_LIMIT_ENABLED"] or not rules:
+            return None
+
+        script = Context.redis().register_script(RATE_LIMIT_SCRIPT)
+        retry_after = None
+        for rule in rules:
+            value = cls.__get_key_value(rule["key"])
+            if value is None:
+                continue
+            try:
+                allowed, wait = script(keys = [f"{cls.KEY_PREFIX}:{flask.request.endpoint}:{rule['key']}:{value}"],
+                                       args = [rule["limit"], rule["period"]])
+            except RedisError as exception:
+                logger.warning("Rate limit of %s not checked: %s", flask.request.endpoint, exception)
+                with cls.__lock:
+                    cls.__errors += 1
+                if config["RATE_LIMIT_FAIL_OPEN"]:
+                    continue
+                allowed, wait = 0, 1
+            if not int(allowed):
+                retry_after = max(retry_after or 0, float(wait))
+
+        with cls.__lock:
+            if retry_after is None:
+                cls.__allowed += 1
+            else:
+                cls.__rejected += 1
+        return retry_after
+
+    # Returns the number of checked and rejected requests of this worker
+    @classmethod
+    def stats(cls) -> dict[str, int]:
+        with cls.__lock:
+            return {"allowed": cls.__allowed, "rejected": cls.__rejected, "redis_errors": cls.__errors}
+
+    # Usernames are hashed, so that the length of the key does not depend on the request.
+    # The address is the one of the client forwarded by the trusted proxies (see PROXY_TRUSTED_HOPS).
+    @classmethod
+    def __get_key_value(cls, key: str) -> str:
+        if key == "ip":
+            return flask.request.remote_addr
+        if key == "username":
+            username = flask.request.form.get("username")
+            return sha1(username.encode("utf-8")).hexdigest() if username else None
+        if key == "user":
+            user_id = get_jwt_identity()
+            return str(user_id) if user_id is not None else None
+        raise ValueError(f"Unknown rate limit key: {key}")
+
+
+# Decorator rejecting the requests exceeding the limits of the route with a 429 and a Retry-After header.
+# Limits keyed by "user" need the token to be verified first, so the decorator goes below verify_token or allow.
+def rate_limit(f):
+    @wraps(f)
+    def decorator_function(*args, **kwargs):
+        retry_after = RateLimiter.check()
+        if retry_after is not None:
+            return flask.jsonify(msg = "Too many requests, retry later"), 429, {"Retry-After": max(math.ceil(retry_after), 1)}
+        return f(*args, **kwargs)
+    return decorator_function
@@ -0,0 +1,35 @@
+import argparse
+import json
+import random
+import time
+import flask
+
+# Local stand-in for the sensor API, to run the monitoring and querying routes without the remote server.
+# Start it with "python sensor_stub.py" and set SENSOR_API_URL to "http://127.0.0.1:63429".
+app = flask.Flask(__name__)
+
+# Streams "count" newline-delimited JSON readings, one every "interval" seconds
+@app.route("/api/data", methods=["GET"])
+def data():
+    count = flask.request.args.get("count", 10, type = int)
+    interval = flask.request.args.get("interval", 0.0, type = float)
+    area_id = flask.request.args.get("area_id", 1, type = int)
+
+    def generate():
+        for index in range(count):
+            yield json.dumps({
+                "area_id": area_id,
+                "sensor": index % 8,
+                "timestamp": time.time(),
+                "value": round(random.uniform(0, 100), 2)
+            }) + "\n"
+            if interval > 0:
+                time.sleep(interval)
+
+    return flask.Response(generate(), content_type = "application/x-ndjson")
+
+# Entry point for the stub
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Sensor API stub")
+    parser.add_argument("--port", type = int, default = 63429)
+    app.run(port = parser.parse_args().port, threaded = True)
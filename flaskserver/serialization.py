@@ -0,0 +1,70 @@
+from datetime import date
+from decimal import Decimal
+from uuid import UUID
+import dataclasses
+from flask import Flask, Response
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+# orjson is optional, the default provider of Flask is used if it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# JSON provider backed by orjson, producing the same output as the default provider of Flask:
+# dates as HTTP dates, sorted keys and dataclasses, including the models, as objects of their fields.
+# Values orjson cannot encode, such as integers larger than 64 bits, are left to the default provider,
+# and so are the documents with non-ASCII characters while ensure_ascii is set, as it is by default,
+# since orjson cannot escape them.
+class OrjsonProvider(DefaultJSONProvider):
+    # Creates the provider if orjson is installed and selected by JSON_PROVIDER, or returns None
+    @classmethod
+    def create(cls, app: Flask) -> "OrjsonProvider":
+        if orjson is None or app.config["JSON_PROVIDER"] != "orjson":
+            return None
+        return cls(app)
+
+    def dumps(self, obj: any, **kwargs: any) -> str:
+        return self.dumps_bytes(obj, **kwargs).decode("utf-8")
+
+    def dumps_bytes(self, obj: any, **kwargs: any) -> bytes:
+        if set(kwargs) - {"indent", "separators"}:
+            return super().dumps(obj, **kwargs).encode("utf-8")
+
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        try:
+            body = orjson.dumps(obj, default = self.__default, option = option)
+        except TypeError:
+            return super().dumps(obj, **kwargs).encode("utf-8")
+        if self.ensure_ascii and not body.isascii():
+            return super().dumps(obj, **kwargs).encode("utf-8")
+        return body
+
+    def loads(self, s: str | bytes, **kwargs: any) -> any:
+        return orjson.loads(s) if not kwargs else super().loads(s, **kwargs)
+
+    # Writes the body directly as bytes, without going through a str
+    def response(self, *args: any, **kwargs: any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumps_bytes(obj, indent = 2 if indent else None) + b"\n", mimetype = self.mimetype)
+
+    # Serializes the values orjson passes through as the default provider of Flask does.
+    # Dataclasses are serialized field by field, without the deep copy of dataclasses.asdict.
+    @staticmethod
+    def __default(obj: any) -> any:
+        if isinstance(obj, date):
+            return http_date(obj)
+        if isinstance(obj, (Decimal, UUID)):
+            return str(obj)
+        if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+            return {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+        if hasattr(obj, "__html__"):
+            return str(obj.__html__())
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
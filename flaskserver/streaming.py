@@ -0,0 +1,144 @@
+from hashlib import sha1
+from typing import Iterable, Iterator
+import csv
+import io
+import json
+import zlib
+import flask
+
+# Brotli is optional, responses are only gzip encoded if it is not installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Export formats and their content types
+EXPORT_FORMATS: dict[str, str] = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+
+# Encodes rows as newline-delimited JSON, one line per row
+def iter_ndjson(rows: Iterable[dict[str, any]]) -> Iterator[bytes]:
+    for row in rows:
+        yield (json.dumps(row, default = str) + "\n").encode("utf-8")
+
+# Encodes rows as CSV, starting with a header line
+def iter_csv(rows: Iterable[dict[str, any]], fieldnames: list[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames = fieldnames)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+# Compresses a stream of chunks with gzip without buffering the whole stream.
+# With flush_chunks, every input chunk is sent to the client as soon as it is compressed.
+def iter_gzip(chunks: Iterable[bytes], level: int = 6, flush_chunks: bool = False) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if flush_chunks:
+            compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+# Compresses a stream of chunks with brotli, flushing every chunk like iter_gzip
+def iter_brotli(chunks: Iterable[bytes], quality: int = 4, flush_chunks: bool = False) -> Iterator[bytes]:
+    compressor = brotli.Compressor(quality = quality)
+    for chunk in chunks:
+        compressed = compressor.process(chunk)
+        if flush_chunks:
+            compressed += compressor.flush()
+        if compressed:
+            yield compressed
+    yield compressor.finish()
+
+# Tells whether the client of the current request accepts gzip encoded responses
+def accepts_gzip() -> bool:
+    return flask.request.accept_encodings["gzip"] > 0
+
+# Returns the encoding preferred by the client among the supported ones, or None
+def negotiate_encoding() -> str:
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return flask.request.accept_encodings.best_match(supported)
+
+# Compresses the chunks with the given encoding and level, flushing every chunk so that streams are not delayed.
+# The source is closed with the response, since closing a generator does not close the one it reads from.
+def iter_encoded(chunks: Iterable[bytes], encoding: str, level: int) -> Iterator[bytes]:
+    try:
+        if encoding == "br":
+            yield from iter_brotli(chunks, level, flush_chunks = True)
+        else:
+            yield from iter_gzip(chunks, level, flush_chunks = True)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+# Returns a 304 Not Modified response if the client already has the representation of "etag", or None.
+# Lets a view holding a cheap validator answer before building its response. The ETag is weak,
+# like those of compress_response, so that the 200 and 304 responses carry the same one.
+def not_modified_response(etag: str) -> flask.Response:
+    if flask.request.method not in ("GET", "HEAD") or not flask.request.if_none_match.contains_weak(etag):
+        return None
+    response = flask.Response(status = 304)
+    response.set_etag(etag, weak = True)
+    response.vary.add("Accept-Encoding")
+    return response
+
+# Adds a weak ETag to the successful JSON responses, answering 304 Not Modified when it matches,
+# then compresses the responses of a compressible type with the encoding preferred by the client.
+# Buffered responses smaller than COMPRESSION_MIN_SIZE are sent as they are, streams are compressed chunk by chunk.
+def compress_response(response: flask.Response) -> flask.Response:
+    config = flask.current_app.config
+    if not config["COMPRESSION_ENABLED"] or response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+
+    if not response.is_streamed:
+        if (response.status_code == 200 and response.mimetype == "application/json" 
+                and flask.request.method in ("GET", "HEAD") and response.get_etag() == (None, None)):
+            response.set_etag(sha1(response.get_data()).hexdigest(), weak = True)
+            response.make_conditional(flask.request)
+        if response.content_length is not None and response.content_length < config["COMPRESSION_MIN_SIZE"]:
+            return response
+
+    if (response.status_code < 200 or response.status_code in (204, 304) 
+            or response.mimetype not in config["COMPRESSION_MIMETYPES"] or "no-transform" in response.cache_control):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    # The encoded representation has different bytes, so its ETag can only be weak. Views setting
+    # their own ETag set it weak already, so that it does not depend on the negotiated encoding.
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak = True)
+
+    level = config["COMPRESSION_BROTLI_QUALITY"] if encoding == "br" else config["COMPRESSION_LEVEL"]
+    response.headers["Content-Encoding"] = encoding
+    if response.is_streamed:
+        response.response = iter_encoded(response.response, encoding, level)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(b"".join(iter_encoded([response.get_data()], encoding, level)))
+    return response
+
+# Builds a response streaming the rows in the requested format, gzip encoded if the client accepts it.
+# The request context is kept alive until the last row has been sent, so that the rows can be read lazily.
+def build_export_response(rows: Iterable[dict[str, any]], fieldnames: list[str], export_format: str, filename: str) -> flask.Response:
+    chunks = iter_csv(rows, fieldnames) if export_format == "csv" else iter_ndjson(rows)
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{export_format}"', "Vary": "Accept-Encoding"}
+
+    if accepts_gzip():
+        chunks = iter_gzip(chunks)
+        headers["Content-Encoding"] = "gzip"
+
+    return flask.Response(flask.stream_with_context(chunks), content_type = EXPORT_FORMATS[export_format], headers = headers)
@@ -1,93 +1,450 @@
+import csv
+from hashlib import sha1
+import io
+import json
+import logging
+from typing import Callable
+import flask
+from werkzeug.datastructures import MultiDict
 from flask_jwt_extended import create_access_token, create_refresh_token, decode_token
-from core import Context
-from models import UserRole
+from redis.client import Pipeline
+from redis.exceptions import NoScriptError
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from caching import CachedJSON, CacheInvalidator, LRUCache, build_cached_json
+from core import REDIS_UNAVAILABLE_ERRORS, Context, RequestScope
+from models import InvalidQueryException, InvalidRequestBodyException, Machine, User, UserCredentials, UserRole
+
+logger = logging.getLogger(__name__)
+
+# Saves the roles of a user unless they are already saved, which is the case if their version,
+# a hash of their content, is unchanged. The other workers are told to drop their cached roles only if they changed.
+# Returns 1 if the roles were written, 0 otherwise.
+SAVE_ROLES_SCRIPT = """
+if redis.call("HGET", KEYS[1], ARGV[2]) == ARGV[4] then
+    return 0
+end
+redis.call("HSET", KEYS[1], ARGV[1], ARGV[3], ARGV[2], ARGV[4])
+redis.call("PUBLISH", ARGV[5], ARGV[6])
+return 1
+"""
+
+# Moves the legacy "user_{id}:*" keys of a user into the per-user hash.
+# Fields already present in the hash are newer than the legacy keys and are kept.
+MIGRATE_LEGACY_KEYS_SCRIPT = """
+local access_token = redis.call("GET", KEYS[2])
+local refresh_token = redis.call("GET", KEYS[3])
+local roles = redis.call("LRANGE", KEYS[4], 0, -1)
+if not access_token and not refresh_token and #roles == 0 then
+    return 0
+end
+if access_token then
+    redis.call("HSETNX", KEYS[1], ARGV[1], access_token)
+end
+if refresh_token then
+    redis.call("HSETNX", KEYS[1], ARGV[2], refresh_token)
+end
+if #roles > 0 then
+    redis.call("HSETNX", KEYS[1], ARGV[3], cjson.encode(roles))
+end
+local ttl = math.max(redis.call("PTTL", KEYS[2]), redis.call("PTTL", KEYS[3]), redis.call("PTTL", KEYS[4]))
+local current_ttl = redis.call("PTTL", KEYS[1])
+if ttl > 0 and (current_ttl < 0 or ttl > current_ttl) then
+    redis.call("PEXPIRE", KEYS[1], ttl)
+end
+redis.call("DEL", KEYS[2], KEYS[3], KEYS[4])
+return 1
+"""
+
+# Scripts queued on pipelines, loaded again if Redis does not know them
+PIPELINE_SCRIPTS: tuple[str] = (SAVE_ROLES_SCRIPT, MIGRATE_LEGACY_KEYS_SCRIPT)
 
 # Redis utilities
 class RedisUtils:
-    # Generates the redis key for the access 
+    ACCESS_TOKEN_FIELD: str = "access_token_identifier"
+    REFRESH_TOKEN_FIELD: str = "refresh_token_identifier"
+    ROLES_FIELD: str = "roles"
+    ROLE_VERSION_FIELD: str = "role_version"
+
+    __role_cache_invalidator: CacheInvalidator = None
+    __token_cache_invalidator: CacheInvalidator = None
+
+    # Generates the redis key of the hash holding the tokens and the roles of a user
+    @classmethod
+    def get_user_key(cls, user_id: int) -> str:
+        return f"user_{user_id}"
+
+    # Generates the legacy redis key for the access token
     @classmethod
     def get_access_token_key(cls, user_id: int) -> str:
         return f"user_{user_id}:access_token_identifier"
-    
-    # Generates the redis key for the refresh token
+
+    # Generates the legacy redis key for the refresh token
     @classmethod
     def get_refresh_token_key(cls, user_id: int) -> str:
         return f"user_{user_id}:refresh_token_identifier"
-    
-    # Generates the redis key for the roles
+
+    # Generates the legacy redis key for the roles
     @classmethod
     def get_roles_key(cls, user_id: int) -> str:
         return f"user_{user_id}:roles"
-    
+
+    # Expiration of the user hash, which must outlive both tokens
+    @classmethod
+    def get_user_key_expiration(cls):
+        return Context.app().config["JWT_REFRESH_TOKEN_EXPIRES"] + Context.app().config["JWT_ACCESS_TOKEN_EXPIRES"]
+
     # Returns the access token for the specified user
     @classmethod
     def get_access_token(cls, user_id: int) -> str:
-        return Context.redis().get(cls.get_access_token_key(user_id))
-    
+        return cls.get_token_and_roles(user_id)[0]
+
     # Returns the refresh token for the specified user
     @classmethod
     def get_refresh_token(cls, user_id: int) -> str:
-        return Context.redis().get(cls.get_refresh_token_key(user_id))
+        return cls.get_token_and_roles(user_id, refresh = True)[0]
+
+    # Returns the access or refresh token and the roles of a user with a single round trip,
+    # caching the roles so that the authorization check does not hit Redis again.
+    # With the local revocation mode, the tokens are also cached and no round trip is needed.
+    # Within a request, Redis is read at most once.
+    # If Redis is unavailable and REDIS_DEGRADED_MODE is "fallback", the token is assumed to be "default",
+    # so that revocations are not enforced meanwhile unless the local revocation mode has cached the user's tokens,
+    # and the roles come from the local cache or the database.
+    @classmethod
+    def get_token_and_roles(cls, user_id: int, refresh: bool = False, default: str = None) -> tuple[str, list[str]]:
+        try:
+            return cls.__get_token_and_roles(user_id, refresh)
+        except REDIS_UNAVAILABLE_ERRORS as exception:
+            if not cls.is_fallback_enabled():
+                raise
+            logger.debug("Redis unavailable, not checking the revocation of the token of user %s: %s", user_id, exception)
+        return default, cls.get_roles(user_id)
+
+    @classmethod
+    def __get_token_and_roles(cls, user_id: int, refresh: bool) -> tuple[str, list[str]]:
+        tokens: tuple[str, str] = RequestScope.get(cls.__tokens_scope_key(user_id))
+        if tokens is not None:
+            return tokens[1] if refresh else tokens[0], cls.get_roles(user_id)
+
+        local_revocation = Context.app().config["TOKEN_REVOCATION_MODE"] == "local"
+        if local_revocation:
+            tokens = cls.token_cache_invalidator().cache.get(str(user_id))
+            if tokens is not None:
+                RequestScope.set(cls.__tokens_scope_key(user_id), tokens)
+                return tokens[1] if refresh else tokens[0], cls.get_roles(user_id)
+
+        fields = (cls.ACCESS_TOKEN_FIELD, cls.REFRESH_TOKEN_FIELD, cls.ROLES_FIELD, cls.ROLE_VERSION_FIELD)
+        access_token, refresh_token, roles, role_version = Context.redis().hmget(cls.get_user_key(user_id), *fields)
+
+        # Users still stored with the legacy layout are migrated on first access
+        if (access_token is None and refresh_token is None and roles is None 
+                and Context.app().config["REDIS_LEGACY_KEYS_FALLBACK"]):
+            if cls.migrate_legacy_keys(user_id):
+                access_token, refresh_token, roles, role_version = Context.redis().hmget(cls.get_user_key(user_id), *fields)
+
+        roles = cls.__decode_roles(roles)
+        cls.__cache_roles(user_id, roles, role_version)
+        RequestScope.set(cls.__tokens_scope_key(user_id), (access_token, refresh_token))
+        if local_revocation:
+            invalidator = cls.token_cache_invalidator()
+            invalidator.listen(Context.redis())
+            invalidator.cache.set(str(user_id), (access_token, refresh_token))
+        return refresh_token if refresh else access_token, roles
 
     # Saves access token to Redis database
     @classmethod
     def save_access_token(cls, user_id: int, token: str):
-        Context.redis().set(cls.get_access_token_key(user_id), decode_token(token)["jti"], 
-                            ex=Context.app().config["JWT_ACCESS_TOKEN_EXPIRES"])
+        cls.save_session(user_id, access_token = token)
 
     # Saves refresh token to Redis database
     @classmethod
     def save_refresh_token(cls, user_id: int, token: str):
-        Context.redis().set(cls.get_refresh_token_key(user_id), decode_token(token)["jti"], 
-                            ex=Context.app().config["JWT_REFRESH_TOKEN_EXPIRES"])
+        cls.save_session(user_id, refresh_token = token)
 
     # Saves access and refresh tokens to Redis database
     @classmethod
     def save_tokens(cls, user_id: int, access_token: str, refresh_token: str):
-        cls.save_access_token(user_id, access_token)
-        cls.save_refresh_token(user_id, refresh_token)
+        cls.save_session(user_id, access_token, refresh_token)
+
+    # Saves any of the provided tokens and roles with a single round trip.
+    # The roles are only written, and the cached roles invalidated, if they differ from the saved ones.
+    @classmethod
+    def save_session(cls, user_id: int, access_token: str = None, refresh_token: str = None, roles: list[str] = None):
+        mapping: dict[str, str] = {}
+        if access_token is not None:
+            mapping[cls.ACCESS_TOKEN_FIELD] = decode_token(access_token)["jti"]
+        if refresh_token is not None:
+            mapping[cls.REFRESH_TOKEN_FIELD] = decode_token(refresh_token)["jti"]
+        if not mapping and roles is None:
+            return
+        cls.__forget_in_request(user_id)
+
+        # The roles are saved first, so that whether they changed is the first result.
+        # Superseded tokens are revoked in the workers using the local revocation mode too.
+        def queue(pipeline: Pipeline):
+            if roles is not None:
+                cls.queue_script(pipeline, SAVE_ROLES_SCRIPT, [cls.get_user_key(user_id)],
+                                 [cls.ROLES_FIELD, cls.ROLE_VERSION_FIELD, json.dumps(roles), cls.get_version_of_roles(roles),
+                                  cls.role_cache_invalidator().channel, str(user_id)])
+            if mapping:
+                pipeline.hset(cls.get_user_key(user_id), mapping = mapping)
+            cls.__queue_legacy_keys_migration(pipeline, user_id)
+            pipeline.expire(cls.get_user_key(user_id), cls.get_user_key_expiration())
+            if mapping:
+                cls.token_cache_invalidator().invalidate(pipeline, str(user_id))
+
+        results = cls.execute_pipeline(queue)
+        if roles is not None and results[0]:
+            cls.role_cache_invalidator().cache.delete(str(user_id))
 
     # Deletes any saved tokens for the provided user
     @classmethod
     def delete_tokens(cls, user_id: int):
-        Context.redis().delete(cls.get_access_token_key(user_id), cls.get_refresh_token_key(user_id))
+        cls.__forget_in_request(user_id)
+        def queue(pipeline: Pipeline):
+            cls.__queue_legacy_keys_migration(pipeline, user_id)
+            pipeline.hdel(cls.get_user_key(user_id), cls.ACCESS_TOKEN_FIELD, cls.REFRESH_TOKEN_FIELD)
+            cls.token_cache_invalidator().invalidate(pipeline, str(user_id))
+        cls.execute_pipeline(queue)
 
-    # Add roles to the list of roles for a user
+    # Deletes the saved tokens and roles of the provided user with a single round trip,
+    # including the legacy keys, which would otherwise be migrated back into the deleted hash
+    @classmethod
+    def delete_session(cls, user_id: int):
+        cls.__forget_in_request(user_id)
+        pipeline = Context.redis().pipeline()
+        pipeline.delete(cls.get_user_key(user_id), cls.get_access_token_key(user_id),
+                        cls.get_refresh_token_key(user_id), cls.get_roles_key(user_id))
+        cls.token_cache_invalidator().invalidate(pipeline, str(user_id))
+        cls.role_cache_invalidator().invalidate(pipeline, str(user_id))
+        pipeline.execute()
+
+    # Returns the invalidator of the in-process cache of the current token identifiers, used by the local
+    # revocation mode. Entries live at most TOKEN_REVOCATION_MAX_STALENESS seconds, which bounds how long
+    # a revoked token may still be accepted if an invalidation message is lost.
+    @classmethod
+    def token_cache_invalidator(cls) -> CacheInvalidator:
+        if cls.__token_cache_invalidator is None:
+            config = Context.app().config
+            cls.__token_cache_invalidator = CacheInvalidator(
+                LRUCache(config["TOKEN_CACHE_SIZE"], config["TOKEN_REVOCATION_MAX_STALENESS"]), 
+                config["TOKEN_REVOCATION_CHANNEL"])
+        return cls.__token_cache_invalidator
+
+    # Drops the in-process caches, built from the configuration of the former application
+    @classmethod
+    def reset(cls):
+        for invalidator in (cls.__token_cache_invalidator, cls.__role_cache_invalidator):
+            if invalidator is not None:
+                invalidator.close()
+        cls.__token_cache_invalidator = None
+        cls.__role_cache_invalidator = None
+
+    # Returns the invalidator of the in-process roles cache, creating it on first use
+    @classmethod
+    def role_cache_invalidator(cls) -> CacheInvalidator:
+        if cls.__role_cache_invalidator is None:
+            config = Context.app().config
+            cls.__role_cache_invalidator = CacheInvalidator(
+                LRUCache(config["ROLE_CACHE_SIZE"], config["ROLE_CACHE_TTL"]), config["ROLE_CACHE_CHANNEL"])
+        return cls.__role_cache_invalidator
+
+    # Removes the cached roles of a user from every worker process
+    @classmethod
+    def invalidate_cached_roles(cls, user_id: int):
+        cls.__forget_in_request(user_id)
+        cls.role_cache_invalidator().invalidate(Context.redis(), str(user_id))
+
+    # Returns the list of roles for a user, from the in-process cache if possible
     @classmethod
     def get_roles(cls, user_id: int) -> list[str]:
-        roles_key = cls.get_roles_key(user_id)
-        return Context.redis().lrange(roles_key, 0, Context.redis().llen(roles_key))
+        return cls.get_roles_and_version(user_id)[0]
+
+    # Returns the version of the roles of a user, which changes whenever the roles are set or deleted.
+    # Only the version is read from Redis on a cache miss, and it is cached without the roles.
+    # If Redis is unavailable and REDIS_DEGRADED_MODE is "fallback", None is returned.
+    @classmethod
+    def get_role_version(cls, user_id: int) -> str:
+        cached: tuple[tuple[str], str] = RequestScope.get(cls.__roles_scope_key(user_id))
+        if cached is None:
+            cached = cls.role_cache_invalidator().cache.get(str(user_id))
+            if cached is not None:
+                RequestScope.set(cls.__roles_scope_key(user_id), cached)
+        if cached is not None:
+            return cached[1]
+
+        try:
+            role_version = Context.redis().hget(cls.get_user_key(user_id), cls.ROLE_VERSION_FIELD)
+        except REDIS_UNAVAILABLE_ERRORS as exception:
+            if not cls.is_fallback_enabled():
+                raise
+            logger.debug("Redis unavailable, ignoring the role version of user %s: %s", user_id, exception)
+            return None
+        cls.__cache_roles(user_id, None, role_version)
+        return role_version
+
+    # Returns the list of roles for a user and its version, from the request or in-process cache if possible.
+    # If Redis is unavailable and REDIS_DEGRADED_MODE is "fallback", the roles are read from the database,
+    # without a version, so that the roles embedded in tokens are not trusted meanwhile.
+    @classmethod
+    def get_roles_and_version(cls, user_id: int) -> tuple[list[str], str]:
+        cached: tuple[tuple[str], str] = RequestScope.get(cls.__roles_scope_key(user_id))
+        if cached is None:
+            cached = cls.role_cache_invalidator().cache.get(str(user_id))
+            if cached is not None:
+                RequestScope.set(cls.__roles_scope_key(user_id), cached)
+        # Entries cached by get_role_version have no roles
+        if cached is not None and cached[0] is not None:
+            return list(cached[0]), cached[1]
+
+        try:
+            return cls.__get_roles_and_version(user_id)
+        except REDIS_UNAVAILABLE_ERRORS as exception:
+            if not cls.is_fallback_enabled():
+                raise
+            logger.debug("Redis unavailable, reading the roles of user %s from the database: %s", user_id, exception)
+
+        # Kept for the request only, since invalidations cannot be received while Redis is down
+        roles = UserRole.get_rolenames_by_user_id(int(user_id))
+        RequestScope.set(cls.__roles_scope_key(user_id), (tuple(roles), None))
+        return roles, None
+
+    # Tells whether the tokens and roles are checked without Redis while it is unavailable
+    @classmethod
+    def is_fallback_enabled(cls) -> bool:
+        return Context.app().config["REDIS_DEGRADED_MODE"] == "fallback"
+
+    @classmethod
+    def __get_roles_and_version(cls, user_id: int) -> tuple[list[str], str]:
+        fields = (cls.ROLES_FIELD, cls.ROLE_VERSION_FIELD)
+        roles, role_version = Context.redis().hmget(cls.get_user_key(user_id), *fields)
+        if roles is None and Context.app().config["REDIS_LEGACY_KEYS_FALLBACK"]:
+            if cls.migrate_legacy_keys(user_id):
+                roles, role_version = Context.redis().hmget(cls.get_user_key(user_id), *fields)
+
+        roles = cls.__decode_roles(roles)
+        cls.__cache_roles(user_id, roles, role_version)
+        return roles, role_version
+
+    # Returns the version of a list of roles, a hash of its content regardless of the order rather than a counter,
+    # so that it is never reused for different roles when the user hash is deleted and created again
+    @classmethod
+    def get_version_of_roles(cls, roles: list[str]) -> str:
+        return sha1(json.dumps(sorted(roles)).encode("utf-8")).hexdigest()
 
     # Add roles to the list of roles for a user
     @classmethod
     def add_roles(cls, user_id: int, roles: list[str]):
-        Context.redis().rpush(cls.get_roles_key(user_id), *roles)
+        current_roles = cls.get_roles(user_id)
+        cls.set_roles(user_id, current_roles + [role for role in roles if role not in current_roles])
 
     # Deletes a list of roles for a user
     @classmethod
     def delete_roles(cls, user_id: int):
-        Context.redis().delete(cls.get_roles_key(user_id))
+        cls.__forget_in_request(user_id)
+        def queue(pipeline: Pipeline):
+            cls.__queue_legacy_keys_migration(pipeline, user_id)
+            pipeline.hdel(cls.get_user_key(user_id), cls.ROLES_FIELD, cls.ROLE_VERSION_FIELD)
+            cls.role_cache_invalidator().invalidate(pipeline, str(user_id))
+        cls.execute_pipeline(queue)
 
     # Set a new list of roles for a user
     @classmethod
     def set_roles(cls, user_id: int, roles: list[str]):
-        cls.delete_roles(user_id)
-        cls.add_roles(user_id, roles)
-        Context.redis().expire(cls.get_roles_key(user_id), 
-                               Context.app().config["JWT_REFRESH_TOKEN_EXPIRES"] + 
-                               Context.app().config["JWT_ACCESS_TOKEN_EXPIRES"])
+        cls.save_session(user_id, roles = roles)
+
+    # Moves the legacy keys of a user, or of every user if no id is given, into the per-user hashes.
+    # Returns the number of migrated users.
+    @classmethod
+    def migrate_legacy_keys(cls, user_id: int = None) -> int:
+        if user_id is None:
+            user_ids = {key.split(":", 1)[0].removeprefix("user_") for key in Context.redis().scan_iter(match = "user_*:*")}
+        else:
+            user_ids = {user_id}
+
+        script = Context.redis().register_script(MIGRATE_LEGACY_KEYS_SCRIPT)
+        migrated = 0
+        for legacy_user_id in user_ids:
+            migrated += script(
+                keys = [cls.get_user_key(legacy_user_id), cls.get_access_token_key(legacy_user_id),
+                        cls.get_refresh_token_key(legacy_user_id), cls.get_roles_key(legacy_user_id)],
+                args = [cls.ACCESS_TOKEN_FIELD, cls.REFRESH_TOKEN_FIELD, cls.ROLES_FIELD]
+            )
+        return migrated
+
+    # Runs the commands queued by "queue" in a transaction, with a single round trip. If Redis lost the scripts,
+    # after a restart, they are loaded and the commands queued and run again, since they can be repeated.
+    @classmethod
+    def execute_pipeline(cls, queue: Callable[[Pipeline], None]) -> list[any]:
+        pipeline = Context.redis().pipeline()
+        queue(pipeline)
+        try:
+            return pipeline.execute()
+        except NoScriptError:
+            for script in PIPELINE_SCRIPTS:
+                Context.redis().script_load(script)
+        pipeline = Context.redis().pipeline()
+        queue(pipeline)
+        return pipeline.execute()
+
+    # Queues a script of PIPELINE_SCRIPTS as an EVALSHA of its digest. A Script object would make redis-py
+    # check that it is loaded with a SCRIPT EXISTS round trip ahead of every transaction.
+    @classmethod
+    def queue_script(cls, pipeline: Pipeline, script: str, keys: list[str], args: list[any]):
+        pipeline.evalsha(sha1(script.encode("utf-8")).hexdigest(), len(keys), *keys, *args)
+
+    # Migrates the legacy keys of a user in the same transaction as a change to the user hash.
+    # Otherwise, the legacy keys left in place would be migrated once the hash fields are deleted,
+    # bringing back the tokens revoked meanwhile. Fields already in the hash are kept.
+    @classmethod
+    def __queue_legacy_keys_migration(cls, pipeline: Pipeline, user_id: int):
+        if not Context.app().config["REDIS_LEGACY_KEYS_FALLBACK"]:
+            return
+        cls.queue_script(pipeline, MIGRATE_LEGACY_KEYS_SCRIPT,
+                         [cls.get_user_key(user_id), cls.get_access_token_key(user_id),
+                          cls.get_refresh_token_key(user_id), cls.get_roles_key(user_id)],
+                         [cls.ACCESS_TOKEN_FIELD, cls.REFRESH_TOKEN_FIELD, cls.ROLES_FIELD])
+
+    @classmethod
+    def __decode_roles(cls, roles: str) -> list[str]:
+        return json.loads(roles) if roles else []
+
+    # Caches the roles of a user and their version, or only the version if "roles" is None
+    @classmethod
+    def __cache_roles(cls, user_id: int, roles: list[str], role_version: str):
+        entry = (tuple(roles) if roles is not None else None, role_version)
+        invalidator = cls.role_cache_invalidator()
+        invalidator.listen(Context.redis())
+        invalidator.cache.set(str(user_id), entry)
+        RequestScope.set(cls.__roles_scope_key(user_id), entry)
+
+    # Keys of the values memoized for the current request
+    @classmethod
+    def __tokens_scope_key(cls, user_id: int) -> tuple[str, str]:
+        return ("redis_tokens", str(user_id))
+
+    @classmethod
+    def __roles_scope_key(cls, user_id: int) -> tuple[str, str]:
+        return ("redis_roles", str(user_id))
+
+    # Drops the values memoized for the current request, before they are changed
+    @classmethod
+    def __forget_in_request(cls, user_id: int):
+        RequestScope.forget(cls.__tokens_scope_key(user_id), cls.__roles_scope_key(user_id))
 
 
 # Flask utilities
 class FlaskUtils:
-    # Generates a new access token and saves it to Redis database
+    # Generates a new access token and saves it to Redis database, along with the roles if provided
     @classmethod
-    def generate_access_token(cls, user_id: int, fresh: bool = False) -> str:
+    def generate_access_token(cls, user_id: int, fresh: bool = False, roles: list[str] = None) -> str:
         # Creates new access token
-        access_token = create_access_token(identity = user_id, fresh = fresh)
+        role_claims = cls.get_role_claims(user_id, roles)
+        access_token = create_access_token(identity = user_id, fresh = fresh, additional_claims = role_claims)
 
         # Saves access token to redis database
-        RedisUtils.save_access_token(user_id, access_token)
+        RedisUtils.save_session(user_id, access_token = access_token, roles = roles)
 
         return access_token
 
@@ -102,15 +459,206 @@ class FlaskUtils:
 
         return refresh_token
 
-    # Generates new access and refresh tokens and saves them to Redis database
+    # Generates new access and refresh tokens and saves them to Redis database with a single round trip,
+    # along with the roles if provided
     @classmethod
-    def generate_tokens(cls, user_id: int, fresh_access_token: bool = False) -> tuple[str]:
-        access_token = cls.generate_access_token(user_id, fresh_access_token)
-        refresh_token = cls.generate_refresh_token(user_id)
+    def generate_tokens(cls, user_id: int, fresh_access_token: bool = False, roles: list[str] = None) -> tuple[str]:
+        role_claims = cls.get_role_claims(user_id, roles)
+        access_token = create_access_token(identity = user_id, fresh = fresh_access_token, additional_claims = role_claims)
+        refresh_token = create_refresh_token(identity = user_id)
+        RedisUtils.save_session(user_id, access_token, refresh_token, roles)
         return access_token, refresh_token
-    
+
+    # Returns the claims embedding the roles of a user in an access token if JWT_ROLE_CLAIMS is enabled,
+    # either the roles about to be saved or the current ones
+    @classmethod
+    def get_role_claims(cls, user_id: int, roles: list[str] = None) -> dict[str, any]:
+        if not Context.app().config["JWT_ROLE_CLAIMS"]:
+            return {}
+        if roles is not None:
+            return {"roles": roles, "role_version": RedisUtils.get_version_of_roles(roles)}
+        roles, role_version = RedisUtils.get_roles_and_version(user_id)
+        return {"roles": roles, "role_version": role_version}
+
     # Saves user roles that are stored in SQL database in Redis
     @classmethod
     def cache_roles_in_redis(cls, user_id: int):
         RedisUtils.set_roles(user_id, UserRole.get_rolenames_by_user_id(user_id))
-        
\ No newline at end of file
+
+    # Tells whether a listing route has been asked for a page instead of the whole list
+    @classmethod
+    def is_page_request(cls, args: MultiDict, filters: tuple[str] = ()) -> bool:
+        return any(arg in args for arg in ("cursor", "limit", "fields", *filters))
+
+    # Parses the cursor, the page size and the selected fields of a listing route
+    @classmethod
+    def get_page_args(cls, args: MultiDict) -> tuple[int, int, list[str]]:
+        config = Context.app().config
+        try:
+            cursor = int(args["cursor"]) if "cursor" in args else None
+            limit = int(args.get("limit", config["PAGE_DEFAULT_SIZE"]))
+        except ValueError:
+            raise InvalidQueryException
+        if limit < 1 or limit > config["PAGE_MAX_SIZE"]:
+            raise InvalidQueryException
+
+        fields = [field for field in args.get("fields", "").split(",") if field] or None
+        return cursor, limit, fields
+
+    # Parses a batch of rows from the body of the current request, either a JSON list of objects
+    # or a CSV document with a header line
+    @classmethod
+    def get_body_rows(cls, max_rows: int) -> list[dict[str, any]]:
+        request = flask.request
+        if request.mimetype == "text/csv":
+            rows = list(csv.DictReader(io.StringIO(request.get_data(as_text = True))))
+        else:
+            rows = request.get_json(silent = True)
+
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows) or len(rows) > max_rows:
+            raise InvalidRequestBodyException
+        return rows
+
+    # Parses a JSON object from the body of the current request, whatever its content type
+    @classmethod
+    def get_body_object(cls) -> dict[str, any]:
+        data = flask.request.get_json(force = True, silent = True)
+        if not isinstance(data, dict):
+            raise InvalidRequestBodyException
+        return data
+
+    # Parses a required integer query argument
+    @classmethod
+    def get_int_arg(cls, args: MultiDict, name: str) -> int:
+        value = args.get(name, None)
+        if value is None or not value.isascii() or not value.removeprefix("-").isdigit():
+            raise InvalidQueryException
+        return int(value)
+
+    # Parses an optional boolean query argument
+    @classmethod
+    def get_bool_arg(cls, args: MultiDict, name: str) -> bool:
+        value = args.get(name, None)
+        if value is None:
+            return None
+        if value.lower() in ("true", "1"):
+            return True
+        if value.lower() in ("false", "0"):
+            return False
+        raise InvalidQueryException
+
+
+# Cache of the serialized machines of each area, invalidated across workers when the machines change
+class MachineCache:
+    CHANGED_AREAS_KEY: str = "changed_machine_areas"
+
+    __invalidator: CacheInvalidator = None
+
+    # Returns the invalidator of the in-process machines cache, creating it on first use
+    @classmethod
+    def invalidator(cls) -> CacheInvalidator:
+        if cls.__invalidator is None:
+            config = Context.app().config
+            cls.__invalidator = CacheInvalidator(
+                LRUCache(config["MACHINE_CACHE_SIZE"], config["MACHINE_CACHE_TTL"]), config["MACHINE_CACHE_CHANNEL"])
+        return cls.__invalidator
+
+    # Drops the in-process cache, built from the configuration of the former application
+    @classmethod
+    def reset(cls):
+        if cls.__invalidator is not None:
+            cls.__invalidator.close()
+        cls.__invalidator = None
+
+    # Returns the serialized machines of an area, querying the database only on a cache miss.
+    # The area id must be parsed already, so that every spelling of it maps to the same key.
+    @classmethod
+    def get_by_area_id(cls, area_id: int) -> CachedJSON:
+        invalidator = cls.invalidator()
+        invalidator.listen(Context.redis())
+        return invalidator.cache.get_or_set(str(area_id), lambda: build_cached_json(Machine.get_rows_by_area_id(area_id)))
+
+    # Removes the cached machines of the given areas from every worker process
+    @classmethod
+    def invalidate(cls, area_ids: set[int]):
+        for area_id in area_ids:
+            cls.invalidator().invalidate(Context.redis(), str(area_id))
+
+
+# Lookup of the credentials of the users logging in. Usernames found not to exist are remembered by each worker
+# for LOGIN_NEGATIVE_CACHE_TTL seconds, so that floods of logins with unknown usernames do not reach the database.
+# They are forgotten by every worker as soon as a user takes that username.
+class CredentialCache:
+    __invalidator: CacheInvalidator = None
+
+    # Returns the invalidator of the in-process cache of unknown usernames, creating it on first use
+    @classmethod
+    def invalidator(cls) -> CacheInvalidator:
+        if cls.__invalidator is None:
+            config = Context.app().config
+            cls.__invalidator = CacheInvalidator(
+                LRUCache(config["LOGIN_NEGATIVE_CACHE_SIZE"], config["LOGIN_NEGATIVE_CACHE_TTL"]), 
+                config["LOGIN_NEGATIVE_CACHE_CHANNEL"])
+        return cls.__invalidator
+
+    # Drops the in-process cache, built from the configuration of the former application
+    @classmethod
+    def reset(cls):
+        if cls.__invalidator is not None:
+            cls.__invalidator.close()
+        cls.__invalidator = None
+
+    # Returns the credentials and roles of a user, or None if the username does not exist
+    @classmethod
+    def get_by_username(cls, username: str) -> UserCredentials:
+        if not username:
+            return None
+        if Context.app().config["LOGIN_NEGATIVE_CACHE_TTL"] <= 0:
+            return User.get_credentials_by_username(username)
+
+        invalidator = cls.invalidator()
+        invalidator.listen(Context.redis())
+        key = cls.__get_key(username)
+        if invalidator.cache.get(key) is not None:
+            return None
+        credentials = User.get_credentials_by_username(username)
+        if credentials is None:
+            invalidator.cache.set(key, True)
+        return credentials
+
+    # Forgets that the given usernames do not exist, in every worker process, with a single round trip
+    @classmethod
+    def invalidate(cls, usernames: list[str]):
+        if Context.app().config["LOGIN_NEGATIVE_CACHE_TTL"] <= 0 or not usernames:
+            return
+        pipeline = Context.redis().pipeline(transaction = False)
+        for username in usernames:
+            cls.invalidator().invalidate(pipeline, cls.__get_key(username))
+        pipeline.execute()
+
+    # Usernames are hashed, so that the size of the cache does not depend on the requests.
+    # They are case-folded, as they are compared case-insensitively by the database.
+    @classmethod
+    def __get_key(cls, username: str) -> str:
+        return sha1(username.casefold().encode("utf-8")).hexdigest()
+
+
+# Records the areas whose machines are changed by a flush, including the previous area of moved machines
+@event.listens_for(Machine, "after_insert")
+@event.listens_for(Machine, "after_update")
+@event.listens_for(Machine, "after_delete")
+def record_changed_machine_area(_mapper, _connection, machine: Machine):
+    areas: set[int] = inspect(machine).session.info.setdefault(MachineCache.CHANGED_AREAS_KEY, set())
+    history = inspect(machine).attrs.area.history
+    areas.update(area for area in (*history.unchanged, *history.added, *history.deleted) if area is not None)
+
+# Invalidates the recorded areas once the changes are visible to the other workers
+@event.listens_for(Session, "after_commit")
+def invalidate_changed_machine_areas(session: Session):
+    areas: set[int] = session.info.pop(MachineCache.CHANGED_AREAS_KEY, None)
+    if areas:
+        MachineCache.invalidate(areas)
+
+@event.listens_for(Session, "after_rollback")
+def discard_changed_machine_areas(session: Session):
+    session.info.pop(MachineCache.CHANGED_AREAS_KEY, None)
@@ -0,0 +1,4 @@
+from main import create_app
+
+# Application served by "gunicorn -c gunicorn.conf.py wsgi:app", configured from the environment
+app = create_app()
@@ -0,0 +1,90 @@
+import logging
+import os
+import sys
+import threading
+import time
+import fakeredis
+import pytest
+from werkzeug.serving import make_server
+
+# The server modules are imported flat, as gunicorn does from the flaskserver directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "flaskserver"))
+
+import main
+import sensor_stub
+from models import Area, Role, User, UserRole, db
+
+ROLES = ["Dipendente", "Titolare", "Amministratore di sistema"]
+PASSWORD = "password"
+
+
+# Application on a temporary SQLite database and its own fakeredis server, with the areas and roles created.
+# Passwords are hashed inline with few rounds, and the rate limits and metrics are off unless a test overrides them.
+@pytest.fixture
+def config(tmp_path, sensor_url) -> dict[str, any]:
+    return {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+        "SENSOR_API_URL": sensor_url,
+        "BCRYPT_LOG_ROUNDS": 4,
+        "BCRYPT_POOL_SIZE": 0,
+        "RATE_LIMIT_ENABLED": False,
+        "METRICS_ENABLED": False,
+        "LOG_LEVEL": "WARNING"
+    }
+
+# The sensor API stub, served in a background thread for the whole session
+@pytest.fixture(scope = "session")
+def sensor_url() -> str:
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, sensor_stub.app, threaded = True)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+@pytest.fixture
+def redis() -> fakeredis.FakeStrictRedis:
+    return fakeredis.FakeStrictRedis(server = fakeredis.FakeServer(), decode_responses = True)
+
+@pytest.fixture
+def app(config, redis):
+    app = main.create_app(config, redis = redis)
+    with app.app_context():
+        # Only the primary database: the shared extension keeps the binds of the apps created by earlier tests
+        db.create_all(bind_key = None)
+        db.session.add_all([Role(rolename = role) for role in ROLES] + [Area(id = 1), Area(id = 2)])
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Creates a user with the given roles, returning its id
+def create_user(app, username: str, roles: list[str] = ()) -> int:
+    with app.app_context():
+        user_id = User.insert(username, PASSWORD)
+        for role in roles:
+            UserRole.insert(user_id, role)
+        return user_id
+
+# Logs a user in, returning its tokens
+def login(client, username: str) -> dict[str, str]:
+    response = client.post("/login", data = {"username": username, "password": PASSWORD})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def bearer(token: str) -> dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
+
+# Polls until the condition holds, since invalidations from other workers arrive on a subscriber thread
+def wait_until(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
@@ -0,0 +1,32 @@
+import fakeredis
+import main
+from conftest import create_user, login
+from core import Context
+from utilities import CredentialCache
+
+
+# A second application must not keep the caches and clients built from the configuration of the first one
+def test_applications_start_over(app, config, client):
+    with app.app_context():
+        first_cache = CredentialCache.invalidator().cache
+        first_redis = Context.redis()
+
+    redis = fakeredis.FakeStrictRedis(server = fakeredis.FakeServer(), decode_responses = True)
+    second = main.create_app({**config, "LOGIN_NEGATIVE_CACHE_SIZE": 7}, redis = redis)
+    with second.app_context():
+        assert Context.app() is second
+        assert Context.redis() is redis and redis is not first_redis
+        cache = CredentialCache.invalidator().cache
+        assert cache is not first_cache and cache.max_size == 7
+
+        create_user(second, "alice")
+        login(second.test_client(), "alice")
+        assert redis.keys()
+
+# Importing the module does not connect to the database nor to Redis
+def test_wsgi_module_creates_the_application(monkeypatch, tmp_path):
+    monkeypatch.setenv("FLASKSERVER_SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'wsgi.db'}")
+    monkeypatch.setenv("FLASKSERVER_REDIS_URL", "redis://127.0.0.1:1/0")
+    import wsgi
+    assert wsgi.app is Context.app()
+    assert wsgi.app.config["REDIS_URL"] == "redis://127.0.0.1:1/0"
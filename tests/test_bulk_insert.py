@@ -0,0 +1,72 @@
+import pytest
+from conftest import bearer, create_user, login
+from hashing import PasswordHasher
+from models import Role, User, UserRole, db
+
+
+@pytest.fixture
+def token(app, client) -> str:
+    create_user(app, "admin", ["Amministratore di sistema"])
+    return login(client, "admin")["access_token"]
+
+
+def test_rows_are_validated_before_inserting(app, client, token):
+    rows = [
+        {"username": "Alice", "password": "secret1", "rolename": "Titolare"},
+        {"username": "alice", "password": "secret1"},
+        {"username": "carl", "password": "secret1", "rolename": "x" * 31},
+        {"username": "d" * 31, "password": "secret1"},
+        {"username": "ed", "password": "secret1"},
+        {"username": "fred", "password": "short"},
+        {"password": "secret1"}
+    ]
+    response = client.post("/insert-users", json = rows, headers = bearer(token))
+    assert response.status_code == 200
+    reports = response.get_json()["results"]
+    assert "id" in reports[0]
+    assert [report.get("error") for report in reports[1:]] == [
+        "The given username is already in use",
+        "The given role name must be at most 30 characters long",
+        "The given username must be at most 30 characters long",
+        "The given username must be at least 3 characters long",
+        "The given password must be at least 6 characters long",
+        "Bad request: missing username field"
+    ]
+    with app.app_context():
+        assert UserRole.get_rolenames_by_user_id(reports[0]["id"]) == ["Titolare"]
+        assert User.query.count() == 2
+
+# Missing roles are created in the same transaction, once each
+def test_missing_roles_are_created(app, client, token):
+    rows = [{"username": "amy", "password": "secret1", "rolename": "Manutentore"},
+            {"username": "bob", "password": "secret1", "rolename": "Manutentore"},
+            {"username": "carl", "password": "secret1", "rolename": "Titolare"}]
+    reports = client.post("/insert-users", json = rows, headers = bearer(token)).get_json()["results"]
+    with app.app_context():
+        assert sorted(Role.get_rolenames()) == ["Amministratore di sistema", "Dipendente", "Manutentore", "Titolare"]
+        assert [UserRole.get_rolenames_by_user_id(report["id"]) for report in reports] == [["Manutentore"], ["Manutentore"], ["Titolare"]]
+
+def test_created_users_can_log_in(client, token):
+    rows = [{"username": f"user{index}", "password": "secret1"} for index in range(3)]
+    assert client.post("/insert-users", json = rows, headers = bearer(token)).status_code == 200
+    assert client.post("/login", data = {"username": "user2", "password": "secret1"}).status_code == 200
+
+# A username taken between the validation and the insert rolls the whole batch back
+def test_conflicting_concurrent_inserts_answer_409(app, client, token, monkeypatch):
+    generate_password_hashes = PasswordHasher.generate_password_hashes
+    def generate_and_take_username(passwords: list[str]) -> list[str]:
+        db.session.add(User(username = "bob", password = "x"))
+        db.session.commit()
+        return generate_password_hashes(passwords)
+    monkeypatch.setattr(PasswordHasher, "generate_password_hashes", generate_and_take_username)
+
+    rows = [{"username": "amy", "password": "secret1"}, {"username": "bob", "password": "secret1"}]
+    response = client.post("/insert-users", json = rows, headers = bearer(token))
+    assert response.status_code == 409
+    assert response.get_json()["exceptionType"] == "BulkInsertConflictException"
+    with app.app_context():
+        assert User.get_by_username("amy") is None
+
+def test_batches_over_the_limit_are_rejected(app, client, token):
+    rows = [{"username": f"user{index}", "password": "secret1"} for index in range(app.config["BULK_INSERT_MAX_ROWS"] + 1)]
+    assert client.post("/insert-users", json = rows, headers = bearer(token)).status_code == 400
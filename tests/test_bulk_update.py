@@ -0,0 +1,48 @@
+import pytest
+from conftest import bearer, create_user, login
+from models import Task, db
+
+
+@pytest.fixture
+def tasks(app, client) -> tuple[str, list[int], int]:
+    alice, bob = create_user(app, "alice", ["Dipendente"]), create_user(app, "bob", ["Dipendente"])
+    with app.app_context():
+        owned = [Task(area = 1, user = str(alice), description = f"Task {index}") for index in range(3)]
+        other = Task(area = 1, user = str(bob), description = "Not mine")
+        db.session.add_all([*owned, other])
+        db.session.commit()
+        return login(client, "alice")["access_token"], [task.id for task in owned], other.id
+
+def get_states(app, task_ids: list[int]) -> list[bool]:
+    with app.app_context():
+        return [db.session.get(Task, task_id).completed for task_id in task_ids]
+
+
+def test_states_are_updated_together(app, client, tasks):
+    token, owned, _other = tasks
+    body = [{"task_id": owned[0], "completed": True}, {"task_id": owned[2], "completed": True}]
+    assert client.put("/user-tasks-update", json = body, headers = bearer(token)).status_code == 200
+    assert get_states(app, owned) == [True, False, True]
+
+def test_no_state_is_updated_if_a_task_belongs_to_someone_else(app, client, tasks):
+    token, owned, other = tasks
+    body = [{"task_id": owned[0], "completed": True}, {"task_id": other, "completed": True}]
+    response = client.put("/user-tasks-update", json = body, headers = bearer(token))
+    assert response.status_code == 403 and response.get_json()["task_ids"] == [other]
+    assert get_states(app, [*owned, other]) == [False, False, False, False]
+
+@pytest.mark.parametrize("body", ['[{"task_id": "1", "completed": true}]', '{"task_id": 1}', "not json"])
+def test_invalid_bodies_are_rejected(client, tasks, body):
+    response = client.put("/user-tasks-update", data = body, content_type = "application/json", headers = bearer(tasks[0]))
+    assert response.status_code == 400
+
+# The single task update only accepts JSON, with or without its content type, and no Python literals
+@pytest.mark.parametrize("body, status", [
+    ('{"task_id": %d, "completed": true}', 200),
+    ("{'task_id': %d, 'completed': True}", 400),
+    ('[%d]', 400)
+])
+def test_single_updates_parse_json_only(app, client, tasks, body, status):
+    token, owned, _other = tasks
+    assert client.put("/user-task-update", data = body % owned[0], headers = bearer(token)).status_code == status
+    assert get_states(app, owned[:1]) == [status == 200]
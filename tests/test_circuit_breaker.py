@@ -0,0 +1,76 @@
+import socket
+import time
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+from core import ApplicationInitializer, CircuitBreaker, RedisCircuitOpenError
+
+
+class Unavailable(Exception):
+    pass
+
+class Rejected(Exception):
+    pass
+
+def fail():
+    raise Unavailable
+
+def create_breaker(threshold: int = 2, reset_timeout: float = 0.1) -> CircuitBreaker:
+    return CircuitBreaker("test", threshold, reset_timeout, (Unavailable,), Rejected, (KeyError,))
+
+def call_failing(breaker: CircuitBreaker, times: int):
+    for _ in range(times):
+        with pytest.raises(Unavailable):
+            breaker.call(fail)
+
+
+def test_opens_after_consecutive_failures_only():
+    breaker = create_breaker()
+    call_failing(breaker, 1)
+    assert breaker.call(lambda: "ok") == "ok"
+    call_failing(breaker, 1)
+    assert not breaker.is_open()
+    call_failing(breaker, 1)
+    assert breaker.is_open()
+
+    with pytest.raises(Rejected):
+        breaker.call(lambda: "ok")
+    assert breaker.stats() == {"state": CircuitBreaker.OPEN, "consecutive_failures": 2, "opens": 1, "rejected": 1}
+
+def test_other_errors_are_not_failures():
+    breaker = create_breaker(threshold = 1)
+    for error in (KeyError, ValueError):
+        with pytest.raises(error):
+            breaker.call(lambda: {}["missing"] if error is KeyError else int("x"))
+    assert breaker.stats()["state"] == CircuitBreaker.CLOSED
+
+def test_a_successful_probe_closes_the_circuit():
+    breaker = create_breaker()
+    call_failing(breaker, 2)
+    time.sleep(0.15)
+    assert not breaker.is_open()
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.stats()["state"] == CircuitBreaker.CLOSED
+
+def test_a_failed_probe_opens_the_circuit_again():
+    breaker = create_breaker()
+    call_failing(breaker, 2)
+    time.sleep(0.15)
+    call_failing(breaker, 1)
+    assert breaker.is_open()
+    assert breaker.stats()["opens"] == 2
+
+# The Redis client stops connecting once its breaker opens, failing fast instead of waiting on the timeouts
+def test_redis_calls_fail_fast_while_redis_is_down(app):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    config = {**app.config, "REDIS_URL": f"redis://127.0.0.1:{port}/0", "REDIS_RETRIES": 0,
+              "REDIS_BREAKER_THRESHOLD": 2, "REDIS_BREAKER_RESET_TIMEOUT": 60}
+    redis = ApplicationInitializer.create_redis(config)
+    for _ in range(2):
+        with pytest.raises(RedisConnectionError) as error:
+            redis.get("key")
+        assert not isinstance(error.value, RedisCircuitOpenError)
+    with pytest.raises(RedisCircuitOpenError):
+        redis.get("key")
+    assert redis.circuit_breaker.stats()["rejected"] == 1
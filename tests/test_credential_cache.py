@@ -0,0 +1,91 @@
+import pytest
+from conftest import PASSWORD, bearer, create_user, login
+from models import User
+from utilities import CredentialCache, RedisUtils
+
+
+# Counts the lookups of credentials reaching the database
+@pytest.fixture
+def lookups(monkeypatch) -> list[str]:
+    usernames = []
+    get_credentials_by_username = User.get_credentials_by_username
+    def count_lookup(username: str):
+        usernames.append(username)
+        return get_credentials_by_username(username)
+    monkeypatch.setattr(User, "get_credentials_by_username", count_lookup)
+    return usernames
+
+# Counts the round trips to Redis, each sending one command or a whole pipeline
+@pytest.fixture
+def round_trips(redis, monkeypatch) -> list[bytes]:
+    calls = []
+    connection = redis.connection_pool.get_connection()
+    redis.connection_pool.release(connection)
+    send_packed_command = type(connection).send_packed_command
+    def count_round_trip(self, command, *args, **kwargs):
+        calls.append(command)
+        return send_packed_command(self, command, *args, **kwargs)
+    monkeypatch.setattr(type(connection), "send_packed_command", count_round_trip)
+    return calls
+
+def post_login(client, username: str):
+    return client.post("/login", data = {"username": username, "password": PASSWORD})
+
+
+def test_unknown_usernames_are_looked_up_once(client, lookups):
+    assert [post_login(client, "nobody").status_code for _ in range(3)] == [401, 401, 401]
+    assert lookups == ["nobody"]
+
+def test_known_usernames_are_always_looked_up(app, client, lookups):
+    create_user(app, "alice")
+    assert [post_login(client, "alice").status_code for _ in range(2)] == [200, 200]
+    assert lookups == ["alice", "alice"]
+
+def test_created_users_can_log_in_at_once(app, client, lookups):
+    create_user(app, "admin", ["Amministratore di sistema"])
+    token = login(client, "admin")["access_token"]
+    assert post_login(client, "bob").status_code == 401
+
+    rows = [{"username": "bob", "password": PASSWORD}]
+    assert client.post("/insert-users", json = rows, headers = bearer(token)).status_code == 200
+    assert post_login(client, "bob").status_code == 200
+
+def test_unknown_usernames_expire(app, client, lookups, monkeypatch):
+    with app.app_context():
+        assert CredentialCache.get_by_username("nobody") is None
+        cache = CredentialCache.invalidator().cache
+        monkeypatch.setattr(cache, "get", lambda key: None)
+        assert CredentialCache.get_by_username("nobody") is None
+    assert lookups == ["nobody", "nobody"]
+
+def test_the_cache_can_be_disabled(app, client, lookups):
+    app.config["LOGIN_NEGATIVE_CACHE_TTL"] = 0
+    assert [post_login(client, "nobody").status_code for _ in range(2)] == [401, 401]
+    assert lookups == ["nobody", "nobody"]
+
+def test_lookups_ignore_the_case_of_the_username(app, client, lookups):
+    create_user(app, "admin", ["Amministratore di sistema"])
+    token = login(client, "admin")["access_token"]
+    assert post_login(client, "Bob").status_code == 401
+    assert client.post("/insert-users", json = [{"username": "bob", "password": PASSWORD}], headers = bearer(token)).status_code == 200
+    with app.app_context():
+        assert CredentialCache.invalidator().cache.stats()["size"] == 0
+
+def test_invalidations_are_published_with_a_single_round_trip(app, round_trips):
+    with app.app_context():
+        CredentialCache.invalidate([f"user{index}" for index in range(100)])
+    assert len(round_trips) == 1
+
+# The tokens and roles are saved with one transaction, without checking first that the scripts are loaded
+def test_logins_save_the_session_with_a_single_round_trip(app, client, redis, round_trips):
+    user_id = create_user(app, "alice", ["Titolare"])
+    login(client, "alice")
+    round_trips.clear()
+    login(client, "alice")
+    assert len(round_trips) == 1 and b"SCRIPT" not in round_trips[0]
+
+    # Scripts lost by Redis are loaded again
+    redis.script_flush()
+    with app.app_context():
+        RedisUtils.set_roles(user_id, ["Dipendente"])
+        assert RedisUtils.get_roles(user_id) == ["Dipendente"]
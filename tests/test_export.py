@@ -0,0 +1,38 @@
+import csv
+import gzip
+import io
+import json
+import pytest
+from conftest import bearer, create_user, login
+from models import Task, db
+
+
+@pytest.fixture
+def token(app, client) -> str:
+    user_id = create_user(app, "alice", ["Titolare"])
+    with app.app_context():
+        db.session.add_all([Task(area = 1, user = str(user_id), description = f"Task {index}") for index in range(5)])
+        db.session.commit()
+    return login(client, "alice")["access_token"]
+
+
+def test_tasks_are_exported_as_csv(client, token):
+    with client.get("/export/tasks", query_string = {"area_id": 1, "format": "csv"}, headers = bearer(token)) as response:
+        assert response.headers["Content-Disposition"] == 'attachment; filename="tasks_area_1.csv"'
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text = True))))
+    assert [row["description"] for row in rows] == [f"Task {index}" for index in range(5)]
+
+def test_tasks_are_exported_as_gzip_encoded_ndjson(client, token):
+    headers = {**bearer(token), "Accept-Encoding": "gzip"}
+    with client.get("/export/tasks", query_string = {"area_id": 1}, headers = headers) as response:
+        assert response.headers["Content-Encoding"] == "gzip"
+        lines = gzip.decompress(response.get_data()).splitlines()
+    assert [json.loads(line)["description"] for line in lines] == [f"Task {index}" for index in range(5)]
+
+@pytest.mark.parametrize("route", ["/export/tasks", "/export/machines"])
+@pytest.mark.parametrize("area_id", [None, "", "1\"; x", "one"])
+def test_invalid_area_ids_are_rejected(client, token, route, area_id):
+    query = {"area_id": area_id} if area_id is not None else {}
+    response = client.get(route, query_string = query, headers = bearer(token))
+    assert response.status_code == 400
+    assert "Content-Disposition" not in response.headers
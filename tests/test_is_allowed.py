@@ -0,0 +1,27 @@
+from conftest import bearer, create_user, login
+from authorization import is_allowed
+
+
+def check(app, headers: dict[str, str], roles: list[str]) -> bool:
+    with app.test_request_context(headers = headers):
+        return is_allowed(roles)
+
+
+def test_tokens_are_checked_against_the_roles(app, client):
+    create_user(app, "alice", ["Titolare"])
+    token = login(client, "alice")["access_token"]
+    assert check(app, bearer(token), ["Titolare", "Amministratore di sistema"])
+    assert not check(app, bearer(token), ["Amministratore di sistema"])
+
+def test_missing_and_invalid_tokens_are_not_allowed(app, client):
+    create_user(app, "alice", ["Titolare"])
+    refresh_token = login(client, "alice")["refresh_token"]
+    assert not check(app, {}, ["Titolare"])
+    assert not check(app, bearer("not.a.token"), ["Titolare"])
+    assert not check(app, bearer(refresh_token), ["Titolare"])
+
+def test_revoked_tokens_are_not_allowed(app, client):
+    create_user(app, "alice", ["Titolare"])
+    token = login(client, "alice")["access_token"]
+    assert client.delete("/logout", headers = bearer(token)).status_code == 200
+    assert not check(app, bearer(token), ["Titolare"])
@@ -0,0 +1,71 @@
+import pytest
+from conftest import bearer, create_user, login
+from models import Machine, db
+from utilities import MachineCache
+
+
+def add_machine(app, area: int, serial: str) -> int:
+    with app.app_context():
+        machine = Machine(area = area, model = "M1", serial = serial, type = "Lathe", manufacturer = "Acme",
+                          width = 100, depth = 100, height = 100, weight = 500, purchase_year = "2020")
+        db.session.add(machine)
+        db.session.commit()
+        return machine.id
+
+@pytest.fixture
+def token(app, client) -> str:
+    create_user(app, "alice", ["Dipendente"])
+    return login(client, "alice")["access_token"]
+
+
+def test_machines_are_cached_per_parsed_area(app, client, token):
+    add_machine(app, 1, "S1")
+    first = client.get("/machines", query_string = {"area_id": "1"}, headers = bearer(token))
+    second = client.get("/machines", query_string = {"area_id": "01"}, headers = bearer(token))
+    assert first.status_code == second.status_code == 200
+    assert [machine["serial"] for machine in first.get_json()] == ["S1"]
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert "Last-Modified" not in first.headers
+    with app.app_context():
+        stats = MachineCache.invalidator().cache.stats()
+        assert (stats["size"], stats["hits"]) == (1, 1)
+
+@pytest.mark.parametrize("query", [{}, {"area_id": "x"}, {"area_id": "1.5"}])
+def test_invalid_area_ids_are_rejected(client, token, query):
+    response = client.get("/machines", query_string = query, headers = bearer(token))
+    assert response.status_code == 400
+    assert response.get_json()["exceptionType"] == "InvalidQueryException"
+
+def test_matching_etags_are_answered_with_the_same_weak_etag(client, token):
+    for encoding in ("identity", "gzip"):
+        headers = {**bearer(token), "Accept-Encoding": encoding}
+        etag = client.get("/machines", query_string = {"area_id": 1}, headers = headers).headers["ETag"]
+        response = client.get("/machines", query_string = {"area_id": 1}, headers = {**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag and etag.startswith("W/")
+
+def test_committed_changes_invalidate_the_area(app, client, token):
+    add_machine(app, 1, "S1")
+    etag = client.get("/machines", query_string = {"area_id": 1}, headers = bearer(token)).headers["ETag"]
+
+    machine_id = add_machine(app, 1, "S2")
+    response = client.get("/machines", query_string = {"area_id": 1}, headers = {**bearer(token), "If-None-Match": etag})
+    assert response.status_code == 200
+    assert [machine["serial"] for machine in response.get_json()] == ["S1", "S2"]
+
+    # Moving a machine changes both its former and its new area
+    area_2 = client.get("/machines", query_string = {"area_id": 2}, headers = bearer(token)).get_json()
+    with app.app_context():
+        db.session.get(Machine, machine_id).area = 2
+        db.session.commit()
+    assert len(client.get("/machines", query_string = {"area_id": 1}, headers = bearer(token)).get_json()) == 1
+    assert len(client.get("/machines", query_string = {"area_id": 2}, headers = bearer(token)).get_json()) == len(area_2) + 1
+
+def test_rolled_back_changes_do_not_invalidate(app, client, token):
+    client.get("/machines", query_string = {"area_id": 1}, headers = bearer(token))
+    with app.app_context():
+        db.session.add(Machine(area = 1, model = "M1", serial = "S1", type = "Lathe", manufacturer = "Acme",
+                               width = 1, depth = 1, height = 1, weight = 1, purchase_year = "2020"))
+        db.session.flush()
+        db.session.rollback()
+        assert MachineCache.invalidator().cache.get("1") is not None
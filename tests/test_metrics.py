@@ -0,0 +1,39 @@
+import pytest
+from prometheus_client import REGISTRY
+from conftest import create_user, login
+
+
+def count_requests(endpoint: str, status: str) -> float:
+    labels = {"blueprint": "authentication", "endpoint": endpoint, "method": "POST", "status": status}
+    return REGISTRY.get_sample_value("flaskserver_requests_total", labels) or 0.0
+
+def count_backend_calls(backend: str) -> float:
+    return REGISTRY.get_sample_value("flaskserver_backend_duration_seconds_count", {"backend": backend}) or 0.0
+
+
+class TestEnabled:
+    @pytest.fixture
+    def config(self, config, monkeypatch) -> dict[str, any]:
+        monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising = False)
+        return {**config, "METRICS_ENABLED": True}
+
+    def test_requests_and_backends_are_measured(self, app, client):
+        create_user(app, "alice")
+        requests, queries = count_requests("authentication.login", "200"), count_backend_calls("sql")
+        login(client, "alice")
+        assert count_requests("authentication.login", "200") == requests + 1
+        assert count_backend_calls("sql") > queries
+
+    def test_metrics_are_served_to_local_clients_only(self, client):
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert b"flaskserver_request_duration_seconds_bucket" in response.data
+        assert client.get("/metrics", environ_base = {"REMOTE_ADDR": "10.0.0.1"}).status_code == 403
+
+
+# The metrics of the application are off in the default test configuration
+def test_nothing_is_recorded_while_disabled(client):
+    requests, queries = count_requests("authentication.login", "401"), count_backend_calls("sql")
+    assert client.post("/login", data = {"username": "nobody", "password": "password"}).status_code == 401
+    assert (count_requests("authentication.login", "401"), count_backend_calls("sql")) == (requests, queries)
+    assert client.get("/metrics").status_code == 404
@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.dialects import mysql
+from conftest import bearer, create_user, login
+from models import Task, db, migrate_indexes
+
+
+@pytest.fixture
+def user(app, client) -> tuple[int, str]:
+    user_id = create_user(app, "alice", ["Dipendente"])
+    with app.app_context():
+        db.session.add_all([Task(area = 1, user = str(user_id), description = f"Task {index}", completed = index % 3 == 0)
+                            for index in range(7)])
+        db.session.add(Task(area = 2, user = str(user_id), description = "Elsewhere"))
+        db.session.commit()
+    return user_id, login(client, "alice")["access_token"]
+
+
+def get_all_pages(client, token: str, query: dict[str, any]) -> list[list[dict[str, any]]]:
+    pages, cursor = [], None
+    while True:
+        page = client.get("/user-tasks", query_string = {**query, **({"cursor": cursor} if cursor else {})},
+                          headers = bearer(token)).get_json()
+        pages.append(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+def test_pages_cover_every_task_once_in_id_order(client, user):
+    pages = get_all_pages(client, user[1], {"area_id": 1, "limit": 3})
+    assert [len(page) for page in pages] == [3, 3, 1]
+    ids = [task["id"] for page in pages for task in page]
+    assert ids == sorted(ids) and len(set(ids)) == 7
+
+def test_pages_are_filtered_and_sparse(client, user):
+    pages = get_all_pages(client, user[1], {"area_id": 1, "limit": 2, "completed": "true", "fields": "description"})
+    tasks = [task for page in pages for task in page]
+    assert [task["description"] for task in tasks] == ["Task 0", "Task 3", "Task 6"]
+    assert all(set(task) == {"id", "description"} for task in tasks)
+
+@pytest.mark.parametrize("query", [{"limit": 0}, {"limit": "x"}, {"cursor": "x"}, {"fields": "secret"}, {"completed": "maybe"}])
+def test_invalid_page_arguments_are_rejected(client, user, query):
+    response = client.get("/user-tasks", query_string = {"area_id": 1, "limit": 2, **query}, headers = bearer(user[1]))
+    assert response.status_code == 400
+
+# The string column is compared to a string, which MySQL needs to seek the index on it rather than scan the table
+def test_tasks_of_a_user_are_looked_up_by_string(app):
+    with app.app_context():
+        statement = Task.query_by_user_id_and_area_id(7, 1).statement.compile(dialect = mysql.dialect())
+    assert statement.params == {"user_1": "7", "area_1": 1}
+
+def test_migrate_indexes_creates_the_declared_indexes_and_drops_the_replaced_ones(app):
+    with app.app_context():
+        db.session.execute(db.text("DROP INDEX ix_task_user_area_completed"))
+        db.session.execute(db.text("CREATE INDEX ix_task_user_completed ON task (user, completed)"))
+        db.session.commit()
+
+        assert migrate_indexes() == (["ix_task_user_area_completed"], ["ix_task_user_completed"])
+        indexes = {index["name"]: index["column_names"] for index in inspect(db.engine).get_indexes("task")}
+        assert indexes == {"ix_task_user_area_completed": ["user", "area", "completed", "id"]}
+        assert migrate_indexes() == ([], [])
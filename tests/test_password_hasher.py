@@ -0,0 +1,78 @@
+import threading
+import time
+import bcrypt
+import pytest
+from conftest import PASSWORD, bearer, create_user, login, wait_until
+from hashing import PasswordHasher
+from models import User, db
+
+
+# A pool of a single process, with no queue, so that a second hashing operation is rejected at once
+@pytest.fixture
+def config(config) -> dict[str, any]:
+    return {**config, "BCRYPT_POOL_SIZE": 1, "BCRYPT_QUEUE_SIZE": 0, "BCRYPT_TIMEOUT": 10}
+
+@pytest.fixture
+def token(app, client) -> str:
+    create_user(app, "admin", ["Amministratore di sistema"])
+    return login(client, "admin")["access_token"]
+
+# Keeps the process of the pool busy with a slow check, until the returned thread is joined
+def occupy_pool(app) -> threading.Thread:
+    def check():
+        with app.app_context():
+            PasswordHasher.check_password_hash(bcrypt.gensalt(13), PASSWORD)
+    thread = threading.Thread(target = check)
+    thread.start()
+    with app.app_context():
+        assert wait_until(lambda: PasswordHasher.stats()["in_flight"] == 1)
+    return thread
+
+def get_hasher_stats(client, token: str) -> dict[str, any]:
+    return client.get("/stats", headers = bearer(token)).get_json()["password_hasher"]
+
+
+def test_hashing_runs_on_the_pool(client, token):
+    stats = get_hasher_stats(client, token)
+    assert (stats["pool_size"], stats["in_flight"], stats["rejected"]) == (1, 0, 0)
+    assert stats["completed"] == 2 and stats["mean_seconds"] > 0
+
+def test_logins_beyond_the_queue_are_rejected_at_once(app, client, token):
+    thread = occupy_pool(app)
+    start = time.perf_counter()
+    response = client.post("/login", data = {"username": "admin", "password": PASSWORD})
+    assert time.perf_counter() - start < 0.5
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+
+    stats = get_hasher_stats(client, token)
+    assert (stats["in_flight"], stats["queue_depth"], stats["rejected"]) == (1, 0, 1)
+    thread.join()
+    assert get_hasher_stats(client, token)["in_flight"] == 0
+    assert client.post("/login", data = {"username": "admin", "password": PASSWORD}).status_code == 200
+
+# A check taking longer than BCRYPT_TIMEOUT answers 503 instead of holding the request
+def test_slow_checks_time_out(app, client, token):
+    user_id = create_user(app, "alice")
+    with app.app_context():
+        db.session.get(User, user_id).password = bcrypt.gensalt(13).decode("utf-8")
+        db.session.commit()
+    app.config["BCRYPT_TIMEOUT"] = 0.1
+    assert client.post("/login", data = {"username": "alice", "password": PASSWORD}).status_code == 503
+
+# Bulk hashing waits for the pool to be free instead of being rejected
+def test_bulk_hashing_waits_for_free_slots(app, client, token):
+    thread = occupy_pool(app)
+    rows = [{"username": f"user{index}", "password": PASSWORD} for index in range(3)]
+    response = client.post("/insert-users", json = rows, headers = bearer(token))
+    thread.join()
+    assert response.status_code == 200
+    assert all("id" in report for report in response.get_json()["results"])
+    assert get_hasher_stats(client, token)["rejected"] == 0
+
+def test_reset_shuts_the_pool_down(app):
+    with app.app_context():
+        PasswordHasher.generate_password_hash(PASSWORD)
+        assert PasswordHasher.stats()["completed"] == 1
+        PasswordHasher.reset()
+        assert PasswordHasher.stats()["completed"] == 0
+        assert PasswordHasher.check_password_hash(PasswordHasher.generate_password_hash(PASSWORD), PASSWORD)
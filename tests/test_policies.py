@@ -0,0 +1,69 @@
+import json
+import flask
+import pytest
+from conftest import ROLES, bearer, create_user, login
+from authorization import deny
+from policies import PolicyRegistry
+
+
+def test_allow_policies_need_one_of_the_roles():
+    policy = PolicyRegistry.compile(PolicyRegistry.ALLOW, ["Titolare", "Amministratore di sistema"])
+    assert policy.permits(["Dipendente", "Titolare"])
+    assert policy.permits(("Amministratore di sistema",))
+    assert not policy.permits(["Dipendente"])
+    assert not policy.permits([])
+    assert not PolicyRegistry.compile(PolicyRegistry.ALLOW, []).permits(ROLES)
+
+def test_deny_policies_exclude_any_of_the_roles():
+    policy = PolicyRegistry.compile(PolicyRegistry.DENY, ["Dipendente"])
+    assert not policy.permits(["Dipendente"])
+    assert not policy.permits(["Titolare", "Dipendente"])
+    assert policy.permits(["Titolare"])
+    assert policy.permits([])
+
+# Roles interned after a policy is compiled get new ids, leaving the compiled masks valid
+def test_new_roles_do_not_change_compiled_policies():
+    policy = PolicyRegistry.compile(PolicyRegistry.ALLOW, ["Titolare"])
+    mask = policy.mask
+    assert not policy.permits(["Role created later"])
+    assert PolicyRegistry.compile(PolicyRegistry.ALLOW, ["Titolare"]).mask == mask
+    assert PolicyRegistry.role_ids()["Role created later"] != PolicyRegistry.role_ids()["Titolare"]
+
+
+class TestRoutes:
+    @pytest.fixture
+    def app(self, app):
+        app.add_url_rule("/not-for-employees", "not_for_employees", deny(["Dipendente"])(lambda: flask.jsonify(msg = "ok")))
+        return app
+
+    @pytest.fixture
+    def tokens(self, app, client) -> dict[str, str]:
+        users = {"employee": ["Dipendente"], "owner": ["Titolare"], "nobody": [], "admin": ["Amministratore di sistema"]}
+        for username, roles in users.items():
+            create_user(app, username, roles)
+        return {username: login(client, username)["access_token"] for username in users}
+
+    def test_deny_rejects_users_with_any_of_the_roles(self, client, tokens):
+        statuses = {username: client.get("/not-for-employees", headers = bearer(token)).status_code
+                    for username, token in tokens.items()}
+        assert statuses == {"employee": 403, "owner": 200, "nobody": 200, "admin": 200}
+        assert client.get("/not-for-employees").status_code == 401
+
+    def test_policies_are_listed_for_the_administrators(self, client, tokens):
+        assert client.get("/policies", headers = bearer(tokens["owner"])).status_code == 403
+        body = client.get("/policies", headers = bearer(tokens["admin"])).get_json()
+        routes = {route["endpoint"]: route for route in body["routes"]}
+        assert routes["api.get_machines_by_area"] == {
+            "endpoint": "api.get_machines_by_area", "rule": "/machines", "methods": ["GET"], "effect": "allow",
+            "roles": sorted(ROLES), "mask": PolicyRegistry.get_mask(ROLES)
+        }
+        assert routes["not_for_employees"]["effect"] == "deny"
+        assert routes["authentication.login"]["effect"] is None
+        assert set(ROLES) <= set(body["role_ids"])
+
+    # The flask command pushes an application context, as done here
+    def test_policies_are_dumped_by_the_command(self, app):
+        with app.app_context():
+            result = app.test_cli_runner().invoke(args = ["dump-policies"])
+        assert result.exit_code == 0
+        assert json.loads(result.output) == PolicyRegistry.dump(app)
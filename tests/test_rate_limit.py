@@ -0,0 +1,62 @@
+import pytest
+from conftest import PASSWORD, create_user
+
+
+# Two logins per username a minute, and the negative cache of usernames off so that failed logins need no Redis
+@pytest.fixture
+def config(config) -> dict[str, any]:
+    return {
+        **config,
+        "RATE_LIMIT_ENABLED": True,
+        "RATE_LIMITS": {"authentication.login": [{"key": "username", "limit": 2, "period": 60}]},
+        "LOGIN_NEGATIVE_CACHE_TTL": 0
+    }
+
+def login(client, username: str, password: str = PASSWORD):
+    return client.post("/login", data = {"username": username, "password": password})
+
+
+def test_logins_over_the_limit_are_rejected(app, client):
+    create_user(app, "alice")
+    assert [login(client, "alice", "wrong").status_code for _ in range(2)] == [401, 401]
+    response = login(client, "alice")
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 30
+
+def test_limits_are_counted_by_username(app, client):
+    create_user(app, "alice")
+    create_user(app, "bob")
+    assert [login(client, "alice").status_code for _ in range(3)] == [200, 200, 429]
+    assert login(client, "bob").status_code == 200
+
+def test_limits_are_shared_by_the_workers_through_redis(app, client, redis):
+    create_user(app, "alice")
+    login(client, "alice")
+    assert any(key.startswith("rate_limit:authentication.login:username:") for key in redis.keys())
+    redis.flushall()
+    assert [login(client, "alice").status_code for _ in range(3)] == [200, 200, 429]
+
+@pytest.mark.parametrize("fail_open, status", [(True, 401), (False, 429)])
+def test_redis_failures_follow_the_fail_open_setting(app, client, redis, fail_open, status):
+    app.config["RATE_LIMIT_FAIL_OPEN"] = fail_open
+    redis.connection_pool.connection_kwargs["server"].connected = False
+    assert login(client, "nobody").status_code == status
+
+# Behind the reverse proxy, the clients are told apart by the address it forwards
+class TestClientAddress:
+    @pytest.fixture
+    def config(self, config) -> dict[str, any]:
+        return {**config, "RATE_LIMITS": {"authentication.login": [{"key": "ip", "limit": 2, "period": 60}]}}
+
+    def post_login(self, client, address: str):
+        return client.post("/login", data = {"username": "nobody", "password": PASSWORD},
+                           headers = {"X-Forwarded-For": address})
+
+    def test_limits_are_counted_by_forwarded_address(self, client):
+        assert [self.post_login(client, "10.0.0.1").status_code for _ in range(3)] == [401, 401, 429]
+        assert self.post_login(client, "10.0.0.2").status_code == 401
+
+    # Only the address appended by the trusted proxy counts, not the ones sent by the client
+    def test_spoofed_addresses_are_ignored(self, client):
+        statuses = [self.post_login(client, f"192.168.0.{index}, 10.0.0.1").status_code for index in range(3)]
+        assert statuses == [401, 401, 429]
@@ -0,0 +1,68 @@
+import json
+import pytest
+from conftest import bearer, create_user, login
+from utilities import RedisUtils
+
+
+# Moves the hash of a user back to the legacy "user_{id}:*" keys, as stored before the per-user hash
+def to_legacy_layout(redis, user_id: int):
+    session = redis.hgetall(RedisUtils.get_user_key(user_id))
+    redis.delete(RedisUtils.get_user_key(user_id))
+    redis.set(RedisUtils.get_access_token_key(user_id), session[RedisUtils.ACCESS_TOKEN_FIELD], ex = 3600)
+    redis.set(RedisUtils.get_refresh_token_key(user_id), session[RedisUtils.REFRESH_TOKEN_FIELD], ex = 3600)
+    redis.rpush(RedisUtils.get_roles_key(user_id), *json.loads(session[RedisUtils.ROLES_FIELD]))
+
+def get_legacy_keys(redis, user_id: int) -> list[str]:
+    return sorted(redis.keys(f"{RedisUtils.get_user_key(user_id)}:*"))
+
+@pytest.fixture
+def user_id(app) -> int:
+    return create_user(app, "alice", ["Titolare"])
+
+
+def test_sessions_are_stored_in_a_single_hash(client, redis, user_id):
+    login(client, "alice")
+    assert redis.keys("*") == [RedisUtils.get_user_key(user_id)]
+    session = redis.hgetall(RedisUtils.get_user_key(user_id))
+    assert set(session) == {RedisUtils.ACCESS_TOKEN_FIELD, RedisUtils.REFRESH_TOKEN_FIELD,
+                            RedisUtils.ROLES_FIELD, RedisUtils.ROLE_VERSION_FIELD}
+    assert json.loads(session[RedisUtils.ROLES_FIELD]) == ["Titolare"]
+    assert redis.ttl(RedisUtils.get_user_key(user_id)) > 0
+
+def test_legacy_keys_are_migrated_on_first_access(client, redis, user_id):
+    tokens = login(client, "alice")
+    to_legacy_layout(redis, user_id)
+    assert client.get("/user-data", headers = bearer(tokens["access_token"])).get_json()["role_list"] == ["Titolare"]
+    assert get_legacy_keys(redis, user_id) == []
+    assert redis.hget(RedisUtils.get_user_key(user_id), RedisUtils.ROLES_FIELD) == json.dumps(["Titolare"])
+    assert 0 < redis.ttl(RedisUtils.get_user_key(user_id)) <= 3600
+
+def test_legacy_keys_are_migrated_by_the_command(app, client, redis, user_id):
+    login(client, "alice")
+    to_legacy_layout(redis, user_id)
+    result = app.test_cli_runner().invoke(args = ["migrate-redis-keys"])
+    assert result.output.strip() == "Migrated the Redis keys of 1 users"
+    assert get_legacy_keys(redis, user_id) == []
+    assert redis.hget(RedisUtils.get_user_key(user_id), RedisUtils.ACCESS_TOKEN_FIELD) is not None
+
+# Logging in again must not leave the legacy keys behind, to be migrated back once the hash is deleted
+def test_logout_does_not_bring_back_legacy_tokens(client, redis, user_id):
+    legacy_tokens = login(client, "alice")
+    to_legacy_layout(redis, user_id)
+    tokens = login(client, "alice")
+    assert get_legacy_keys(redis, user_id) == []
+    assert client.delete("/logout", headers = bearer(tokens["access_token"])).status_code == 200
+
+    assert client.get("/user-data", headers = bearer(legacy_tokens["access_token"])).status_code == 401
+    assert client.post("/refresh", headers = bearer(legacy_tokens["refresh_token"])).status_code == 401
+    assert redis.keys("*") == []
+
+# Deleting the tokens keeps the legacy roles, which are migrated first
+def test_deleting_the_tokens_keeps_the_legacy_roles(app, client, redis, user_id):
+    legacy_tokens = login(client, "alice")
+    to_legacy_layout(redis, user_id)
+    with app.app_context():
+        RedisUtils.delete_tokens(user_id)
+        assert RedisUtils.get_roles(user_id) == ["Titolare"]
+    assert get_legacy_keys(redis, user_id) == []
+    assert client.get("/user-data", headers = bearer(legacy_tokens["access_token"])).status_code == 401
@@ -0,0 +1,33 @@
+import pytest
+from conftest import bearer, create_user, login
+from core import RoutingSession
+from models import Machine, Task, db
+
+
+# The replica is a second SQLite database, left empty so that the reads it serves can be told apart
+@pytest.fixture
+def config(config, tmp_path) -> dict[str, any]:
+    return {**config, "DB_REPLICA_URI": f"sqlite:///{tmp_path / 'replica.db'}"}
+
+@pytest.fixture
+def token(app, client) -> str:
+    user_id = create_user(app, "alice", ["Titolare"])
+    with app.app_context():
+        db.metadata.create_all(db.engines[RoutingSession.REPLICA_BIND])
+        db.session.add(Machine(area = 1, model = "M1", serial = "S1", type = "Lathe", manufacturer = "Acme",
+                               width = 1, depth = 1, height = 1, weight = 1, purchase_year = "2020"))
+        db.session.add(Task(area = 1, user = str(user_id), description = "Task"))
+        db.session.commit()
+    return login(client, "alice")["access_token"]
+
+
+# The cached machines and the task list of a user must not lag behind their writes
+def test_cache_fills_and_lists_read_the_primary(client, token):
+    assert len(client.get("/machines", query_string = {"area_id": 1}, headers = bearer(token)).get_json()) == 1
+    assert len(client.get("/user-tasks", query_string = {"area_id": 1}, headers = bearer(token)).get_json()) == 1
+
+def test_pages_and_exports_read_the_replica(client, token):
+    assert client.get("/machines", query_string = {"area_id": 1, "limit": 10}, headers = bearer(token)).get_json()["items"] == []
+    assert client.get("/user-tasks", query_string = {"area_id": 1, "limit": 10}, headers = bearer(token)).get_json()["items"] == []
+    with client.get("/export/tasks", query_string = {"area_id": 1}, headers = bearer(token)) as response:
+        assert response.get_data() == b""
@@ -0,0 +1,63 @@
+import fakeredis
+import pytest
+import redis as redis_client
+from flask_jwt_extended import verify_jwt_in_request
+from conftest import PASSWORD, bearer, create_user, login
+from core import InstrumentedRedis, RequestScope
+from models import User
+from utilities import RedisUtils
+
+
+# The Redis client of the application, counting its round trips, on a fakeredis server
+@pytest.fixture
+def redis() -> InstrumentedRedis:
+    pool = redis_client.ConnectionPool(connection_class = fakeredis.FakeRedisConnection, server = fakeredis.FakeServer(),
+                                       decode_responses = True)
+    return InstrumentedRedis(connection_pool = pool)
+
+@pytest.fixture
+def config(config) -> dict[str, any]:
+    return {**config, "REQUEST_COUNTERS_HEADER": True}
+
+@pytest.fixture
+def user_id(app) -> int:
+    return create_user(app, "alice", ["Titolare"])
+
+
+# The token, the roles and the user are read once, although the decorators and the view all need them.
+# The machines are then served from the cache of the worker.
+@pytest.mark.parametrize("path, counters", [
+    ("/user-data", ["db=1, redis=1", "db=1, redis=1"]),
+    ("/user-tasks?area_id=1", ["db=1, redis=1", "db=1, redis=1"]),
+    ("/machines?area_id=1", ["db=1, redis=1", "db=0, redis=1"])
+])
+def test_requests_read_the_session_and_the_user_once(client, user_id, path, counters):
+    token = login(client, "alice")["access_token"]
+    responses = [client.get(path, headers = bearer(token)) for _ in counters]
+    assert [response.status_code for response in responses] == [200, 200]
+    assert [response.headers[RequestScope.COUNTERS_HEADER] for response in responses] == counters
+
+def test_logins_write_the_session_with_one_round_trip(client, user_id):
+    login(client, "alice")
+    response = client.post("/login", data = {"username": "alice", "password": PASSWORD})
+    assert response.headers[RequestScope.COUNTERS_HEADER] == "db=1, redis=1"
+
+def test_lookups_are_memoized_within_a_request(app, client, user_id):
+    token = login(client, "alice")["access_token"]
+    with app.test_request_context(headers = bearer(token)):
+        verify_jwt_in_request()
+        assert User.get_current_user() is User.get_current_user()
+        assert RedisUtils.get_access_token(user_id) is not None
+        assert RedisUtils.get_roles(user_id) == RedisUtils.get_roles(user_id) == ["Titolare"]
+        RedisUtils.get_role_version(user_id)
+        assert RequestScope.counters() == {"db": 1, "redis": 1}
+
+        # Changes drop the memoized values
+        RedisUtils.set_roles(user_id, ["Dipendente"])
+        assert RedisUtils.get_roles(user_id) == ["Dipendente"]
+
+def test_nothing_is_memoized_outside_of_a_request(app, user_id):
+    with app.app_context():
+        RedisUtils.get_roles(user_id)
+        assert RequestScope.get(("redis_roles", str(user_id))) is None
+        assert RequestScope.counters() == {}
@@ -0,0 +1,75 @@
+import threading
+import pytest
+from werkzeug.wrappers import Response
+from caching import CachedResponse, ResponseCache
+from conftest import bearer, create_user, login
+
+
+@pytest.fixture
+def config(config) -> dict[str, any]:
+    return {**config, "RESPONSE_CACHE_BACKEND": "memory", "RESPONSE_CACHE_MAX_ITEM_BYTES": 1000}
+
+@pytest.fixture
+def token(app, client) -> str:
+    create_user(app, "alice", ["Dipendente"])
+    return login(client, "alice")["access_token"]
+
+
+def test_successful_responses_are_fetched_once():
+    cache, calls = ResponseCache("test", 60, 16, 100), []
+    fetch = lambda: calls.append(1) or CachedResponse(200, "application/json", b"{}")
+    assert cache.get_or_fetch("key", fetch).body == b"{}"
+    assert cache.get_or_fetch("key", fetch).body == b"{}"
+    assert len(calls) == 1
+
+@pytest.mark.parametrize("response", [CachedResponse(502, "application/json", b"{}"), CachedResponse(200, "text/plain", b"x" * 101)])
+def test_failed_and_large_responses_are_not_cached(response):
+    cache, calls = ResponseCache("test", 60, 16, 100), []
+    fetch = lambda: calls.append(1) or response
+    cache.get_or_fetch("key", fetch)
+    cache.get_or_fetch("key", fetch)
+    assert len(calls) == 2
+
+# A streamed response cannot be shared, so the requests waiting on the same key fetch on their own
+def test_streamed_responses_are_neither_cached_nor_shared():
+    cache, started, release = ResponseCache("test", 60, 16, 100), threading.Event(), threading.Event()
+    results = []
+
+    def leader_fetch():
+        started.set()
+        release.wait(5)
+        return Response(iter([b"leader"]))
+
+    leader = threading.Thread(target = lambda: results.append(cache.get_or_fetch("key", leader_fetch)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target = lambda: results.append(cache.get_or_fetch("key", lambda: Response(iter([b"follower"])))))
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert sorted(b"".join(result.response) for result in results) == [b"follower", b"leader"]
+    assert cache.get("key") is None
+
+
+def test_small_sensor_responses_are_cached(app, client, token):
+    query = {"count": 2}
+    first = client.get("/querying", query_string = query, headers = bearer(token))
+    second = client.get("/querying", query_string = query, headers = bearer(token))
+    assert first.status_code == second.status_code == 200
+    assert first.get_data() == second.get_data()
+    with app.app_context():
+        assert ResponseCache.for_route("api.querying").stats()["hits"] == 1
+
+def test_large_sensor_responses_are_streamed_uncached(app, client, token):
+    query = {"count": 100}
+    bodies = []
+    for _ in range(2):
+        with client.get("/querying", query_string = query, headers = bearer(token)) as response:
+            assert response.status_code == 200
+            bodies.append(response.get_data())
+    assert all(len(body.splitlines()) == 100 for body in bodies)
+    assert bodies[0] != bodies[1]
+    with app.app_context():
+        assert ResponseCache.for_route("api.querying").stats()["hits"] == 0
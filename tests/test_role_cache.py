@@ -0,0 +1,44 @@
+import json
+from conftest import bearer, create_user, login, wait_until
+from utilities import RedisUtils
+
+
+def test_roles_are_served_from_the_process_cache(app, redis):
+    user_id = create_user(app, "alice", ["Dipendente"])
+    with app.app_context():
+        RedisUtils.set_roles(user_id, ["Dipendente"])
+        assert RedisUtils.get_roles(user_id) == ["Dipendente"]
+
+        # Written behind the back of the cache, as another worker would without invalidating it
+        redis.hset(RedisUtils.get_user_key(user_id), RedisUtils.ROLES_FIELD, json.dumps(["Titolare"]))
+        assert RedisUtils.get_roles(user_id) == ["Dipendente"]
+
+        RedisUtils.invalidate_cached_roles(user_id)
+        assert RedisUtils.get_roles(user_id) == ["Titolare"]
+
+def test_set_roles_invalidates_the_cache(app):
+    user_id = create_user(app, "alice", ["Dipendente"])
+    with app.app_context():
+        RedisUtils.set_roles(user_id, ["Dipendente"])
+        assert RedisUtils.get_roles(user_id) == ["Dipendente"]
+        RedisUtils.set_roles(user_id, ["Dipendente", "Titolare"])
+        assert RedisUtils.get_roles(user_id) == ["Dipendente", "Titolare"]
+
+def test_invalidations_published_by_other_workers_are_applied(app, redis):
+    user_id = create_user(app, "alice", ["Dipendente"])
+    with app.app_context():
+        RedisUtils.set_roles(user_id, ["Dipendente"])
+        assert RedisUtils.get_roles(user_id) == ["Dipendente"]
+        cache = RedisUtils.role_cache_invalidator().cache
+
+        redis.publish(app.config["ROLE_CACHE_CHANNEL"], str(user_id))
+        assert wait_until(lambda: cache.get(str(user_id)) is None)
+
+def test_role_changes_apply_to_the_next_request(app, client):
+    user_id = create_user(app, "alice", ["Amministratore di sistema"])
+    tokens = login(client, "alice")
+    assert client.get("/stats", headers = bearer(tokens["access_token"])).status_code == 200
+
+    with app.app_context():
+        RedisUtils.set_roles(user_id, ["Dipendente"])
+    assert client.get("/stats", headers = bearer(tokens["access_token"])).status_code == 403
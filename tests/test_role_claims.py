@@ -0,0 +1,51 @@
+import pytest
+from flask_jwt_extended import decode_token, verify_jwt_in_request
+from authorization import get_current_roles
+from conftest import bearer, create_user, login
+from utilities import RedisUtils
+
+
+@pytest.fixture
+def config(config) -> dict[str, any]:
+    return {**config, "JWT_ROLE_CLAIMS": True}
+
+
+def test_current_claims_are_trusted_with_a_version_only_lookup(app, client, redis):
+    create_user(app, "alice", ["Amministratore di sistema"])
+    tokens = login(client, "alice")
+
+    # The commands sent by the client are recorded
+    commands = []
+    original = redis.execute_command
+    def counting(*args, **options):
+        commands.append(args[:3])
+        return original(*args, **options)
+    redis.execute_command = counting
+    try:
+        with app.test_request_context("/", headers = bearer(tokens["access_token"])):
+            verify_jwt_in_request()
+            RedisUtils.role_cache_invalidator().cache.clear()
+            assert get_current_roles() == ["Amministratore di sistema"]
+    finally:
+        del redis.execute_command
+
+    role_reads = [command for command in commands if command[0] in ("HGET", "HMGET")]
+    assert len(role_reads) == 1 and role_reads[0][0] == "HGET" and role_reads[0][2] == RedisUtils.ROLE_VERSION_FIELD
+
+def test_stale_claims_fall_back_to_the_current_roles(app, client):
+    user_id = create_user(app, "alice", ["Amministratore di sistema"])
+    tokens = login(client, "alice")
+    assert client.get("/stats", headers = bearer(tokens["access_token"])).status_code == 200
+
+    with app.app_context():
+        RedisUtils.set_roles(user_id, ["Dipendente"])
+    assert client.get("/stats", headers = bearer(tokens["access_token"])).status_code == 403
+    assert client.get("/machines", query_string = {"area_id": 1}, headers = bearer(tokens["access_token"])).status_code == 200
+
+def test_claims_carry_the_version_of_the_roles(app, client):
+    user_id = create_user(app, "alice", ["Titolare"])
+    tokens = login(client, "alice")
+    with app.app_context():
+        claims = decode_token(tokens["access_token"])
+        assert claims["roles"] == ["Titolare"]
+        assert claims["role_version"] == RedisUtils.get_version_of_roles(["Titolare"]) == RedisUtils.get_role_version(user_id)
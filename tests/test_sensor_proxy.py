@@ -0,0 +1,65 @@
+import json
+import socket
+import time
+import pytest
+from conftest import bearer, create_user, login
+
+
+# One stream at a time
+@pytest.fixture
+def config(config) -> dict[str, any]:
+    return {**config, "SENSOR_API_MAX_STREAMS": 1}
+
+@pytest.fixture
+def token(app, client) -> str:
+    create_user(app, "alice", ["Dipendente"])
+    return login(client, "alice")["access_token"]
+
+def get_monitoring(client, token: str, **query):
+    return client.get("/monitoring", query_string = query, headers = bearer(token), buffered = False)
+
+
+def test_readings_are_streamed_as_they_arrive(client, token):
+    start = time.perf_counter()
+    response = get_monitoring(client, token, count = 3, interval = 0.5)
+    try:
+        assert response.status_code == 200 and response.content_type == "application/x-ndjson"
+        chunks = iter(response.response)
+        assert json.loads(next(chunks))["sensor"] == 0
+        assert time.perf_counter() - start < 0.5
+        assert [json.loads(line)["sensor"] for line in b"".join(chunks).splitlines()] == [1, 2]
+    finally:
+        response.close()
+
+def test_streams_beyond_the_limit_are_rejected_until_one_is_closed(client, token):
+    first = get_monitoring(client, token, count = 100, interval = 0.01)
+    next(iter(first.response))
+    second = get_monitoring(client, token, count = 1)
+    assert second.status_code == 503 and second.headers["Retry-After"] == "1"
+
+    # Closed before being read to the end, as by a client going away
+    first.close()
+    third = get_monitoring(client, token, count = 1)
+    assert third.status_code == 200 and third.get_data()
+    third.close()
+
+def test_unreachable_sensor_api_answers_502(app, client, token):
+    with socket.socket() as closed:
+        closed.bind(("127.0.0.1", 0))
+        app.config["SENSOR_API_URL"] = f"http://127.0.0.1:{closed.getsockname()[1]}"
+        response = get_monitoring(client, token)
+    assert response.status_code == 502
+    assert get_monitoring(client, token).status_code == 502
+
+# The sensor API accepts the connection but never answers
+def test_silent_sensor_api_answers_504(app, client, token):
+    with socket.socket() as silent:
+        silent.bind(("127.0.0.1", 0))
+        silent.listen()
+        app.config["SENSOR_API_URL"] = f"http://127.0.0.1:{silent.getsockname()[1]}"
+        app.config["SENSOR_API_READ_TIMEOUT"] = 0.5
+        start = time.perf_counter()
+        assert get_monitoring(client, token).status_code == 504
+        assert time.perf_counter() - start < 2
+        # The slot of the failed stream is free again
+        assert get_monitoring(client, token).status_code == 504
@@ -0,0 +1,54 @@
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from uuid import UUID
+import pytest
+from flask.json.provider import DefaultJSONProvider
+from markupsafe import Markup
+from models import Machine, Task
+from serialization import OrjsonProvider
+
+
+@dataclass
+class Point:
+    x: int
+    y: Decimal
+
+DOCUMENTS = [
+    {"b": 1, "a": [True, None, 1.5, "text"]},
+    [Task(id = 1, area = 2, user = "3", description = "Task", completed = False)],
+    {"machine": Machine(id = 1, area = 1, model = "M", serial = "S", type = "Lathe", manufacturer = "Acme",
+                        width = 1.5, depth = 2, height = 3, weight = 4, purchase_year = "2020")},
+    {"added": datetime(2024, 5, 6, 7, 8, 9, tzinfo = timezone.utc), "day": date(2024, 5, 6)},
+    {"amount": Decimal("1.10"), "id": UUID(int = 1), "point": Point(1, Decimal("2.5")), "html": Markup("<b>")},
+    {"big": 2 ** 70}
+]
+
+
+@pytest.fixture
+def providers(app) -> tuple[OrjsonProvider, DefaultJSONProvider]:
+    return OrjsonProvider(app), DefaultJSONProvider(app)
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_documents_match_the_default_provider(providers, document):
+    fast, default = providers
+    assert json.loads(fast.dumps(document)) == json.loads(default.dumps(document))
+
+def test_unknown_types_are_rejected(providers):
+    with pytest.raises(TypeError):
+        providers[0].dumps({"value": object()})
+
+@pytest.mark.parametrize("ensure_ascii, expected", [(True, "Caff\\u00e8"), (False, "Caffè")])
+def test_non_ascii_characters_follow_ensure_ascii(providers, ensure_ascii, expected):
+    fast, _default = providers
+    fast.ensure_ascii = ensure_ascii
+    body = fast.dumps({"name": "Caffè"})
+    assert expected in body and json.loads(body) == {"name": "Caffè"}
+
+def test_responses_use_the_orjson_provider(app):
+    assert isinstance(app.json, OrjsonProvider)
+    with app.test_request_context():
+        response = app.json.response(tasks = [Task(id = 1, area = 1, user = "1", description = "Task", completed = True)])
+    assert json.loads(response.data) == {"tasks": [{"area": 1, "completed": True, "description": "Task", "id": 1, "user": "1"}]}
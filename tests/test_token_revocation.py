@@ -0,0 +1,73 @@
+import time
+import pytest
+from conftest import bearer, create_user, login, wait_until
+from caching import CacheInvalidator, LRUCache
+from utilities import RedisUtils
+
+
+# Tokens checked against the identifiers cached by each worker, for TOKEN_REVOCATION_MAX_STALENESS seconds at most
+@pytest.fixture
+def config(config) -> dict[str, any]:
+    return {**config, "TOKEN_REVOCATION_MODE": "local", "TOKEN_REVOCATION_MAX_STALENESS": 60}
+
+@pytest.fixture
+def user_id(app) -> int:
+    return create_user(app, "alice", ["Titolare"])
+
+def get_user_data(client, token: str) -> int:
+    return client.get("/user-data", headers = bearer(token)).status_code
+
+
+def test_tokens_are_checked_from_the_process_cache(app, client, redis, user_id):
+    token = login(client, "alice")["access_token"]
+    assert get_user_data(client, token) == 200
+    with app.app_context():
+        assert RedisUtils.token_cache_invalidator().cache.get(str(user_id)) is not None
+
+    # Gone from Redis behind the back of the cache, as if the invalidation were lost
+    redis.delete(RedisUtils.get_user_key(user_id))
+    assert get_user_data(client, token) == 200
+
+def test_superseded_tokens_are_rejected(client, user_id):
+    first = login(client, "alice")["access_token"]
+    assert get_user_data(client, first) == 200
+    second = login(client, "alice")["access_token"]
+    assert get_user_data(client, first) == 401
+    assert get_user_data(client, second) == 200
+
+# Another worker, with its own cache, drops the tokens of the user once told by logout
+def test_logout_invalidates_the_other_workers(app, client, redis, user_id):
+    token = login(client, "alice")["access_token"]
+    other_worker = CacheInvalidator(LRUCache(10, 60), app.config["TOKEN_REVOCATION_CHANNEL"])
+    other_worker.listen(redis)
+    try:
+        other_worker.cache.set(str(user_id), ("access", "refresh"))
+        assert client.delete("/logout", headers = bearer(token)).status_code == 200
+        assert wait_until(lambda: other_worker.cache.get(str(user_id)) is None)
+    finally:
+        other_worker.close()
+    assert get_user_data(client, token) == 401
+
+class TestStaleness:
+    @pytest.fixture
+    def config(self, config) -> dict[str, any]:
+        return {**config, "TOKEN_REVOCATION_MAX_STALENESS": 0.5}
+
+    def test_revocations_missed_are_applied_after_the_staleness_limit(self, client, redis, user_id):
+        token = login(client, "alice")["access_token"]
+        assert get_user_data(client, token) == 200
+        redis.delete(RedisUtils.get_user_key(user_id))
+        assert get_user_data(client, token) == 200
+        time.sleep(0.6)
+        assert get_user_data(client, token) == 401
+
+# Invalidations may be missed while the subscriber is disconnected, so its cache is dropped
+def test_the_cache_is_cleared_when_the_subscriber_fails(app, client, redis, user_id):
+    token = login(client, "alice")["access_token"]
+    assert get_user_data(client, token) == 200
+    with app.app_context():
+        cache = RedisUtils.token_cache_invalidator().cache
+    assert cache.get(str(user_id)) is not None
+
+    redis.connection_pool.connection_kwargs["server"].connected = False
+    assert wait_until(lambda: cache.get(str(user_id)) is None, timeout = 3)